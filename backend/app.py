@@ -1,25 +1,55 @@
-import os, io, uuid, re, json, datetime as dt
+import os, uuid, re, json, time, hashlib, asyncio, tempfile, datetime as dt
 import logging
+from contextlib import suppress
+import multiprocessing
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Optional
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.datastructures import Headers, MutableHeaders
 from starlette.responses import Response, PlainTextResponse
-import pandas as pd
-
-# Optional deps
-try:
-    import docx  # python-docx
-except Exception:
-    docx = None
-try:
-    from PyPDF2 import PdfReader
-except Exception:
-    PdfReader = None
+from store import AppealStore, LIST_FIELDS
+from ingest import (
+    tokenize, sentiment_score, parse_path, ParseError,
+    PdfReader, PDF_MAX_PAGES, pdf_page_count, pdf_pages_text, pdf_rows,
+)
+from exports import EXPORT_FORMATS, open_export, export_media_type
+from appeals import AppealTable
+from filecache import FileCache
+from plans import make_plan_text, render_plan
+from geocode import load_gazetteer
+from httpcache import cached_json, file_response
+import metrics, profiler
 
 EXPORT_DIR = os.environ.get("EXPORT_DIR", "/data/exports")
 os.makedirs(EXPORT_DIR, exist_ok=True)
+# Kept outside EXPORT_DIR: that folder is served as downloads
+DB_PATH = os.environ.get("DB_PATH", "/data/db/appeals.sqlite3")
+
+# Upload parsing runs in worker processes so the event loop stays responsive.
+# PARSE_WORKERS=0 parses in the threadpool instead (dev/tests).
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PARSE_TIMEOUT = float(os.environ.get("PARSE_TIMEOUT", "600"))  # seconds per file
+UPLOAD_TMP_DIR = os.environ.get("UPLOAD_TMP_DIR") or None
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "16"))
+EXPORT_FORMAT = os.environ.get("EXPORT_FORMAT", "xlsx")  # default for uploads: xlsx | csv.gz | parquet
+# Exports and plan documents are rendered on first download and kept in EXPORT_DIR as an LRU cache
+EXPORT_CACHE_MAX_MB = float(os.environ.get("EXPORT_CACHE_MAX_MB", "1024"))
+EXPORT_CACHE_TTL = float(os.environ.get("EXPORT_CACHE_TTL", str(7 * 24 * 3600)))  # seconds
+EXPORT_CACHE_SWEEP = float(os.environ.get("EXPORT_CACHE_SWEEP", "600"))           # seconds between sweeps
+# Local street gazetteer (CSV) for appeals that come without coordinates; no external geocoder
+GAZETTEER_PATH = os.environ.get("GAZETTEER_PATH", "")
+GEOCODE_CACHE_SIZE = int(os.environ.get("GEOCODE_CACHE_SIZE", "50000"))
+# Prometheus metrics at /api/metrics; with several uvicorn workers they are summed via snapshot files
+METRICS_FLUSH = float(os.environ.get("METRICS_FLUSH", "15"))  # seconds between snapshots
+METRICS_DIR = os.environ.get("METRICS_DIR") or (
+    os.path.join(os.path.dirname(DB_PATH), "metrics") if int(os.environ.get("WEB_CONCURRENCY", "1")) > 1 else "")
+# Sampling profiler: requests with the header "X-Profile: <PROFILE_TOKEN>" are profiled; off when empty
+PROFILE_TOKEN = os.environ.get("PROFILE_TOKEN", "")
+PROFILE_DIR = os.environ.get("PROFILE_DIR") or os.path.join(os.path.dirname(DB_PATH), "profiles")
 
 app = FastAPI(title="AI-ДОВЕРИЕ API", version="1.0")
 
@@ -63,613 +93,605 @@ MUNICIPALITIES = [
     {"id":4,"name":"Люберцы"},
 ]
 
-KEYWORDS = {
-    "Благоустройство": ["дворы","освещение","урны","лавочки","парк","сквер","уборка","детская площадка","озеленение","благоустройство"],
-    "Окружающая среда": ["экология","свалка","запах","дым","выбросы","река","водоём","шум","окружающая среда","природа"],
-    "Доступность цифровых услуг": ["госуслуги","интернет","цифров","сайт","онлайн","мфц запись","портал"],
-    "Дороги": ["дорога","ямы","ремонт дороги","асфальт","яма","бордюр","разметка","снег","уборка снега","тротуар"],
-    "Образование": ["школа","детсад","садик","учитель","образование","лицей","гимназия"],
-    "Культура": ["культура","дом культуры","библиотека","музей","концерт"],
-    "Здравоохранение": ["поликлиника","больница","врач","медицина","здравоохранение","скорая"],
-    "Транспортное обслуживание": ["автобус","маршрут","транспорт","расписание","остановка","электричка","метро"],
-    "ЖКХ": ["жкх","квартира","подъезд","управляющая компания","счетчик","отопление","вода","горячая вода","холодная вода","электричество","лифт"],
-    "Адаптация участников СВО": ["СВО","ветеран","реабилитация","поддержка","пособие"],
-    "Политическое доверие": ["мэр","глава","администрация","власть","политика","доверие"]
-}
-
-def guess_category(text:str)->str:
-    t = text.lower()
-    best = None; score = 0
-    for cat, kws in KEYWORDS.items():
-        s = sum(1 for w in kws if w in t)
-        if s>score: score=s; best=cat
-    return best or "ЖКХ"
-
-DATE_RE = re.compile(r"(20\d{2}[-./]\d{1,2}[-./]\d{1,2}|\d{1,2}[-./]\d{1,2}[-./]20\d{2})")
-ADDR_RE = re.compile(r"(ул\.\s*[А-ЯЁа-яёA-Za-z0-9\- ]+|проспект\s+[А-ЯЁа-яёA-Za-z\- ]+|дом\s*\d+[А-Яа-яA-Za-z]?)")
-
-
-DOBRODEL_STATUS_ALLOW = {
-    "в работе исполнителя",
-    "на исполнении",
-    "на уточнении модератора",
-}
-
-def parse_dobrodel_excel(upload: UploadFile):
-    """Return list of normalized rows from a Добродел выгрузка, or None if not applicable.
-    Each row: source,date,address,text,category,lat,lng,municipality_id(None for now)"""
+from fastapi import Request
+
+@app.get("/api/appeals/municipalities")
+def municipalities(request: Request):
+    # static list: the ETag is its content hash
+    return cached_json(request, f'"m-{content_key(MUNICIPALITIES)}"', lambda: {"items": MUNICIPALITIES})
+
+_pool = None
+
+def parse_pool():
+    global _pool
+    if _pool is None and PARSE_WORKERS > 0:
+        # spawn: workers import only ingest.py, never this module's app/store state
+        _pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+@app.on_event("shutdown")
+def _shutdown_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+async def run_parse_job(fn, *args, file_type:Optional[str]=None):
+    """Run a blocking parse/export call off the event loop, bounded by PARSE_TIMEOUT.
+
+    With file_type, the stages fn went through (metrics.stage) are recorded for that file type.
+    """
+    if file_type:
+        fn, args = metrics.collect, (fn, *args)
+    pool = parse_pool()
+    if pool is not None:
+        fut = asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    else:
+        fut = run_in_threadpool(fn, *args)
+    res = await asyncio.wait_for(fut, PARSE_TIMEOUT)
+    if file_type:
+        res, timings = res
+        for name, seconds in timings:
+            metrics.INGEST_STAGE.observe(seconds, name, file_type)
+    return res
+
+FILE_TYPES = ("xlsx", "xls", "csv", "tsv", "pdf", "docx", "doc", "txt")
+
+def file_type(filename:Optional[str]) -> str:
+    """Metrics label for an uploaded file."""
+    ext = os.path.splitext(filename or "")[1].lower().lstrip(".")
+    return ext if ext in FILE_TYPES else "other"
+
+MAX_UPLOAD_FILE_MB = float(os.environ.get("MAX_UPLOAD_FILE_MB", "200"))
+MAX_UPLOAD_REQUEST_MB = float(os.environ.get("MAX_UPLOAD_REQUEST_MB", "500"))
+SPOOL_CHUNK = 1 << 20
+
+def _spool_to_disk(f: UploadFile, budget:int):
+    """Copy an upload to a temp file in chunks, hashing as it goes.
+
+    Returns (path, sha256, size). `budget` is what is left of the per-request limit.
+    """
+    limit = min(int(MAX_UPLOAD_FILE_MB * 1024 * 1024), budget)
+    fd, path = tempfile.mkstemp(prefix="upload_", dir=UPLOAD_TMP_DIR)
+    h, size = hashlib.sha256(), 0
     try:
-        xls = pd.ExcelFile(upload.file)
-        # choose sheet that has typical columns
-        target_sheet = None
-        for s in xls.sheet_names:
-            cols = [str(c).strip().lower() for c in xls.parse(s, nrows=1).columns]
-            if ("омсу" in cols) and (("статус" in cols) or any("статус" in c for c in cols)):
-                target_sheet = s
-                break
-        if not target_sheet:
-            return None
-        df = xls.parse(target_sheet)
-        # normalize columns
-        cols_map = {str(c).strip().lower(): c for c in df.columns}
-        def pick(*variants):
-            for v in variants:
-                v_low = v.lower()
-                if v_low in cols_map: return cols_map[v_low]
-                # fuzzy contains match
-                for k in cols_map:
-                    if v_low in k: return cols_map[k]
-            return None
-
-        col_omcu = pick("ОМСУ")
-        col_status = pick("Статус")
-        col_source = pick("Источник")
-        col_date = pick("Дата обращения","Дата (первого взятия в работу)","Дата")
-        col_address = pick("Адрес")
-        col_fact = pick("Факт")
-        col_descr = pick("Описание")
-
-        if not (col_omcu and col_status and (col_fact or col_descr) and col_address):
-            # not a recognizable layout
-            return None
-
-        df2 = df.copy()
-        # filter OМСУ содержит Люберцы
-        df2 = df2[df2[col_omcu].astype(str).str.contains("Люберц", case=False, na=False)]
-        # filter statuses
-        df2 = df2[df2[col_status].astype(str).str.strip().str.lower().isin(DOBRODEL_STATUS_ALLOW)]
-        if df2.empty:
-            return []
-
-        # build rows
-        rows = []
-        for _, r in df2.iterrows():
-            src = str(r.get(col_source, "Добродел") or "Добродел")
-            date_val = r.get(col_date, None)
-            # normalize date to yyyy-mm-dd
-            date_str = None
-            if pd.notna(date_val):
-                try:
-                    date_parsed = pd.to_datetime(date_val)
-                    date_str = str(date_parsed.date())
-                except Exception:
-                    date_str = str(date_val)[:10]
-            address = str(r.get(col_address, "") or "").strip() or None
-            text_parts = []
-            if col_fact: 
-                v = r.get(col_fact, None)
-                if pd.notna(v): text_parts.append(str(v))
-            if col_descr:
-                v = r.get(col_descr, None)
-                if pd.notna(v): text_parts.append(str(v))
-            text = "\n".join(text_parts).strip()
-            cat = guess_category(text or "")
-            # naive geotag placeholder: none (could be enhanced later)
-            lat_val, lng_val = detect_coords_from_row(r)
-            rows.append({
-                "source": src,
-                "date": date_str,
-                "address": address,
-                "text": text,
-                "category": cat,
-                "lat": lat_val,
-                "lng": lng_val,
-                "municipality_id": None
-            })
-        return rows
-    except Exception as e:
-        # If anything goes wrong, fall back to generic extraction
-        return None
-def extract_text_from_file(up: UploadFile) -> str:
-    name = up.filename or "file"
-    if name.lower().endswith((".xlsx",".xls",".csv")):
-        try:
-            if name.lower().endswith(".csv"):
-                df = pd.read_csv(up.file)
-            else:
-                df = pd.read_excel(up.file)
-            cols = [c.lower() for c in df.columns]
-            text_cols = [i for i,c in enumerate(cols) if any(x in c for x in ["текст","сообщ","опис","обращ","post","message"])]
-            if text_cols:
-                return "\n".join(str(x) for x in df.iloc[:, text_cols[0]].astype(str).tolist())
-            else:
-                return df.to_csv(index=False)
-        except Exception as e:
-            return f"Не удалось прочитать таблицу: {e}"
-    if name.lower().endswith((".doc",".docx")) and docx:
-        try:
-            d = docx.Document(up.file)
-            return "\n".join(p.text for p in d.paragraphs)
-        except Exception as e:
-            return f"Не удалось прочитать DOCX: {e}"
-    if name.lower().endswith(".pdf") and PdfReader:
-        try:
-            r = PdfReader(up.file)
-            texts = []
-            for p in r.pages:
-                texts.append(p.extract_text() or "")
-            return "\n".join(texts)
-        except Exception as e:
-            return f"Не удалось прочитать PDF: {e}"
-    # fallback
-    b = up.file.read()
+        with os.fdopen(fd, "wb") as out:
+            f.file.seek(0)
+            while True:
+                chunk = f.file.read(SPOOL_CHUNK)
+                if not chunk: break
+                size += len(chunk)
+                if size > limit:
+                    raise HTTPException(413, f"Файл {f.filename} превышает допустимый размер загрузки")
+                h.update(chunk)
+                out.write(chunk)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, h.hexdigest(), size
+
+async def _spool_all(files: List[UploadFile]) -> list:
+    """[(path, filename, sha256)] for all files, enforcing per-file and per-request size limits."""
+    spooled, budget = [], int(MAX_UPLOAD_REQUEST_MB * 1024 * 1024)
+    try:
+        for f in files:
+            with metrics.INGEST_STAGE.time("spool", file_type(f.filename)):
+                path, digest, size = await run_in_threadpool(_spool_to_disk, f, budget)
+            budget -= size
+            spooled.append((path, f.filename, digest))
+    except BaseException:
+        for p, _, _ in spooled: os.unlink(p)
+        raise
+    return spooled
+
+async def _gather_or_cancel(*aws) -> list:
+    """asyncio.gather that, when one awaitable fails or the caller is cancelled, cancels the
+    others and waits for them, so none is still using (or about to unlink) a spooled file."""
+    tasks = [asyncio.ensure_future(a) for a in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+async def _parse_spooled(path:str, filename:str) -> AppealTable:
+    try:
+        return await run_parse_job(parse_path, path, filename, file_type=file_type(filename))
+    except ParseError as e:
+        raise HTTPException(400, str(e))
+    except asyncio.TimeoutError:
+        raise HTTPException(504, f"Превышено время обработки файла {filename}")
+    finally:
+        os.unlink(path)
+
+async def _parse_pdf_spooled(path:str, filename:str) -> AppealTable:
+    """PDFs: page ranges are extracted in parallel across the parse pool, then merged in page order."""
     try:
-        return b.decode("utf-8")
+        n = min(await run_parse_job(pdf_page_count, path, file_type="pdf"), PDF_MAX_PAGES)
     except Exception:
-        return b.decode("latin-1","ignore")
-
-def extract_fields(text:str, source:str):
-    date_match = DATE_RE.search(text)
-    date = None
-    if date_match:
-        raw = date_match.group(0).replace('/','-').replace('.','-')
-        parts = raw.split('-')
-        if len(parts[0])==4:
-            date = raw
+        # unreadable/encrypted: the generic path turns it into a "Не удалось прочитать PDF" appeal
+        return await _parse_spooled(path, filename)
+    try:
+        ranges = [(i, min(i + PDF_PAGES_PER_TASK, n)) for i in range(0, n, PDF_PAGES_PER_TASK)]
+        chunks = await _gather_or_cancel(*(run_parse_job(pdf_pages_text, path, a, b, file_type="pdf") for a, b in ranges))
+        return await run_parse_job(pdf_rows, [p for c in chunks for p in c], filename, file_type="pdf")
+    except asyncio.TimeoutError:
+        raise HTTPException(504, f"Превышено время обработки файла {filename}")
+    finally:
+        os.unlink(path)
+
+def content_key(*parts) -> str:
+    """Stable name for a rendered file, derived from what it is rendered from."""
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False).encode()).hexdigest()[:32]
+
+async def ingest_spooled(spooled:list, municipality_id:Optional[int], origin:str, job:Optional[dict]=None,
+                         export_format:str="xlsx") -> dict:
+    """Parse spooled (path, filename, sha256) files and store the rows.
+
+    Files are parsed in parallel, then stored one by one in upload order. A file whose content was
+    already ingested for this municipality is not parsed: its stored rows are reused.
+    The export is only registered here (keyed by the file hashes) and rendered on first
+    download. Returns a summary; the rows themselves are browsed via GET /api/appeals.
+    `job` (if given) gets progress updates.
+    """
+    def stage(name):
+        if job is not None: job["stage"] = name
+
+    batch_id = str(uuid.uuid4())
+    cached = []
+
+    async def load(path, filename, digest):
+        """(AppealTable, None, size) for a new file, (None, category counts, size) for an already ingested one."""
+        size = os.path.getsize(path)
+        with metrics.INGEST_STAGE.time("dedupe", file_type(filename)):
+            found = await run_in_threadpool(STORE.find_upload, digest, municipality_id)
+        if found:
+            os.unlink(path)
+            return None, await run_in_threadpool(STORE.upload_category_counts, digest, municipality_id), size
+        with metrics.INGEST_STAGE.time("parse", file_type(filename)):  # wall time, including the wait for a pool worker
+            if PdfReader and (filename or "").lower().endswith(".pdf"):
+                return await _parse_pdf_spooled(path, filename), None, size
+            return await _parse_spooled(path, filename), None, size
+
+    async def store(filename, digest, loaded, t) -> Counter:
+        ftype = file_type(filename)
+        items, counts, size = loaded
+        if items is None:
+            cached.append(filename)
+            metrics.INGEST_FILES.inc(ftype, "cached")
+        else:
+            items.set_municipality(municipality_id)
+            if GEOCODER is not None:
+                with metrics.INGEST_STAGE.time("geocode", ftype):
+                    await run_in_threadpool(GEOCODER.fill, items, municipality_id)
+            with metrics.INGEST_STAGE.time("store", ftype):
+                await run_in_threadpool(STORE.append, items, batch_id=batch_id, file_hash=digest,
+                                        filename=filename, municipality_id=municipality_id)
+            counts = Counter()
+            for c, n in items.counts("category").items():
+                counts[c or "—"] += n
+            seconds = max(time.perf_counter() - t, 1e-9)
+            metrics.INGEST_FILES.inc(ftype, "parsed")
+            metrics.INGEST_FILE_SECONDS.observe(seconds, ftype)
+            metrics.INGEST_ROWS.inc(ftype, amount=len(items))
+            metrics.INGEST_BYTES.inc(ftype, amount=size)
+            metrics.INGEST_ROWS_RATE.observe(len(items) / seconds, ftype)
+            metrics.INGEST_BYTES_RATE.observe(size / seconds, ftype)
+        if job is not None:
+            job["files_done"] += 1
+            job["rows"] += sum(counts.values())
+            await _save_job(job)
+        return counts
+
+    stage("parsing")
+    # identical files within one request are ingested once
+    unique, seen = [], set()
+    for p, n, d in spooled:
+        if d in seen:
+            os.unlink(p)
+            cached.append(n)
         else:
-            # dd-mm-yyyy
-            d,m,y = parts
-            date = f"{y}-{m.zfill(2)}-{d.zfill(2)}"
-    addr_match = ADDR_RE.search(text)
-    address = addr_match.group(0) if addr_match else None
-    category = guess_category(text)
-    lat, lng = detect_coords_from_text((text or "") + " " + (address or ""))
+            seen.add(d)
+            unique.append((p, n, d))
+    if job is not None:
+        job["files_done"] += len(spooled) - len(unique)
+        await _save_job(job)
+    # parse in parallel, then store one file at a time in upload order, so row ids follow the upload
+    t = time.perf_counter()
+    loaded = await _gather_or_cancel(*(load(p, n, d) for p, n, d in unique))
+    parsed = [await store(n, d, res, t) for (_, n, d), res in zip(unique, loaded)]
+    by_category = sum(parsed, Counter())
+
+    digests = [d for _, _, d in unique]
+    key = content_key("export", municipality_id or 0, digests)
+    await run_in_threadpool(STORE.save_document, key, "export", {"municipality_id": municipality_id, "files": digests})
+    stage("done")
+    ext = EXPORT_FORMATS[export_format][1]
     return {
-        "source": source,
-        "date": date,
-        "address": address,
-        "text": text.strip()[:5000],
-        "category": category,
-        "lat": lat, "lng": lng,
+        "batch_id": batch_id,
+        "rows": sum(by_category.values()),
+        "by_category": dict(by_category.most_common()),
+        "files": [{"name": n, "rows": sum(c.values())} for (_, n, _), c in zip(unique, parsed)],
+        "export_url": f"{origin}/api/appeals/export/{key}.{ext}",
+        "cached_files": cached,
     }
 
-# In-memory "DB"
-
-# --- Geotag detection helpers ---
-COORD_DD_RE = re.compile(r'(?P<lat>[+-]?\d{1,2}(?:[.,]\d+))\s*[,; ]\s*(?P<lng>[+-]?\d{1,3}(?:[.,]\d+))')
-DMS_RE = re.compile(r'(?:(?P<lat_deg>\d{1,2})[°\s]\s*(?P<lat_min>\d{1,2})(?:[\'’′]\s*(?P<lat_sec>\d{1,2}(?:[.,]\d+))?)?\s*(?P<lat_hem>[NSСЮСеверЮж])\s*[,; ]\s*)?(?P<lng_deg>\d{1,3})[°\s]\s*(?P<lng_min>\d{1,2})(?:[\'’′]\s*(?P<lng_sec>\d{1,2}(?:[.,]\d+))?)?\s*(?P<lng_hem>[EWЗВВостЗап])', re.IGNORECASE)
-
-def _dms_to_dd(deg, minutes, seconds, hemisphere):
-    deg = float(str(deg).replace(',', '.'))
-    minutes = float(str(minutes).replace(',', '.')) if minutes is not None else 0.0
-    seconds = float(str(seconds).replace(',', '.')) if seconds is not None else 0.0
-    dd = deg + minutes/60.0 + seconds/3600.0
-    if hemisphere and str(hemisphere).upper() in ['S','W','З','Ю']:
-        dd = -dd
-    return dd
-
-def detect_coords_from_text(text: str):
-    if not text:
-        return (None, None)
-    t = str(text)
-    m = COORD_DD_RE.search(t)
-    if m:
-        try:
-            lat = float(m.group('lat').replace(',', '.'))
-            lng = float(m.group('lng').replace(',', '.'))
-            if -90 <= lat <= 90 and -180 <= lng <= 180:
-                return (lat, lng)
-        except Exception:
-            pass
-    m = DMS_RE.search(t)
-    if m:
-        try:
-            lat = None
-            if m.group('lat_deg') is not None:
-                lat = _dms_to_dd(m.group('lat_deg'), m.group('lat_min'), m.group('lat_sec'), m.group('lat_hem') or 'N')
-            lng = _dms_to_dd(m.group('lng_deg'), m.group('lng_min'), m.group('lng_sec'), m.group('lng_hem') or 'E')
-            return (lat, lng)
-        except Exception:
-            pass
-    return (None, None)
-
-def detect_coords_from_row(row: dict):
-    # Try explicit lat/lng columns
-    for key in list(row.keys()):
-        k = (str(key) or '').strip().lower()
-        if k in ('lat', 'latitude', 'широта', 'y'):
-            val = row.get(key)
-            if val not in (None, ''):
-                try:
-                    lat = float(str(val).replace(',', '.'))
-                except Exception:
-                    continue
-                for kk in list(row.keys()):
-                    k2 = (str(kk) or '').strip().lower()
-                    if k2 in ('lng', 'lon', 'long', 'longitude', 'долгота', 'x'):
-                        v2 = row.get(kk)
-                        if v2 not in (None, ''):
-                            try:
-                                lng = float(str(v2).replace(',', '.'))
-                                return (lat, lng)
-                            except Exception:
-                                pass
-    # Fallback: detect inside text/address
-    joined = " ".join(str(row.get(k) or '') for k in row.keys())
-    return detect_coords_from_text(joined)
-DB = {
-    "rows": [],
-    "plans": [],
-}
+# --- Background upload jobs: bounded queue, fixed number of consumers ---
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "8"))
+JOBS_KEEP = 200          # finished jobs remembered for polling
 
-@app.get("/api/appeals/municipalities")
-def municipalities():
-    return {"items": MUNICIPALITIES}
+# jobs queued in this process; their states are also saved to the store for the other workers
+JOBS = OrderedDict()
+_job_queue = None
 
-from fastapi import Request
-
-@app.post("/api/appeals/upload")
+async def _save_job(job:dict, keep:Optional[int]=None):
+    try:
+        await run_in_threadpool(STORE.save_job, dict(job), keep)
+    except Exception:
+        logger.exception(f"Saving upload job {job['id']} failed")
+
+def _ensure_job_workers():
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+        for _ in range(JOB_WORKERS):
+            asyncio.create_task(_job_worker(_job_queue))
+    return _job_queue
+
+def _drop_spooled(spooled:list):
+    """Remove what is left of a failed upload's spooled files (parsed ones are already gone)."""
+    for p, _, _ in spooled:
+        with suppress(FileNotFoundError):
+            os.unlink(p)
+
+async def _job_worker(queue):
+    while True:
+        job, spooled, municipality_id, origin, export_format = await queue.get()
+        job["status"] = "running"
+        await _save_job(job)
+        try:
+            res = await ingest_spooled(spooled, municipality_id, origin, job=job, export_format=export_format)
+            job.update(res)
+            job["status"] = "done"
+        except asyncio.CancelledError:
+            # shutdown: the stored state is shared by all workers, so it must not stay "running"
+            job["status"], job["stage"] = "error", "error"
+            job["error"] = "Обработка прервана остановкой сервера, загрузите файлы снова"
+            _drop_spooled(spooled)
+            raise
+        except Exception as e:
+            logger.exception(f"Upload job {job['id']} failed")
+            job["status"], job["stage"] = "error", "error"
+            job["error"] = e.detail if isinstance(e, HTTPException) else str(e)
+            _drop_spooled(spooled)
+        finally:
+            job["finished_at"] = dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            queue.task_done()
+            while len(JOBS) > JOBS_KEEP:
+                JOBS.popitem(last=False)
+            await _save_job(job, keep=JOBS_KEEP)
 
 @app.post("/api/appeals/upload")
-async def upload_appeals(request: Request, files: List[UploadFile] = File(...), municipality_id: Optional[int] = Form(None)):
+async def upload_appeals(request: Request, files: List[UploadFile] = File(...), municipality_id: Optional[int] = Form(None),
+                         job: bool = False, export_format: Optional[str] = Form(None)):
     if not files:
         raise HTTPException(400, "Файлы не переданы")
-    rows = []
-    for f in files:
-        # Try special Добродел parser for Excel
-        parsed = None
-        name = (f.filename or '').lower()
-        if name.endswith(('.xlsx','.xls')):
-            parsed = parse_dobrodel_excel(f)
-            f.file.seek(0)
-        if isinstance(parsed, list):
-            for item in parsed:
-                item['municipality_id'] = municipality_id
-            rows.extend(parsed)
-        else:
-            # Fallback: treat whole file as one text blob
-            text = extract_text_from_file(f)
-            fields = extract_fields(text, f.filename)
-            fields["municipality_id"] = municipality_id
-            rows.append(fields)
-    DB["rows"].extend(rows)
-
-    df = pd.DataFrame(rows, columns=["source","date","address","text","category","lat","lng","municipality_id"])
-    export_id = str(uuid.uuid4())
-    xlsx_path = os.path.join(EXPORT_DIR, f"{export_id}.xlsx")
-    df.to_excel(xlsx_path, index=False)
-
+    export_format = export_format or EXPORT_FORMAT
+    if export_format not in EXPORT_FORMATS:
+        raise HTTPException(400, f"Неподдерживаемый формат выгрузки: {export_format}. Доступны: {', '.join(EXPORT_FORMATS)}")
     origin = str(request.base_url).rstrip('/')
-    return {"items": rows, "export_url": f"{origin}/api/appeals/export/{export_id}.xlsx"}
+    if job:
+        queue = _ensure_job_workers()
+        if queue.full():
+            raise HTTPException(429, "Очередь обработки загрузок заполнена, повторите позже")
+    # UploadFile objects close with the request, so spool before handing off
+    spooled = await _spool_all(files)
+    if not job:
+        try:
+            return await ingest_spooled(spooled, municipality_id, origin, export_format=export_format)
+        except BaseException:
+            _drop_spooled(spooled)
+            raise
+
+    job_id = str(uuid.uuid4())
+    item = {
+        "id": job_id, "status": "queued", "stage": "queued",
+        "files_total": len(spooled), "files_done": 0, "rows": 0,
+        "export_url": None, "error": None,
+        "created_at": dt.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), "finished_at": None,
+    }
+    JOBS[job_id] = item
+    await _save_job(item)
+    try:
+        queue.put_nowait((item, spooled, municipality_id, origin, export_format))
+    except asyncio.QueueFull:
+        JOBS.pop(job_id, None)
+        _drop_spooled(spooled)
+        item["status"], item["stage"], item["error"] = "error", "error", "Очередь обработки загрузок заполнена"
+        await _save_job(item)
+        raise HTTPException(429, "Очередь обработки загрузок заполнена, повторите позже")
+    return JSONResponse({"job_id": job_id, "status_url": f"{origin}/api/appeals/jobs/{job_id}", "job": item},
+                        status_code=202)
+
+LIST_DEFAULT_LIMIT, LIST_MAX_LIMIT = 50, 500
+
+@app.get("/api/appeals")
+def list_appeals(request: Request, municipality_id: Optional[int] = None, category: Optional[str] = None,
+                 source: Optional[str] = None, date_from: Optional[dt.date] = None, date_to: Optional[dt.date] = None,
+                 batch_id: Optional[str] = None, fields: Optional[str] = None, limit: int = LIST_DEFAULT_LIMIT,
+                 cursor: Optional[str] = None):
+    """Stored appeals, newest first. `next_cursor` of a page is passed as `cursor` for the next one."""
+    cols = [f.strip() for f in fields.split(",") if f.strip()] if fields else LIST_FIELDS
+    unknown = [f for f in cols if f not in LIST_FIELDS]
+    if unknown:
+        raise HTTPException(400, f"Неизвестные поля: {', '.join(unknown)}. Доступны: {', '.join(LIST_FIELDS)}")
+    if not 1 <= limit <= LIST_MAX_LIMIT:
+        raise HTTPException(400, f"limit должен быть от 1 до {LIST_MAX_LIMIT}")
+    try:
+        before = int(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(400, "Некорректный cursor")
+
+    def build():
+        items = STORE.list_appeals(cols, limit + 1, before, municipality_id, category, source,
+                                   date_from and date_from.isoformat(), date_to and date_to.isoformat(), batch_id)
+        more = len(items) > limit
+        items = items[:limit]
+        return {"items": items, "next_cursor": str(items[-1]["id"]) if more else None}
+    return cached_json(request, f'"l-{STORE.data_version()}"', build)
+
+SEARCH_MAX_LIMIT = 100
+
+@app.get("/api/appeals/search")
+def search_appeals(request: Request, q: str, municipality_id: Optional[int] = None, category: Optional[str] = None,
+                   fields: Optional[str] = None, limit: int = 20, offset: int = 0):
+    """Full-text search over appeal texts and addresses, best matches first."""
+    cols = [f.strip() for f in fields.split(",") if f.strip()] if fields else LIST_FIELDS
+    unknown = [f for f in cols if f not in LIST_FIELDS]
+    if unknown:
+        raise HTTPException(400, f"Неизвестные поля: {', '.join(unknown)}. Доступны: {', '.join(LIST_FIELDS)}")
+    if not 1 <= limit <= SEARCH_MAX_LIMIT or offset < 0:
+        raise HTTPException(400, f"limit должен быть от 1 до {SEARCH_MAX_LIMIT}, offset — не меньше 0")
+    return cached_json(request, f'"s-{STORE.data_version()}"',
+                       lambda: {"items": STORE.search(q, cols, limit, offset, municipality_id, category)})
+
+@app.get("/api/appeals/jobs/{job_id}")
+def get_job(job_id:str):
+    # a job queued by another worker process is read from the store
+    job = JOBS.get(job_id) or STORE.get_job(job_id)
+    if not job:
+        raise HTTPException(404, "Задача не найдена")
+    return job
+
+def _export_renderer(key:str, fmt:str):
+    doc = STORE.get_document(key)
+    if not doc or doc[0] != "export":
+        return None
+    params = doc[1]
+
+    def render(path):
+        with metrics.RENDER_SECONDS.time("export", fmt):
+            w = open_export(path, fmt)
+            try:
+                for digest in params["files"]:
+                    for chunk in STORE.iter_upload_rows(digest, params["municipality_id"]):
+                        w.write(chunk)
+                w.close()
+            except BaseException:
+                w.abort()
+                raise
+    return render
 
 @app.get("/api/appeals/export/{file_name}")
-def export_file(file_name:str):
-    path = os.path.join(EXPORT_DIR, file_name)
-    if not os.path.exists(path):
+def export_file(file_name:str, request: Request):
+    media_type = export_media_type(file_name)
+    if not media_type:
         raise HTTPException(404, "Файл не найден")
-    return FileResponse(path, filename=file_name, media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    key, fmt = file_name.split(".", 1)
+    # files from before lazy exports have no document record and are served as is
+    path = CACHE.get(file_name, _export_renderer(key, fmt))
+    if not path:
+        raise HTTPException(404, "Файл не найден")
+    return file_response(request, path, file_name, media_type)
 
 # === Analytics helpers and endpoint ===
-RU_STOP = set("и,в,во,не,что,он,на,я,с,со,как,а,то,все,она,так,его,но,да,ты,к,у,же,вы,за,бы,по,ее,мне,есть,тут,они,мы,тебя,ничего,чтобы,когда,где,даже,или,если,без,из,под,при,для,над,про,после,между,это,этот,эта,эти,того,той,тем,теми,тех,та,тут,там,быть,будет,был,были,будут,же,ли,до,от,ну".split(","))
-
-POS_WORDS = set("хорошо,исправили,починили,спасибо,благодарим,улучшили,решено,устранено".split(","))
-NEG_WORDS = set("плохо,ужас,проблема,жалоба,не работает,сломано,грязь,мусор,яма,вонь,шум,некачественно,затопило,отсутствует,протечка,нет,нарушение".split(","))
-
-def sentiment_score(text:str)->float:
-    t = (text or '').lower()
-    score = 0
-    for w in POS_WORDS:
-        if w in t: score += 1
-    for w in NEG_WORDS:
-        if w in t: score -= 1
-    return 1.0 if score>0 else (-1.0 if score<0 else 0.0)
-
-def top_tokens(texts:List[str], topn:int=5)->List[str]:
-    from collections import Counter
-    cnt = Counter()
-    for t in texts:
-        words = re.findall(r"[А-ЯЁа-яёA-Za-z0-9\-]{3,}", (t or "").lower())
-        for w in words:
-            if w in RU_STOP: continue
-            cnt[w]+=1
-    return [w for w,_ in cnt.most_common(topn)]
+
+STORE = AppealStore(DB_PATH, tokenize=tokenize, sentiment=sentiment_score)
+GEOCODER = load_gazetteer(GAZETTEER_PATH, GEOCODE_CACHE_SIZE)
+CACHE = FileCache(EXPORT_DIR, int(EXPORT_CACHE_MAX_MB * 1024 * 1024), EXPORT_CACHE_TTL)
+
+async def _sweep_loop():
+    while True:
+        await asyncio.sleep(EXPORT_CACHE_SWEEP)
+        try:
+            removed = await run_in_threadpool(CACHE.sweep)
+            if removed:
+                logger.info(f"Export cache: removed {removed} files")
+            if PROFILE_TOKEN:
+                await run_in_threadpool(profiler.prune, PROFILE_DIR, EXPORT_CACHE_TTL)
+        except Exception:
+            logger.exception("Export cache sweep failed")
+
+@app.on_event("startup")
+async def _start_cache_sweeper():
+    asyncio.create_task(_sweep_loop())
+
+async def _metrics_loop():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH)
+        try:
+            await run_in_threadpool(metrics.write_snapshot, METRICS_DIR)
+        except Exception:
+            logger.exception("Metrics snapshot failed")
+
+@app.on_event("startup")
+async def _start_metrics_snapshots():
+    if METRICS_DIR:
+        asyncio.create_task(_metrics_loop())
+
+DATE_GRANULARITIES = ("day", "week", "month")
+# upper bound on by_date points; older buckets are cut off (truncated=true)
+ANALYTICS_MAX_POINTS = int(os.environ.get("ANALYTICS_MAX_POINTS", "400"))
+
+def auto_granularity(first:Optional[str], last:Optional[str]) -> str:
+    """Day for up to a quarter, week for up to two years, month beyond; ISO dates (see STORE.date_span)."""
+    if not first or not last:
+        return "day"  # no dated rows
+    days = (dt.date.fromisoformat(last) - dt.date.fromisoformat(first)).days
+    return "day" if days <= 92 else "week" if days <= 731 else "month"
 
 @app.get("/api/appeals/analytics")
-def analytics(municipality_id: Optional[int] = None):
-    df = pd.DataFrame(DB["rows"] or [], columns=["source","date","address","text","category","lat","lng","municipality_id"])
-    if municipality_id:
-        df = df[df["municipality_id"]==municipality_id]
-    if df.empty:
-        return {"by_category": [], "by_date": [], "per_category": []}
-
-    vc = df["category"].fillna("—").astype(str).value_counts()
-    by_cat_df = vc.rename_axis("name").reset_index(name="value")
-    by_cat = [{"name": str(r["name"]), "value": int(r["value"])} for _, r in by_cat_df.iterrows()]
-
-    df2 = df.copy()
-    df2["date"] = df2["date"].fillna("").astype(str).str.slice(0,10).replace({"": "—"})
-    vc2 = df2["date"].value_counts()
-    by_date_df = vc2.rename_axis("date").reset_index(name="count")
-    by_date = [{"date": str(r["date"]), "count": int(r["count"])} for _, r in by_date_df.iterrows()]
-    by_date = sorted(by_date, key=lambda x: x["date"])
+def analytics(request: Request, municipality_id: Optional[int] = None, date_from: Optional[dt.date] = None,
+              date_to: Optional[dt.date] = None, granularity: Optional[str] = None, category: Optional[str] = None):
+    if granularity not in (None, "auto", *DATE_GRANULARITIES):
+        raise HTTPException(400, f"Неподдерживаемая детализация: {granularity}. Доступны: auto, {', '.join(DATE_GRANULARITIES)}")
+    if date_from and date_to and date_from > date_to:
+        raise HTTPException(400, "Начало периода позже его конца")
+    d_from, d_to = (d.isoformat() if d else None for d in (date_from, date_to))
+    # the ETag changes with every ingest, so an unchanged dashboard revalidates with a 304
+    return cached_json(request, f'"a-{STORE.data_version()}"',
+                       lambda: analytics_payload(municipality_id, d_from, d_to, granularity, category))
+
+def analytics_payload(municipality_id:Optional[int], d_from:Optional[str], d_to:Optional[str],
+                      granularity:Optional[str], category:Optional[str]) -> dict:
+    # Served from running aggregates: O(categories + dates in the window), no text rescans
+    totals = STORE.category_totals(municipality_id, category, d_from, d_to)
+    if not totals:
+        return {"by_category": [], "by_date": [], "per_category": [], "granularity": granularity or "auto",
+                "truncated": False, "undated": 0}
+
+    if granularity in (None, "auto"):
+        first, last = STORE.date_span(municipality_id, category)
+        granularity = auto_granularity(d_from or first, d_to or last)
+    by_cat = [{"name": str(c), "value": n} for c, n, _, _ in sorted(totals, key=lambda x: -x[1])]
+    buckets = STORE.date_totals(municipality_id, category, d_from, d_to, granularity, limit=ANALYTICS_MAX_POINTS + 1)
+    undated = sum(n for b, n in buckets if b is None)
+    by_date = [{"date": b, "count": n} for b, n in buckets if b is not None]
+    truncated = len(by_date) > ANALYTICS_MAX_POINTS
+    by_date = by_date[-ANALYTICS_MAX_POINTS:]
 
     per_category = []
-    for cat, g in df.groupby("category"):
-        texts = g["text"].astype(str).tolist()
-        addr_counts = g["address"].dropna().astype(str).value_counts().rename_axis("address").reset_index(name="count")
-        hotspots = [{"address": a, "count": int(c)} for a,c in addr_counts.head(5).itertuples(index=False)]
-        topics = top_tokens(texts, topn=7)
-        s = sum(sentiment_score(t) for t in texts)
-        sentiment = round(s / max(1,len(texts)), 3)
+    for cat, n, s, uniq in totals:
+        hotspots = [{"address": a, "count": c} for a, c in STORE.hotspots(cat, municipality_id, 5, d_from, d_to)]
         per_category.append({
             "category": str(cat),
-            "count": int(len(g)),
-            "unique_texts": int(len(g)),
+            "count": n,
+            "unique_texts": uniq,
             "hotspots": hotspots,
-            "topics": topics,
-            "sentiment": sentiment
+            "topics": STORE.topics(cat, municipality_id, 7, d_from, d_to),
+            "sentiment": round(s / max(1, n), 3)
         })
 
-    return {"by_category": by_cat, "by_date": by_date, "per_category": per_category}
-def make_plan_text(category:str, municipality_name:str)->str:
-    today = dt.date.today()
-    deadline = today + dt.timedelta(days=30)
-    steps = [
-      ("Диагностика проблематики","Собрать первичные данные, верифицировать адресные точки, составить карту очагов."),
-      ("Быстрые победы (до 2 недель)","Отработать 2–3 адреса с высокой видимостью; подготовить фото «до/после»."),
-      ("Системные меры","Запланировать закупки/МКУ/подрядчики, согласовать сметы и графики."),
-      ("Коммуникации","План публикаций в соцсетях, встречи с жителями, ответы в комментариях."),
-      ("Контроль и KPI","Еженедельный отчёт, дашборд метрик, опрос удовлетворённости.")
-    ]
-    lines = [f"План действий на месяц — {category} — {municipality_name}",
-             f"Период: {today.strftime('%d.%m.%Y')} — {deadline.strftime('%d.%m.%Y')}",
-             "", "Цели:", "- Повышение доверия жителей", "- Снижение количества проблемных обращений", "", "Шаги:"]
-    for i,(t,d) in enumerate(steps, start=1):
-        lines.append(f"{i}. {t}: {d}")
-    lines.append("Ключевые KPI: закрытие 80% обращений в срок; рост позитивных упоминаний на 20%; ≥3 встречи с жителями.")
-    return "\n".join(lines)
-
-def write_docx(path:str, text:str):
-    try:
-        import docx
-        d = docx.Document()
-        for para in text.split("\n"):
-            d.add_paragraph(para)
-        d.save(path)
-        return True
-    except Exception:
-        return False
-
-def write_pdf(path:str, text:str):
-    try:
-        from reportlab.lib.pagesizes import A4
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.units import cm
-        from reportlab.pdfbase import pdfmetrics
-        from reportlab.pdfbase.ttfonts import TTFont
-        import os
-        # Locate a Unicode font with Cyrillic support (DejaVu Sans on most Linux images)
-        candidates = [
-            '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
-            '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf',
-            '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
-        ]
-        font_path = next((p for p in candidates if os.path.exists(p)), None)
-        if not font_path:
-            # Fallback: still attempt with default, but Cyrillic may not render
-            font_name = 'Helvetica'
-        else:
-            font_name = 'DejaVuSans'
-            try:
-                pdfmetrics.registerFont(TTFont(font_name, font_path))
-            except Exception:
-                font_name = 'Helvetica'
-        c = canvas.Canvas(path, pagesize=A4)
-        width, height = A4
-        c.setFont(font_name, 11)
-        left, top, bottom = 2*cm, height-2*cm, 2*cm
-        x, y = left, top
-        # Simple word-wrapping
-        for raw_line in (text or '').split('\\n'):
-            line = str(raw_line).replace('\\t','    ')
-            while line:
-                # measure characters that fit in line
-                n = len(line)
-                # naive wrap by characters
-                while n>0 and c.stringWidth(line[:n], font_name, 11) > (width - 2*cm - left):
-                    n -= 1
-                if n == 0:
-                    # force break to avoid infinite loop
-                    n = 1
-                c.drawString(x, y, line[:n])
-                line = line[n:].lstrip()
-                y -= 14
-                if y < bottom:
-                    c.showPage()
-                    c.setFont(font_name, 11)
-                    y = top
-        c.save()
-        return True
-    except Exception as e:
-        return False
-    except Exception:
-        return False
+    return {"by_category": by_cat, "by_date": by_date, "per_category": per_category,
+            "granularity": granularity, "truncated": truncated, "undated": undated}
 
 @app.get("/api/appeals/plans")
-def list_plans(municipality_id: Optional[int] = None):
-    items = DB["plans"]
-    if municipality_id:
-        items = [p for p in items if p["municipality_id"]==municipality_id]
-    return {"items": items[-50:]}
-
-@app.post("/api/appeals/generate-plan/{category}")
-async def generate_plan(category:str, payload: dict, request: Request):
-    municipality_id = payload.get("municipality_id")
-    muni = next((m for m in MUNICIPALITIES if m["id"]==municipality_id), {"name":"Муниципалитет"})
-    text = make_plan_text(category, muni["name"])
+def list_plans(request: Request, municipality_id: Optional[int] = None):
+    origin = str(request.base_url).rstrip('/')
+    # the items carry absolute file URLs, so the same data seen through another host is another body
+    return cached_json(request, f'"p-{STORE.data_version()}-{content_key(origin)[:8]}"',
+                       lambda: {"items": [_plan_item(p, origin) for p in STORE.plans(municipality_id, 50)]})
+
+PLAN_MEMO_SIZE = int(os.environ.get("PLAN_MEMO_SIZE", "256"))
+_plan_memo = OrderedDict()  # (category, municipality_id, date, fmt) -> rendered bytes
+
+def _muni_name(municipality_id) -> str:
+    return next((m["name"] for m in MUNICIPALITIES if m["id"]==municipality_id), "Муниципалитет")
+
+async def plan_document(category:str, municipality_id:Optional[int], date:str, fmt:str) -> bytes:
+    """Rendered plan, memoized: the text depends only on category, municipality and date."""
+    key = (category, municipality_id, date, fmt)
+    data = _plan_memo.get(key)
+    if data is not None:
+        _plan_memo.move_to_end(key)
+        return data
+    with metrics.RENDER_SECONDS.time("plan", fmt):
+        data = await run_parse_job(render_plan, category, _muni_name(municipality_id), date, fmt)
+    _plan_memo[key] = data
+    while len(_plan_memo) > PLAN_MEMO_SIZE:
+        _plan_memo.popitem(last=False)
+    return data
+
+async def _new_plan(category:str, municipality_id:Optional[int], origin:str) -> dict:
+    today = dt.date.today()
+    text = make_plan_text(category, _muni_name(municipality_id), today)
 
-    plan_id = str(uuid.uuid4())
-    docx_path = os.path.join(EXPORT_DIR, f"plan_{plan_id}.docx")
-    pdf_path  = os.path.join(EXPORT_DIR, f"plan_{plan_id}.pdf")
-    write_docx(docx_path, text)
-    write_pdf(pdf_path, text)
+    # documents are rendered on first download; same inputs -> same files
+    params = {"category": category, "municipality_id": municipality_id, "date": today.isoformat()}
+    key = content_key("plan", category, municipality_id, params["date"])
+    await run_in_threadpool(STORE.save_document, key, "plan", params)
 
-    origin = str(request.base_url).rstrip('/')
-    item = {
-      "id": plan_id,
+    plan = {
+      "id": str(uuid.uuid4()),
       "category": category,
       "municipality_id": municipality_id,
-      "municipality_name": muni["name"],
       "summary": text.splitlines()[0],
+      "doc_key": key,
       "created_at": dt.datetime.now().strftime("%Y-%m-%d %H:%M"),
-      "docx_url": f"{origin}/api/appeals/file/{os.path.basename(docx_path)}",
-      "pdf_url": f"{origin}/api/appeals/file/{os.path.basename(pdf_path)}",
     }
-    DB["plans"].append(item)
-    return {"ok": True, "item": item}
+    await run_in_threadpool(STORE.add_plan, plan)
+    return _plan_item(plan, origin)
 
-@app.get("/api/appeals/file/{name}")
-@app.get("/appeals/file/{name}")
-def get_any_file(name:str):
-    path = os.path.join(EXPORT_DIR, name)
-    if not os.path.exists(path): raise HTTPException(404, "Файл не найден")
-    # simple content-type guess
-    mt = "application/octet-stream"
-    if name.endswith(".pdf"): mt = "application/pdf"
-    if name.endswith(".docx"): mt = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    if name.endswith(".xlsx"): mt = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    return FileResponse(path, filename=name, media_type=mt)
-
-
-@app.get('/api/health')
-def health():
-    return {'ok': True}
-
-
-# --- Extra fallback CORS middleware (adds headers if something upstream stripped them) ---
-class FallbackCORSMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
-        # Handle preflight
-        if request.method == "OPTIONS":
-            resp = Response(status_code=204)
-        else:
-            resp = await call_next(request)
-
-        origin = request.headers.get("origin")
-        # If CORSMiddleware already set headers, leave them; otherwise add permissive defaults
-        if "access-control-allow-origin" not in (k.lower() for k in resp.headers.keys()):
-            # Allow specific origin if provided, else wildcard
-            allowed = origin or "*"
-            resp.headers["Access-Control-Allow-Origin"] = allowed if allowed != "null" else "*"
-            resp.headers["Vary"] = (resp.headers.get("Vary", "") + ", Origin").strip(", ")
-            resp.headers["Access-Control-Allow-Methods"] = "GET,POST,PUT,PATCH,DELETE,OPTIONS"
-            resp.headers["Access-Control-Allow-Headers"] = request.headers.get("access-control-request-headers", "*") or "*"
-            resp.headers["Access-Control-Expose-Headers"] = "Content-Disposition"
-        return resp
-
-app.add_middleware(FallbackCORSMiddleware)
-def make_plan_text(category:str, municipality_name:str)->str:
-    today = dt.date.today()
-    deadline = today + dt.timedelta(days=30)
-    steps = [
-      ("Диагностика проблематики","Собрать первичные данные, верифицировать адресные точки, составить карту очагов."),
-      ("Быстрые победы (до 2 недель)","Отработать 2–3 адреса с высокой видимостью; подготовить фото «до/после»."),
-      ("Системные меры","Запланировать закупки/МКУ/подрядчики, согласовать сметы и графики."),
-      ("Коммуникации","План публикаций в соцсетях, встречи с жителями, ответы в комментариях."),
-      ("Контроль и KPI","Еженедельный отчёт, дашборд метрик, опрос удовлетворённости.")
-    ]
-    lines = [f"План действий на месяц — {category} — {municipality_name}",
-             f"Период: {today.strftime('%d.%m.%Y')} — {deadline.strftime('%d.%m.%Y')}",
-             "", "Цели:", "- Повышение доверия жителей", "- Снижение количества проблемных обращений", "", "Шаги:"]
-    for i,(t,d) in enumerate(steps, start=1):
-        lines.append(f"{i}. {t}: {d}")
-    lines.append("Ключевые KPI: закрытие 80% обращений в срок; рост позитивных упоминаний на 20%; ≥3 встречи с жителями.")
-    return "\n".join(lines)
-
-def write_docx(path:str, text:str):
-    try:
-        import docx
-        d = docx.Document()
-        for para in text.split("\n"):
-            d.add_paragraph(para)
-        d.save(path)
-        return True
-    except Exception:
-        return False
-
-def write_pdf(path:str, text:str):
-    try:
-        from reportlab.lib.pagesizes import A4
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.units import cm
-        c = canvas.Canvas(path, pagesize=A4)
-        width, height = A4
-        x, y = 2*cm, height-2*cm
-        for line in text.split("\n"):
-            c.drawString(x, y, line[:120])
-            y -= 14
-            if y < 2*cm:
-                c.showPage()
-                y = height-2*cm
-        c.save()
-        return True
-    except Exception:
-        return False
-
-@app.get("/api/appeals/plans")
-def list_plans(municipality_id: Optional[int] = None):
-    items = DB["plans"]
-    if municipality_id:
-        items = [p for p in items if p["municipality_id"]==municipality_id]
-    return {"items": items[-50:]}
+def _plan_item(plan:dict, origin:str) -> dict:
+    """API view of a stored plan; links point at the host that was asked."""
+    key = plan["doc_key"]
+    return {
+      "id": plan["id"],
+      "category": plan["category"],
+      "municipality_id": plan["municipality_id"],
+      "municipality_name": _muni_name(plan["municipality_id"]),
+      "summary": plan["summary"],
+      "created_at": plan["created_at"],
+      "docx_url": f"{origin}/api/appeals/file/plan_{key}.docx",
+      "pdf_url": f"{origin}/api/appeals/file/plan_{key}.pdf",
+    }
 
 @app.post("/api/appeals/generate-plan/{category}")
 async def generate_plan(category:str, payload: dict, request: Request):
-    municipality_id = payload.get("municipality_id")
-    muni = next((m for m in MUNICIPALITIES if m["id"]==municipality_id), {"name":"Муниципалитет"})
-    text = make_plan_text(category, muni["name"])
-
-    plan_id = str(uuid.uuid4())
-    docx_path = os.path.join(EXPORT_DIR, f"plan_{plan_id}.docx")
-    pdf_path  = os.path.join(EXPORT_DIR, f"plan_{plan_id}.pdf")
-    write_docx(docx_path, text)
-    write_pdf(pdf_path, text)
-
     origin = str(request.base_url).rstrip('/')
-    item = {
-      "id": plan_id,
-      "category": category,
-      "municipality_id": municipality_id,
-      "municipality_name": muni["name"],
-      "summary": text.splitlines()[0],
-      "created_at": dt.datetime.now().strftime("%Y-%m-%d %H:%M"),
-      "docx_url": f"{origin}/api/appeals/file/{os.path.basename(docx_path)}",
-      "pdf_url": f"{origin}/api/appeals/file/{os.path.basename(pdf_path)}",
-    }
-    DB["plans"].append(item)
+    item = await _new_plan(category, payload.get("municipality_id"), origin)
     return {"ok": True, "item": item}
 
+@app.post("/api/appeals/generate-plans")
+async def generate_plans(payload: dict, request: Request):
+    """Plans for every category of one municipality; documents are rendered in parallel."""
+    origin = str(request.base_url).rstrip('/')
+    municipality_id = payload.get("municipality_id")
+    items = [await _new_plan(c, municipality_id, origin) for c in CATEGORIES]
+    names = [it[f].rsplit("/", 1)[1] for it in items for f in ("docx_url", "pdf_url")]
+    await asyncio.gather(*(_plan_file(n) for n in names))
+    return {"ok": True, "items": items}
+
+async def _plan_file(name:str) -> Optional[str]:
+    """Path of a plan document in the file cache, rendering it on a miss."""
+    m = re.fullmatch(r"plan_([0-9a-f]+)\.(docx|pdf)", name)
+    doc = await run_in_threadpool(STORE.get_document, m.group(1)) if m else None
+    if not doc or doc[0] != "plan":
+        return None
+    p = doc[1]
+    try:
+        data = await plan_document(p["category"], p["municipality_id"], p["date"], m.group(2))
+    except Exception as e:
+        logger.warning(f"Plan render failed for {name}: {e}")
+        raise HTTPException(500, "Не удалось сформировать документ")
+
+    def render(path):
+        with open(path, "wb") as f:
+            f.write(data)
+    return await run_in_threadpool(CACHE.get, name, render)
+
 @app.get("/api/appeals/file/{name}")
 @app.get("/appeals/file/{name}")
-def get_any_file(name:str):
-    path = os.path.join(EXPORT_DIR, name)
-    if not os.path.exists(path): raise HTTPException(404, "Файл не найден")
+async def get_any_file(name:str, request: Request):
+    path = await run_in_threadpool(CACHE.get, name) or await _plan_file(name)
+    if not path: raise HTTPException(404, "Файл не найден")
     # simple content-type guess
     mt = "application/octet-stream"
     if name.endswith(".pdf"): mt = "application/pdf"
     if name.endswith(".docx"): mt = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
     if name.endswith(".xlsx"): mt = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-    return FileResponse(path, filename=name, media_type=mt)
+    return file_response(request, path, name, mt)
 
 
 @app.get('/api/health')
@@ -677,25 +699,56 @@ def health():
     return {'ok': True}
 
 
+@app.get("/api/metrics")
+def get_metrics():
+    """Prometheus text format; with several workers, their last snapshots are included."""
+    return PlainTextResponse(metrics.render(METRICS_DIR, max_age=4 * METRICS_FLUSH),
+                             media_type="text/plain; version=0.0.4")
+
+@app.get("/api/metrics/profiles/{profile_id}")
+def get_profile(profile_id: str, request: Request):
+    """Folded stacks of a profiled request (X-Profile-Id); needs the same X-Profile token."""
+    if not PROFILE_TOKEN or request.headers.get("x-profile") != PROFILE_TOKEN \
+            or not re.fullmatch(r"[0-9a-f]{32}", profile_id):
+        raise HTTPException(404, "Профиль не найден")
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.folded")
+    if not os.path.exists(path):
+        raise HTTPException(404, "Профиль не найден")
+    with open(path) as f:
+        return PlainTextResponse(f.read())
+
+
 # --- Extra fallback CORS middleware (adds headers if something upstream stripped them) ---
-class FallbackCORSMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request, call_next):
+# Plain ASGI: headers are patched on the response start message, the body streams through untouched
+class FallbackCORSMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_headers = Headers(scope=scope)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                # If CORSMiddleware already set headers, leave them; otherwise add permissive defaults
+                if "access-control-allow-origin" not in headers:
+                    # Allow specific origin if provided, else wildcard
+                    allowed = request_headers.get("origin") or "*"
+                    headers["Access-Control-Allow-Origin"] = allowed if allowed != "null" else "*"
+                    headers["Vary"] = (headers.get("Vary", "") + ", Origin").strip(", ")
+                    headers["Access-Control-Allow-Methods"] = "GET,POST,PUT,PATCH,DELETE,OPTIONS"
+                    headers["Access-Control-Allow-Headers"] = request_headers.get("access-control-request-headers", "*") or "*"
+                    headers["Access-Control-Expose-Headers"] = "Content-Disposition"
+            await send(message)
+
         # Handle preflight
-        if request.method == "OPTIONS":
-            resp = Response(status_code=204)
+        if scope["method"] == "OPTIONS":
+            await Response(status_code=204)(scope, receive, send_wrapper)
         else:
-            resp = await call_next(request)
-
-        origin = request.headers.get("origin")
-        # If CORSMiddleware already set headers, leave them; otherwise add permissive defaults
-        if "access-control-allow-origin" not in (k.lower() for k in resp.headers.keys()):
-            # Allow specific origin if provided, else wildcard
-            allowed = origin or "*"
-            resp.headers["Access-Control-Allow-Origin"] = allowed if allowed != "null" else "*"
-            resp.headers["Vary"] = (resp.headers.get("Vary", "") + ", Origin").strip(", ")
-            resp.headers["Access-Control-Allow-Methods"] = "GET,POST,PUT,PATCH,DELETE,OPTIONS"
-            resp.headers["Access-Control-Allow-Headers"] = request.headers.get("access-control-request-headers", "*") or "*"
-            resp.headers["Access-Control-Expose-Headers"] = "Content-Disposition"
-        return resp
+            await self.app(scope, receive, send_wrapper)
 
 app.add_middleware(FallbackCORSMiddleware)
+# outermost: times everything above, preflights included
+app.add_middleware(metrics.MetricsMiddleware, profile_token=PROFILE_TOKEN, profile_dir=PROFILE_DIR)
@@ -0,0 +1,206 @@
+"""Array-backed table of parsed appeals.
+
+A parsed file used to travel as a list of eight-key dicts: from the parse
+worker (pickled), through geocoding, into the store. At a few hundred
+thousand rows the dicts and the repeated strings dominate memory. Here each
+field is a column:
+
+- source, category, address: interned (each distinct value stored once,
+  rows hold int32 codes, -1 for None)
+- date: int32 day ordinals; 0 is None, and a value that is not an ISO date
+  (Добродел keeps unparseable cells as their first 10 chars) is interned
+  and stored as -(code + 1)
+- lat, lng: float32, NaN for None; that holds 5 decimal places at these
+  latitudes (~1 m), and rows give them back rounded to 5
+- municipality_id: int32, -1 for None
+- text: one UTF-8 buffer with int64 offsets
+
+Iterating gives the usual row dicts, one at a time.
+"""
+import math, datetime as dt
+from array import array
+from collections import Counter
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional
+
+COLUMNS = ("source", "date", "address", "text", "category", "lat", "lng", "municipality_id")
+
+
+class _Interned:
+    """Dictionary-encoded string column."""
+    __slots__ = ("values", "codes", "_index")
+
+    def __init__(self):
+        self.values: List[str] = []
+        self.codes = array("i")
+        self._index = {}
+
+    def code(self, v) -> int:
+        if v is None:
+            return -1
+        c = self._index.get(v)
+        if c is None:
+            if len(self._index) < len(self.values):  # rebuilt lazily after unpickling
+                self._index = {s: i for i, s in enumerate(self.values)}
+                return self.code(v)
+            c = self._index[v] = len(self.values)
+            self.values.append(v)
+        return c
+
+    def add(self, v):
+        self.codes.append(self.code(v))
+
+    def get(self, i:int) -> Optional[str]:
+        c = self.codes[i]
+        return None if c < 0 else self.values[c]
+
+    # the index only speeds up adding; it is not sent to other processes
+    def __getstate__(self):
+        return self.values, self.codes
+
+    def __setstate__(self, state):
+        self.values, self.codes = state
+        self._index = {}
+
+
+def _str(v) -> Optional[str]:
+    return None if v is None or v != v else str(v)  # None or NaN
+
+
+@lru_cache(maxsize=4096)
+def _ordinal(s:str) -> int:
+    """Day ordinal of an ISO yyyy-mm-dd date, 0 for anything else."""
+    try:
+        d = dt.date.fromisoformat(s)
+    except ValueError:
+        return 0
+    return d.toordinal() if d.isoformat() == s else 0
+
+
+@lru_cache(maxsize=4096)
+def _iso(ordinal:int) -> str:
+    return dt.date.fromordinal(ordinal).isoformat()
+
+
+def _float(v) -> float:
+    if v is None:
+        return math.nan
+    try:
+        v = float(v)
+    except (TypeError, ValueError):
+        return math.nan
+    return v if math.isfinite(v) else math.nan
+
+
+class AppealTable:
+    def __init__(self):
+        self._source, self._address, self._category, self._odd_dates = (_Interned() for _ in range(4))
+        self._date = array("i")
+        self._lat, self._lng = array("f"), array("f")
+        self._municipality = array("i")
+        self._text = bytearray()
+        self._offsets = array("q", [0])
+
+    @classmethod
+    def from_rows(cls, rows:Iterable[dict]) -> "AppealTable":
+        t = cls()
+        t.extend(rows)
+        return t
+
+    def __len__(self) -> int:
+        return len(self._date)
+
+    def append(self, row:dict):
+        """Add one row dict; keys other than COLUMNS are dropped."""
+        g = row.get
+        self._source.add(_str(g("source")))
+        self._address.add(_str(g("address")))
+        self._category.add(_str(g("category")))
+        self._date.append(self._pack_date(_str(g("date"))))
+        self._lat.append(_float(g("lat")))
+        self._lng.append(_float(g("lng")))
+        m = g("municipality_id")
+        try:
+            self._municipality.append(-1 if m is None else int(m))
+        except (TypeError, ValueError):
+            self._municipality.append(-1)
+        self._text += (g("text") or "").encode("utf-8", "surrogatepass")
+        self._offsets.append(len(self._text))
+
+    def extend(self, rows:Iterable[dict]):
+        for r in rows:
+            self.append(r)
+
+    def _pack_date(self, s:Optional[str]) -> int:
+        if s is None:
+            return 0
+        d = _ordinal(s)
+        return d if d else -(self._odd_dates.code(s) + 1)
+
+    def _date_str(self, d:int) -> Optional[str]:
+        if d > 0:
+            return _iso(d)
+        return self._odd_dates.values[-d - 1] if d < 0 else None
+
+    @staticmethod
+    def _coord(v:float) -> Optional[float]:
+        return None if v != v else round(v, 5)
+
+    def __getitem__(self, i:int) -> dict:
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+        i %= len(self)
+        m = self._municipality[i]
+        return {
+            "source": self._source.get(i),
+            "date": self._date_str(self._date[i]),
+            "address": self._address.get(i),
+            "text": self._text[self._offsets[i]:self._offsets[i + 1]].decode("utf-8", "surrogatepass"),
+            "category": self._category.get(i),
+            "lat": self._coord(self._lat[i]),
+            "lng": self._coord(self._lng[i]),
+            "municipality_id": None if m < 0 else m,
+        }
+
+    def __iter__(self):
+        # __getitem__ unrolled over all rows: this feeds the store on every upload
+        sources, addresses, categories = ([None, *c.values] for c in (self._source, self._address, self._category))
+        coord, date_str = self._coord, self._date_str
+        for s, d, a, t, c, la, ln, m in zip(self._source.codes, self._date, self._address.codes, self.texts(),
+                                            self._category.codes, self._lat, self._lng, self._municipality):
+            yield {"source": sources[s + 1], "date": date_str(d), "address": addresses[a + 1], "text": t,
+                   "category": categories[c + 1], "lat": coord(la), "lng": coord(ln),
+                   "municipality_id": None if m < 0 else m}
+
+    def set_municipality(self, municipality_id:Optional[int]):
+        self._municipality = array("i", [-1 if municipality_id is None else municipality_id]) * len(self)
+
+    def counts(self, column:str) -> Counter:
+        """Rows per value of an interned column (source, address or category); None counts missing."""
+        col = {"source": self._source, "address": self._address, "category": self._category}[column]
+        return Counter({(None if c < 0 else col.values[c]): n for c, n in Counter(col.codes).items()})
+
+    def fill_coords(self, lookup:Callable, municipality_id:Optional[int]=None) -> int:
+        """Set lat/lng from lookup(address, municipality_id) on rows with an address and no coordinates.
+
+        Each distinct address (per municipality) is looked up once. Returns how many rows were filled.
+        """
+        found, n = {}, 0
+        codes, values = self._address.codes, self._address.values
+        for i, c in enumerate(codes):
+            if c < 0 or not values[c] or self._lat[i] == self._lat[i] or self._lng[i] == self._lng[i]:
+                continue
+            m = municipality_id or (self._municipality[i] if self._municipality[i] >= 0 else None)
+            key = (c, m)
+            if key not in found:
+                found[key] = lookup(values[c], m)
+            p = found[key]
+            if p:
+                self._lat[i], self._lng[i] = p
+                n += 1
+        return n
+
+    def texts(self):
+        """Texts in row order, decoded one at a time."""
+        buf, off = self._text, self._offsets
+        return (buf[off[i]:off[i + 1]].decode("utf-8", "surrogatepass") for i in range(len(self)))
@@ -0,0 +1,5 @@
+"""Benchmarks for the ingestion hot paths. Run from backend/: python -m bench.<name>
+
+workloads generates the seeded synthetic uploads, report holds the timing and
+JSON output (python -m bench.report old.json new.json compares two runs).
+"""
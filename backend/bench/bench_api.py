@@ -0,0 +1,87 @@
+"""End-to-end upload and analytics timings through the ASGI app, in-process.
+
+    cd backend && python -m bench.bench_api --rows 10000 --kinds xlsx,csv,pdf,docx --json api.json
+
+Runs against a throwaway DB_PATH/EXPORT_DIR. Every upload is a different file
+(seed + i), so none is answered from the upload cache; generating the files is
+not timed. items/s of an upload is appeals stored per second (xlsx rows are
+filtered to Люберцы and open statuses first; a DOCX is one appeal, a PDF one
+per page), bytes_per_s is file size over the best time. Analytics requests run
+after all uploads, on the full store; the last case revalidates with If-None-Match.
+Parsing uses the process pool unless PARSE_WORKERS=0.
+"""
+import os, shutil, argparse, tempfile, time
+
+from bench.workloads import write
+from bench.report import summarize, dump
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=10000, help="rows per uploaded file")
+    ap.add_argument("--kinds", default="xlsx,csv,pdf,docx")
+    ap.add_argument("--repeat", type=int, default=3, help="uploads per kind")
+    ap.add_argument("--requests", type=int, default=50, help="requests per analytics case")
+    ap.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = ap.parse_args()
+
+    tmp = tempfile.mkdtemp(prefix="bench-api-")
+    os.environ["DB_PATH"] = os.path.join(tmp, "db", "appeals.sqlite3")
+    os.environ["EXPORT_DIR"] = os.path.join(tmp, "exports")
+    os.environ.setdefault("PDF_SPLIT", "page")  # extracted PDF text keeps no blank lines between paragraphs
+    from fastapi.testclient import TestClient
+    import app
+
+    results = {}
+    with TestClient(app.app) as client:
+        for kind in args.kinds.split(","):
+            paths = []
+            for i in range(args.repeat):
+                path = os.path.join(tmp, f"upload-{i}.{kind}")
+                write(kind, path, args.rows, 1000 + i)
+                paths.append(path)
+            times, rows = [], 0
+            for path in paths:
+                with open(path, "rb") as f:
+                    data = f.read()
+                t0 = time.perf_counter()
+                r = client.post("/api/appeals/upload", data={"municipality_id": "4"},
+                                files=[("files", (os.path.basename(path), data))])
+                times.append(time.perf_counter() - t0)
+                r.raise_for_status()
+                rows += r.json()["rows"]
+                os.unlink(path)
+            res = summarize(times, rows // len(paths))
+            res["bytes"] = len(data)
+            res["bytes_per_s"] = len(data) / res["best_s"]
+            results[f"upload {kind}"] = res
+
+        day = client.get("/api/appeals/analytics").json()["by_date"]
+        month = day[-1]["date"][:7] if day else "2024-06"
+        cases = {
+            "analytics": {},
+            "analytics municipality": {"municipality_id": 4},
+            "analytics month by day": {"municipality_id": 4, "date_from": f"{month}-01",
+                                       "date_to": f"{month}-28", "granularity": "day"},
+            "analytics category": {"category": "ЖКХ", "granularity": "week"},
+        }
+        for name, params in cases.items():
+            results[name] = _latency(client, params, args.requests)
+        etag = client.get("/api/appeals/analytics").headers["etag"]
+        results["analytics 304"] = _latency(client, {}, args.requests, {"If-None-Match": etag}, 304)
+    shutil.rmtree(tmp, ignore_errors=True)
+    dump("api", vars(args), results, args.json)
+
+
+def _latency(client, params:dict, n:int, headers:dict=None, status:int=200) -> dict:
+    times = []
+    for _ in range(n):
+        t0 = time.perf_counter()
+        r = client.get("/api/appeals/analytics", params=params, headers=headers)
+        times.append(time.perf_counter() - t0)
+        assert r.status_code == status, r.text
+    return summarize(times)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Geotag extraction on appeal-like Russian texts: prefiltered geotag vs the old unfiltered scan.
+
+    cd backend && python -m bench.bench_geotag --rows 50000 --json geotag.json
+
+Texts come from bench.workloads.appeal_texts: most carry house/flat numbers, phones
+and dates but no coordinates; a few carry a decimal pair or a DMS pair, as in real uploads.
+"""
+import argparse
+
+import pandas as pd
+import geotag
+from geotag import COORD_DD_RE, DMS_RE, _dms_to_dd
+from bench.workloads import appeal_texts
+from bench.report import measure, dump
+
+DMS_SHARE = 0.02   # texts with a degree/minute pair, on top of appeal_texts' decimal ones
+
+
+def legacy_from_text(t:str):
+    """The unfiltered per-text scan, kept here only as the benchmark baseline."""
+    if not t:
+        return (None, None)
+    m = COORD_DD_RE.search(t)
+    if m:
+        lat = float(m.group('lat').replace(',', '.')); lng = float(m.group('lng').replace(',', '.'))
+        if -90 <= lat <= 90 and -180 <= lng <= 180:
+            return (lat, lng)
+    m = DMS_RE.search(t)
+    if m:
+        lat = None
+        if m.group('lat_deg') is not None:
+            lat = _dms_to_dd(m.group('lat_deg'), m.group('lat_min'), m.group('lat_sec'), m.group('lat_hem') or 'N')
+        return (lat, _dms_to_dd(m.group('lng_deg'), m.group('lng_min'), m.group('lng_sec'), m.group('lng_hem') or 'E'))
+    return (None, None)
+
+
+def legacy_many(texts:pd.Series):
+    """Old batch path: str.extract for decimal pairs, per-row DMS for every other row with a digit."""
+    t = texts.fillna("").astype(str)
+    m = t.str.extract(COORD_DD_RE)
+    lat = pd.to_numeric(m["lat"].str.replace(",", ".", regex=False), errors="coerce")
+    lng = pd.to_numeric(m["lng"].str.replace(",", ".", regex=False), errors="coerce")
+    ok = lat.between(-90, 90) & lng.between(-180, 180)
+    lat, lng = lat.where(ok), lng.where(ok)
+    for i in t.index[~ok & t.str.contains(r"\d", regex=True)]:
+        la, ln = legacy_from_text(t[i])
+        if la is not None or ln is not None:
+            lat[i] = la if la is not None else float("nan")
+            lng[i] = ln if ln is not None else float("nan")
+    return lat, lng
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = ap.parse_args()
+    texts = pd.Series(list(appeal_texts(args.rows, args.seed, DMS_SHARE)))
+
+    cases = {
+        "per-text, unfiltered": lambda: [legacy_from_text(t) for t in texts],
+        "per-text, prefiltered": lambda: [geotag.detect_coords_from_text(t) for t in texts],
+        "batch, unfiltered": lambda: legacy_many(texts),
+        "batch, prefiltered": lambda: geotag.detect_coords_many(texts),
+    }
+    results = {name: measure(fn, args.repeat, len(texts)) for name, fn in cases.items()}
+
+    old_lat, old_lng = legacy_many(texts)
+    new_lat, new_lng = geotag.detect_coords_many(texts)
+    same = lambda a, b: (a == b) | (a.isna() & b.isna())
+    diff = ~(same(old_lat, new_lat) & same(old_lng, new_lng))
+    marked = texts.str.contains(geotag.DMS_HINT, regex=True)
+    results["batch, prefiltered"].update(with_coords=int(new_lng.notna().sum()), differing_rows=int(diff.sum()),
+                                         differing_unmarked=int((diff & ~marked).sum()))
+    dump("geotag", vars(args), results, args.json)
+    print(f"texts: {len(texts)}, with coordinates (new): {int(new_lng.notna().sum())}")
+    print(f"differing rows: {int(diff.sum())} "
+          f"({int((diff & ~marked).sum())} are old DMS hits on texts without any degree/minute mark)")
+
+
+if __name__ == "__main__":
+    main()
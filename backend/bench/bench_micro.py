@@ -0,0 +1,42 @@
+"""Microbenchmarks of the per-text hot paths, on seeded synthetic appeals.
+
+    cd backend && python -m bench.bench_micro --rows 20000 --json micro.json
+
+Each case runs over all texts; items/s is texts per second. The batch
+variants used by uploads (extract_fields_many, detect_coords_many) are
+measured next to the per-text functions.
+"""
+import argparse
+
+import pandas as pd
+import ingest, geotag
+from bench.workloads import appeal_texts
+from bench.report import measure, dump
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=20000)
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", help="write results to this file ('-' for stdout)")
+    args = ap.parse_args()
+
+    texts = list(appeal_texts(args.rows, args.seed))
+    series = pd.Series(texts)
+    n = len(texts)
+    cases = {
+        "guess_category": lambda: [ingest.guess_category(t) for t in texts],
+        "sentiment_score": lambda: [ingest.sentiment_score(t) for t in texts],
+        "detect_coords_from_text": lambda: [geotag.detect_coords_from_text(t) for t in texts],
+        "detect_coords_many": lambda: geotag.detect_coords_many(series),
+        "top_tokens": lambda: ingest.top_tokens(texts, 5),
+        "extract_fields": lambda: [ingest.extract_fields(t, "bench") for t in texts],
+        "extract_fields_many": lambda: ingest.extract_fields_many(series, "bench"),
+    }
+    results = {name: measure(fn, args.repeat, n) for name, fn in cases.items()}
+    dump("micro", vars(args), results, args.json)
+
+
+if __name__ == "__main__":
+    main()
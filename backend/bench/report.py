@@ -0,0 +1,81 @@
+"""Timing and JSON results shared by the benchmarks.
+
+A result file holds the environment (commit, Python, pandas, CPU count) and one
+entry per case, so two files from different commits can be put side by side:
+
+    python -m bench.report before.json after.json
+"""
+import os, sys, json, time, platform, statistics, subprocess, datetime as dt
+from typing import Callable, Optional
+
+import pandas as pd
+
+
+def measure(fn:Callable, repeat:int=5, items:int=1, warmup:int=1) -> dict:
+    """Seconds per call of fn (best, median, p95 over `repeat` calls) and items/s at the best time."""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter(); fn(); times.append(time.perf_counter() - t0)
+    return summarize(times, items)
+
+
+def summarize(times:list, items:int=1) -> dict:
+    times = sorted(times)
+    best = times[0]
+    return {"calls": len(times), "items": items, "best_s": best, "median_s": statistics.median(times),
+            "p95_s": times[min(len(times) - 1, round(0.95 * (len(times) - 1)))],
+            "items_per_s": items / best if best > 0 else None}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def environment() -> dict:
+    return {"commit": _git_commit(), "python": platform.python_version(), "pandas": pd.__version__,
+            "platform": platform.platform(), "cpus": os.cpu_count(),
+            "time": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds")}
+
+
+def print_table(results:dict):
+    for name, r in results.items():
+        rate = f"{r['items_per_s']:>14,.0f}/s" if r.get("items_per_s") else ""
+        print(f"{name:40} best {r['best_s']*1000:10.2f} ms  median {r['median_s']*1000:10.2f} ms"
+              f"  p95 {r['p95_s']*1000:10.2f} ms {rate}")
+
+
+def dump(bench:str, params:dict, results:dict, path:Optional[str]):
+    """Print the table; with path, also write the JSON result file ('-' for stdout)."""
+    print_table(results)
+    if not path:
+        return
+    doc = {"bench": bench, "params": params, "env": environment(), "results": results}
+    if path == "-":
+        json.dump(doc, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(doc, f, ensure_ascii=False, indent=2)
+
+
+def compare(old_path:str, new_path:str):
+    """Best times of the cases both files have, new/old; above 1 is slower."""
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"{old['env'].get('commit')} -> {new['env'].get('commit')}")
+    for name, r in new["results"].items():
+        if name in old["results"]:
+            a, b = old["results"][name]["best_s"], r["best_s"]
+            print(f"{name:40} {a*1000:10.2f} ms -> {b*1000:10.2f} ms  x{b/a:.2f}" if a else name)
+
+
+if __name__ == "__main__":
+    compare(*sys.argv[1:3])
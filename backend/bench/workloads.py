@@ -0,0 +1,148 @@
+"""Seeded synthetic uploads: Добродел workbooks, CSV/TSV, multi-page PDF and DOCX.
+
+The same seed and size give the same file, so runs can be compared over time.
+
+    cd backend && python -m bench.workloads --kind xlsx --rows 100000 --out /tmp/dobrodel.xlsx
+"""
+import argparse, csv, random
+from typing import Iterator
+
+import pandas as pd
+
+OMSU = ["г.о. Люберцы", "Раменский г.о.", "г.о. Жуковский", "г.о. Бронницы"]
+# the first three are in ingest.DOBRODEL_STATUS_ALLOW, the rest are filtered out
+STATUSES = ["На исполнении", "В работе исполнителя", "На уточнении модератора", "Закрыто", "Отклонено"]
+STREETS = ["ул. Октябрьский проспект", "ул. Смирновская", "ул. 3-е Почтовое отделение", "ул. Кирова", "ул. Мира"]
+FACTS = [
+    "Во дворе не работает освещение, просим починить",
+    "Яма на дороге у подъезда, асфальт разрушен",
+    "Не вывозят мусор с контейнерной площадки",
+    "Протечка в подъезде, управляющая компания не реагирует",
+    "Автобус по маршруту 23 ходит не по расписанию",
+    "Нет горячей воды третий день",
+    "Спасибо, что починили лавочки в сквере",
+]
+# free-text appeals for CSV/PDF/DOCX: dates, house numbers, phones, now and then coordinates
+COMPLAINTS = [
+    "Во дворе не работает освещение, просим починить до {d}",
+    "Яма на дороге у подъезда {n}, асфальт разрушен",
+    "Не вывозят мусор с контейнерной площадки уже {n} дня",
+    "Протечка в подъезде {n} в кв. {k}, управляющая компания не реагирует",
+    "Автобус по маршруту {n} ходит не по расписанию, ждали 40 минут",
+    "Нет горячей воды третий день, звонили по тел. 8 (495) 555-{k:02d}-{n:02d}",
+    "Спасибо, что починили лавочки в сквере {d}",
+    "Сломан лифт в доме {n} корп. 2, этаж {k}",
+    "Не убран снег у д. {n}, {k} подъезд",
+    "Шум от стройки по ночам, нарушение тишины с {d}",
+]
+
+
+def synthetic_export(rows:int, seed:int=42) -> pd.DataFrame:
+    """A Добродел export: mixed municipalities and statuses, dates as timestamps or dd.mm.yyyy."""
+    rnd = random.Random(seed)
+    day0 = pd.Timestamp("2024-01-01")
+    data = {"№": range(rows), "ОМСУ": [], "Статус": [], "Источник": [], "Дата обращения": [],
+            "Адрес": [], "Факт": [], "Описание": []}
+    for i in range(rows):
+        data["ОМСУ"].append(rnd.choice(OMSU))
+        data["Статус"].append(rnd.choice(STATUSES))
+        data["Источник"].append(rnd.choice(["Добродел", "Госуслуги", None]))
+        d = day0 + pd.Timedelta(days=rnd.randrange(365))
+        data["Дата обращения"].append(d if rnd.random() < 0.9 else d.strftime("%d.%m.%Y"))
+        data["Адрес"].append(f"{rnd.choice(STREETS)}, д. {rnd.randint(1, 120)}")
+        data["Факт"].append(rnd.choice(FACTS))
+        data["Описание"].append(f"Координаты 55.{rnd.randint(60, 70)}{i % 1000}, 37.{rnd.randint(80, 99)}{i % 1000}"
+                                if rnd.random() < 0.3 else None)
+    return pd.DataFrame(data)
+
+
+def appeal_texts(rows:int, seed:int=7, dms:float=0.0) -> Iterator[str]:
+    """Free-text appeals, one per row; about 5% carry a decimal coordinate pair, a `dms` share a DMS one."""
+    rnd = random.Random(seed)
+    for _ in range(rows):
+        n, k = rnd.randint(1, 120), rnd.randint(1, 99)
+        d = f"{rnd.randint(1, 28):02d}.{rnd.randint(1, 12):02d}.2024"
+        t = f"{rnd.choice(COMPLAINTS).format(n=n, k=k, d=d)}. Адрес: {rnd.choice(STREETS)}, д. {n}"
+        r = rnd.random()
+        if r < 0.05:
+            t += f" Координаты 55.{rnd.randint(600000, 700000)}, 37.{rnd.randint(800000, 999999)}"
+        elif r < 0.05 + dms:
+            t += f" Точка: 55°{rnd.randint(30, 59)}′{rnd.randint(0, 59)}″ N, 37°{rnd.randint(40, 59)}′ E"
+        yield t
+
+
+def write_xlsx(path:str, rows:int, seed:int=42):
+    synthetic_export(rows, seed).to_excel(path, index=False, sheet_name="Выгрузка")
+
+
+def write_csv(path:str, rows:int, seed:int=7):
+    """Streamed, so 1M rows do not need 1M rows of memory; .tsv paths are tab-separated."""
+    rnd = random.Random(seed + 1)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f, delimiter="\t" if path.lower().endswith(".tsv") else ",")
+        w.writerow(["id", "Дата", "Источник", "Текст обращения"])
+        for i, text in enumerate(appeal_texts(rows, seed)):
+            w.writerow([i, f"2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}",
+                        rnd.choice(["ВКонтакте", "Telegram", "Госуслуги"]), text])
+
+
+def _paragraphs(rows:int, seed:int) -> Iterator[str]:
+    for i, text in enumerate(appeal_texts(rows, seed), 1):
+        yield f"Обращение № {i}. {text}"
+
+
+def write_pdf(path:str, rows:int, seed:int=7):
+    """One appeal per paragraph, blank lines between them, as many A4 pages as it takes."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    from reportlab.pdfgen import canvas
+    from plans import PDF_FONT, FONT_SIZE, LINE_HEIGHT, wrap_line
+
+    c = canvas.Canvas(path, pagesize=A4)
+    width, height = A4
+    left, top, bottom = 2*cm, height - 2*cm, 2*cm
+    c.setFont(PDF_FONT, FONT_SIZE)
+    y = top
+    for para in _paragraphs(rows, seed):
+        for line in [*wrap_line(para, width - 2*left), ""]:
+            if y < bottom:
+                c.showPage()
+                c.setFont(PDF_FONT, FONT_SIZE)
+                y = top
+            c.drawString(left, y, line)
+            y -= LINE_HEIGHT
+    c.save()
+
+
+def write_docx(path:str, rows:int, seed:int=7):
+    import docx
+    d = docx.Document()
+    d.add_heading("Обращения граждан", level=1)
+    for para in _paragraphs(rows, seed):
+        d.add_paragraph(para)
+    d.save(path)
+
+
+WRITERS = {"xlsx": write_xlsx, "csv": write_csv, "tsv": write_csv, "pdf": write_pdf, "docx": write_docx}
+
+
+def write(kind:str, path:str, rows:int, seed:int=None):
+    if seed is None:
+        WRITERS[kind](path, rows)
+    else:
+        WRITERS[kind](path, rows, seed)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--kind", choices=sorted(WRITERS), required=True)
+    ap.add_argument("--rows", type=int, default=1000)
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--out", required=True)
+    args = ap.parse_args()
+    write(args.kind, args.out, args.rows, args.seed)
+    print(args.out)
+
+
+if __name__ == "__main__":
+    main()
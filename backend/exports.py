@@ -0,0 +1,133 @@
+"""Streaming export writers (xlsx, csv.gz, parquet).
+
+Rows are appended in batches as the parsers produce them, so memory stays
+flat regardless of upload size. Output goes to `<path>.part` and is renamed
+into place on close, so a download never sees a half-written file.
+"""
+import os, csv, gzip
+from typing import Optional
+from openpyxl import Workbook
+
+# Optional dep: parquet export is offered only when pyarrow is installed
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except Exception:
+    pa = pq = None
+
+EXPORT_COLUMNS = ["source","date","address","text","category","lat","lng","municipality_id"]
+
+
+def _row(r:dict) -> list:
+    return [r.get(c) for c in EXPORT_COLUMNS]
+
+
+class _Writer:
+    def __init__(self, path:str):
+        self.path = path
+        self.tmp = path + ".part"
+        self.rows = 0
+
+    def write(self, rows:list):
+        self._write(rows)
+        self.rows += len(rows)
+
+    def close(self) -> str:
+        self._close()
+        os.replace(self.tmp, self.path)
+        return self.path
+
+    def abort(self):
+        try:
+            self._close()
+        except Exception:
+            pass
+        if os.path.exists(self.tmp):
+            os.unlink(self.tmp)
+
+
+class XlsxWriter(_Writer):
+    """openpyxl write-only workbook: rows are serialized to a temp file as they are appended."""
+
+    def __init__(self, path:str):
+        super().__init__(path)
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet("appeals")
+        self.ws.append(EXPORT_COLUMNS)
+
+    def _write(self, rows):
+        for r in rows:
+            self.ws.append(_row(r))
+
+    def _close(self):
+        if self.wb is not None:
+            wb, self.wb = self.wb, None
+            wb.save(self.tmp)
+
+
+class CsvGzWriter(_Writer):
+    def __init__(self, path:str):
+        super().__init__(path)
+        # utf-8-sig so Excel opens the unpacked CSV with Cyrillic intact
+        self.f = gzip.open(self.tmp, "wt", encoding="utf-8-sig", newline="")
+        self.w = csv.writer(self.f)
+        self.w.writerow(EXPORT_COLUMNS)
+
+    def _write(self, rows):
+        self.w.writerows(_row(r) for r in rows)
+
+    def _close(self):
+        self.f.close()
+
+
+class ParquetWriter(_Writer):
+    def __init__(self, path:str):
+        super().__init__(path)
+        self.schema = pa.schema([
+            ("source", pa.string()), ("date", pa.string()), ("address", pa.string()),
+            ("text", pa.string()), ("category", pa.string()),
+            ("lat", pa.float64()), ("lng", pa.float64()), ("municipality_id", pa.int64()),
+        ])
+        self.w = pq.ParquetWriter(self.tmp, self.schema, compression="zstd")
+
+    def _write(self, rows):
+        if not rows:
+            return
+        cols = {c: [r.get(c) for r in rows] for c in EXPORT_COLUMNS}
+        for c in ("lat", "lng"):
+            cols[c] = [None if v is None or v != v else float(v) for v in cols[c]]
+        self.w.write_table(pa.table(cols, schema=self.schema))
+
+    def _close(self):
+        self.w.close()
+
+
+# format -> (writer, file extension, media type)
+EXPORT_FORMATS = {
+    "xlsx": (XlsxWriter, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "csv.gz": (CsvGzWriter, "csv.gz", "application/gzip"),
+}
+if pq is not None:
+    EXPORT_FORMATS["parquet"] = (ParquetWriter, "parquet", "application/vnd.apache.parquet")
+
+
+def export_media_type(file_name:str) -> Optional[str]:
+    for _, ext, media in EXPORT_FORMATS.values():
+        if file_name.endswith("." + ext):
+            return media
+    return None
+
+
+def open_export(path:str, fmt:str="xlsx") -> _Writer:
+    return EXPORT_FORMATS[fmt][0](path)
+
+
+def write_export(rows:list, path:str, fmt:str="xlsx") -> str:
+    """One-shot form: write all rows and close."""
+    w = open_export(path, fmt)
+    try:
+        w.write(rows)
+        return w.close()
+    except BaseException:
+        w.abort()
+        raise
@@ -0,0 +1,146 @@
+"""Size-bounded on-disk LRU cache for downloadable files (exports, plan documents).
+
+Files are rendered on first request by a caller-supplied function and kept in
+one directory. Entries expire `ttl` seconds after they were written; when the
+directory grows past `max_bytes` the least recently served files go first.
+The index is rebuilt from the directory at startup, so files written before
+a restart (including ones not rendered through the cache) are served and
+evicted as well.
+
+Several worker processes may share the directory: each keeps its own index,
+picks up files another process rendered on a miss, notices files another
+process evicted, and re-reads the directory on every sweep.
+"""
+import os, time, threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+PART_MAX_AGE = 24 * 3600   # an older .part file is left over from a crashed render
+
+class FileCache:
+    def __init__(self, directory:str, max_bytes:int, ttl:float):
+        self.dir = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._rendering = {}              # name -> lock, one render per file at a time
+        self._index = OrderedDict()       # name -> (size, written_at), least recently served first
+        self._bytes = 0
+        self._scan()
+
+    def _scan(self):
+        """Sync the index with the directory; files new to this process count as least recently served."""
+        found = []
+        for e in os.scandir(self.dir):
+            if not e.is_file():
+                continue
+            try:
+                st = e.stat()
+            except FileNotFoundError:
+                continue
+            if e.name.endswith(".part"):
+                # another process may still be writing a recent one
+                if time.time() - st.st_mtime > PART_MAX_AGE:
+                    self._unlink(e.path)
+                continue
+            if e.name not in self._index:
+                found.append((st.st_mtime, e.name, st.st_size))
+        for name in [n for n in self._index if not os.path.exists(os.path.join(self.dir, n))]:
+            self._drop(name)
+        for mtime, name, size in sorted(found, reverse=True):
+            self._index[name] = (size, mtime)
+            self._index.move_to_end(name, last=False)
+            self._bytes += size
+
+    def _expired(self, name:str) -> bool:
+        return time.time() - self._index[name][1] >= self.ttl
+
+    def _fresh(self, name:str) -> bool:
+        if name not in self._index or self._expired(name):
+            return False
+        if not os.path.exists(os.path.join(self.dir, name)):  # evicted by another process
+            self._drop(name)
+            return False
+        return True
+
+    def _adopt(self, name:str) -> bool:
+        """Index a fresh file that another process rendered; True if there is one."""
+        try:
+            st = os.stat(os.path.join(self.dir, name))
+        except FileNotFoundError:
+            return False
+        if time.time() - st.st_mtime >= self.ttl:
+            return False
+        self._drop(name)
+        self._index[name] = (st.st_size, st.st_mtime)
+        self._bytes += st.st_size
+        return True
+
+    def get(self, name:str, render:Optional[Callable[[str], None]]=None) -> Optional[str]:
+        """Path of `name`, rendering it with render(tmp_path) on a miss.
+
+        Without `render` a miss returns None.
+        """
+        path = os.path.join(self.dir, name)
+        with self._lock:
+            if self._fresh(name) or self._adopt(name):
+                self._index.move_to_end(name)
+                return path
+            if render is None:
+                return None
+            lock = self._rendering.setdefault(name, threading.Lock())
+        with lock:
+            with self._lock:
+                if self._fresh(name) or self._adopt(name):  # rendered by a concurrent request
+                    self._index.move_to_end(name)
+                    return path
+            tmp = f"{path}.{os.getpid()}.part"  # processes rendering the same file do not collide
+            try:
+                render(tmp)
+                os.replace(tmp, path)
+            except BaseException:
+                if os.path.exists(tmp): os.unlink(tmp)
+                raise
+            finally:
+                with self._lock:
+                    self._rendering.pop(name, None)
+            with self._lock:
+                self._drop(name)
+                size = os.path.getsize(path)
+                self._index[name] = (size, time.time())
+                self._bytes += size
+                self._evict(keep=name)
+        return path
+
+    def _drop(self, name:str, unlink:bool=False):
+        e = self._index.pop(name, None)
+        if e is not None:
+            self._bytes -= e[0]
+        if unlink:
+            self._unlink(os.path.join(self.dir, name))
+
+    @staticmethod
+    def _unlink(path:str):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self, keep:Optional[str]=None) -> int:
+        removed = 0
+        for name in [n for n in self._index if n != keep and self._expired(n)]:
+            self._drop(name, unlink=True); removed += 1
+        for name in list(self._index):
+            if self._bytes <= self.max_bytes:
+                break
+            if name != keep:
+                self._drop(name, unlink=True); removed += 1
+        return removed
+
+    def sweep(self) -> int:
+        """Remove expired files and trim to max_bytes; returns how many were removed."""
+        with self._lock:
+            self._scan()
+            return self._evict()
+
@@ -0,0 +1,197 @@
+"""Offline geocoding of appeal addresses against a local street gazetteer.
+
+The gazetteer is a CSV supplied with the deployment (GAZETTEER_PATH):
+
+    municipality_id,street,house,lat,lng
+    4,ул. Смирновская,,55.6781,37.8932        <- street point (house empty)
+    4,ул. Смирновская,6к2,55.6790,37.8951
+
+Street names are normalized (case, ё, street type words and abbreviations)
+and indexed per municipality in a word trie, so an address resolves to the
+longest known street name at its start even when free text follows it
+("ул. Мира дом 5 не вывозят мусор"). The house is looked up exactly, then by
+its bare number, then the street point is used. Results are memoized in an
+LRU cache; no network access is involved.
+"""
+import csv, re, logging
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger("uvicorn.error")
+
+STREET_TYPES = {
+    "ул": "улица", "улица": "улица",
+    "пр": "проспект", "пр-т": "проспект", "просп": "проспект", "проспект": "проспект",
+    "пер": "переулок", "переулок": "переулок",
+    "ш": "шоссе", "шоссе": "шоссе",
+    "б-р": "бульвар", "бул": "бульвар", "бульвар": "бульвар",
+    "пл": "площадь", "площадь": "площадь",
+    "пр-д": "проезд", "проезд": "проезд",
+    "наб": "набережная", "набережная": "набережная",
+    "мкр": "микрорайон", "микрорайон": "микрорайон",
+    "туп": "тупик", "тупик": "тупик",
+    "аллея": "аллея", "кв-л": "квартал", "квартал": "квартал",
+}
+# comma-separated address parts that name the region/city, not the street
+LOCALITY_RE = re.compile(r"(^|\s)(г|город|обл|область|мо|го|округ|р-н|район|россия|рф)(\.|\s|$)|^\d{6}$")
+LOCALITY_NAMES = {"люберцы", "раменское", "раменский", "жуковский", "бронницы"}
+MONTHS = "января|февраля|марта|апреля|мая|июня|июля|августа|сентября|октября|ноября|декабря"
+# first number that is not part of the street name ("3-е Почтовое отделение", "8 Марта")
+HOUSE_START_RE = re.compile(r"(?:\bд(?:ом)?\.?\s*)?(?<![\w-])\d+(?!\d|-?(?:й|я|е|го|ая|ое|ый|ий)\b)(?!\s+(?:" + MONTHS + r")\b)")
+APARTMENT_RE = re.compile(r"\b(?:кв|квартира|оф|офис|пом|помещение)\b\.?\s*\d+\S*")
+# after normalize_house: "15а", "5к2", "12/1", "15ас2"
+HOUSE_RE = re.compile(r"\d+(?:(?![кс]\d)[а-я](?=[кс]\d|[^а-я]|$))?(?:/\d+)?(?:к\d+)?(?:с\d+)?")
+WORD_RE = re.compile(r"[a-zа-я0-9]+(?:-[a-zа-я0-9]+)*")
+
+Point = Tuple[float, float]
+
+
+def _prep(s:str) -> str:
+    return str(s or "").lower().replace("ё", "е")
+
+
+def normalize_street(name:str) -> Tuple[Optional[str], Tuple[str, ...]]:
+    """(canonical street type or None, name words without type/house markers)."""
+    words, kind = [], None
+    for w in WORD_RE.findall(_prep(name)):
+        if w in STREET_TYPES:
+            kind = kind or STREET_TYPES[w]
+        elif w not in ("д", "дом"):
+            words.append(w)
+    return kind, tuple(words)
+
+
+def normalize_house(house:str) -> Optional[str]:
+    t = _prep(house)
+    t = re.sub(r"\b(?:корпус|корп|к)\b\.?", "к", t)
+    t = re.sub(r"\b(?:строение|стр|с)\b\.?", "с", t)
+    t = re.sub(r"\bд(?:ом)?\b\.?|[\s.]", "", t)
+    m = HOUSE_RE.match(t)
+    return m.group(0) if m else None
+
+
+def _is_locality(part:str) -> bool:
+    if part in LOCALITY_NAMES:
+        return True
+    # "г. Люберцы ул. Мира" without a comma keeps its street
+    return bool(LOCALITY_RE.search(part)) and not any(w in STREET_TYPES for w in WORD_RE.findall(part))
+
+
+def parse_address(address:str) -> Optional[Tuple[Optional[str], Tuple[str, ...], Optional[str]]]:
+    """(street type, street name words, house) of a free-form address, or None."""
+    parts = [p.strip() for p in _prep(address).split(",")]
+    t = " ".join(p for p in parts if p and not _is_locality(p))
+    t = APARTMENT_RE.sub(" ", t)
+    m = HOUSE_START_RE.search(t)
+    street, house = (t[:m.start()], normalize_house(t[m.start():])) if m else (t, None)
+    kind, words = normalize_street(street)
+    return (kind, words, house) if words else None
+
+
+def _missing(v) -> bool:
+    return v is None or v != v  # None or NaN
+
+
+class Gazetteer:
+    def __init__(self, rows:Iterable[dict], cache_size:int=50000):
+        # municipality_id -> word trie; a node's None key holds {street type: street}
+        self._tries: Dict[int, dict] = {}
+        streets = []
+        for r in rows:
+            try:
+                muni = int(r["municipality_id"])
+                point = (float(str(r["lat"]).replace(",", ".")), float(str(r["lng"]).replace(",", ".")))
+            except (KeyError, TypeError, ValueError):
+                continue
+            kind, words = normalize_street(r.get("street"))
+            if not words:
+                continue
+            node = self._tries.setdefault(muni, {})
+            for w in words:
+                node = node.setdefault(w, {})
+            st = node.setdefault(None, {}).get(kind)
+            if st is None:
+                st = node[None][kind] = {"point": None, "houses": {}}
+                streets.append(st)
+            house = normalize_house(r.get("house") or "")
+            if house:
+                st["houses"][house] = point
+                st["houses"].setdefault(re.match(r"\d+", house).group(0), point)
+            else:
+                st["point"] = point
+        for st in streets:
+            if st["point"] is None and st["houses"]:
+                pts = list(st["houses"].values())
+                st["point"] = (sum(p[0] for p in pts) / len(pts), sum(p[1] for p in pts) / len(pts))
+        self.streets = len(streets)
+        self.lookup = lru_cache(maxsize=cache_size)(self._lookup)
+
+    @classmethod
+    def from_csv(cls, path:str, **kw) -> "Gazetteer":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            return cls(csv.DictReader(f), **kw)
+
+    def _match(self, trie:dict, words:Tuple[str, ...]) -> Optional[dict]:
+        """Streets ({type: street}) of the longest indexed name in `words`, earliest start first.
+
+        Later starts cover leftovers in front of the street ("люберцы мира").
+        """
+        for start in range(len(words)):
+            node, found = trie, None
+            for w in words[start:]:
+                node = node.get(w)
+                if node is None:
+                    break
+                found = node.get(None, found)
+            if found:
+                return found
+        return None
+
+    def _lookup(self, address:str, municipality_id:Optional[int]=None) -> Optional[Point]:
+        parsed = parse_address(address)
+        if not parsed:
+            return None
+        kind, words, house = parsed
+        if municipality_id:
+            hits = [self._match(self._tries.get(municipality_id, {}), words)]
+        else:
+            # no municipality given: only an unambiguous street name is trusted
+            hits = [self._match(t, words) for t in self._tries.values()]
+        hits = [h for h in hits if h]
+        if len(hits) != 1:
+            return None
+        by_kind = hits[0]
+        st = by_kind.get(kind) or by_kind.get(None) or next(iter(by_kind.values()))
+        if house:
+            p = st["houses"].get(house) or st["houses"].get(re.match(r"\d+", house).group(0))
+            if p:
+                return p
+        return st["point"]
+
+    def fill(self, rows, municipality_id:Optional[int]=None) -> int:
+        """Set lat/lng on rows that have an address but no coordinates; returns how many were filled.
+
+        rows is a list of dicts or an appeals.AppealTable (looked up once per distinct address).
+        """
+        if hasattr(rows, "fill_coords"):
+            return rows.fill_coords(self.lookup, municipality_id)
+        n = 0
+        for r in rows:
+            if _missing(r.get("lat")) and _missing(r.get("lng")) and r.get("address"):
+                p = self.lookup(r["address"], municipality_id or r.get("municipality_id"))
+                if p:
+                    r["lat"], r["lng"] = p
+                    n += 1
+        return n
+
+
+def load_gazetteer(path:Optional[str], cache_size:int=50000) -> Optional[Gazetteer]:
+    if not path:
+        return None
+    try:
+        g = Gazetteer.from_csv(path, cache_size=cache_size)
+    except OSError as e:
+        logger.warning(f"Gazetteer {path} not loaded: {e}")
+        return None
+    logger.info(f"Gazetteer {path}: {g.streets} streets")
+    return g
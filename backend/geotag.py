@@ -0,0 +1,165 @@
+"""Coordinate (geotag) extraction for uploaded appeals.
+
+Two sources, in order: explicit lat/lng columns of a sheet (resolved once per
+sheet), then coordinates written in the text — a decimal pair ("55.67, 37.89")
+or degrees/minutes/seconds ("55°40′ N 37°53′ E").
+
+Most appeal texts carry no coordinates at all, so both text patterns sit
+behind cheap prefilters: no "digit, separator, digit" means no decimal pair,
+and no degree/minute mark means no DMS. DMS_RE is permissive enough to fire on
+plain addresses ("д. 12 5 в подъезде"), so it is only tried when such a mark
+is present.
+"""
+import re
+from typing import Iterable, Optional, Tuple
+import pandas as pd
+
+# Optional dep: with pyarrow the prefilters run as Arrow (C++) string kernels
+try:
+    import pyarrow  # noqa: F401
+except Exception:
+    pyarrow = None
+
+COORD_DD_RE = re.compile(r'(?P<lat>[+-]?\d{1,2}(?:[.,]\d+))\s*[,; ]\s*(?P<lng>[+-]?\d{1,3}(?:[.,]\d+))')
+DMS_RE = re.compile(r'(?:(?P<lat_deg>\d{1,2})[°\s]\s*(?P<lat_min>\d{1,2})(?:[\'’′]\s*(?P<lat_sec>\d{1,2}(?:[.,]\d+))?)?\s*(?P<lat_hem>[NSСЮСеверЮж])\s*[,; ]\s*)?(?P<lng_deg>\d{1,3})[°\s]\s*(?P<lng_min>\d{1,2})(?:[\'’′]\s*(?P<lng_sec>\d{1,2}(?:[.,]\d+))?)?\s*(?P<lng_hem>[EWЗВВостЗап])', re.IGNORECASE)
+
+# prefilters (a text failing them cannot give a coordinate worth reporting)
+DD_HINT = r'\d[.,]\d'
+DMS_HINT = r'[°′\'’]'
+_dd_hint = re.compile(DD_HINT)
+_dms_hint = re.compile(DMS_HINT)
+
+NEGATIVE_HEMISPHERES = ('S', 'W', 'З', 'Ю')
+
+LAT_COLS = ('lat', 'latitude', 'широта', 'y')
+LNG_COLS = ('lng', 'lon', 'long', 'longitude', 'долгота', 'x')
+
+
+def resolve_geo_columns(columns:Iterable) -> Tuple[Optional[object], Optional[object], list]:
+    """(lat column, lng column, all coordinate-like columns) for one sheet.
+
+    Names are matched case-insensitively; on duplicates the first column wins.
+    "Coordinate-like" also covers free-text columns such as "Координаты".
+    """
+    names = {}
+    for c in columns:
+        names.setdefault(str(c).strip().lower(), c)
+    col_lat = next((names[k] for k in LAT_COLS if k in names), None)
+    col_lng = next((names[k] for k in LNG_COLS if k in names), None)
+    geo = [c for k, c in names.items() if k in LAT_COLS or k in LNG_COLS or "коорд" in k]
+    return col_lat, col_lng, geo
+
+
+def _dms_to_dd(deg, minutes, seconds, hemisphere):
+    deg = float(str(deg).replace(',', '.'))
+    minutes = float(str(minutes).replace(',', '.')) if minutes is not None else 0.0
+    seconds = float(str(seconds).replace(',', '.')) if seconds is not None else 0.0
+    dd = deg + minutes/60.0 + seconds/3600.0
+    if hemisphere and str(hemisphere).upper() in NEGATIVE_HEMISPHERES:
+        dd = -dd
+    return dd
+
+
+def detect_coords_from_text(text: str):
+    if not text:
+        return (None, None)
+    t = str(text)
+    if _dd_hint.search(t):
+        m = COORD_DD_RE.search(t)
+        if m:
+            try:
+                lat = float(m.group('lat').replace(',', '.'))
+                lng = float(m.group('lng').replace(',', '.'))
+                if -90 <= lat <= 90 and -180 <= lng <= 180:
+                    return (lat, lng)
+            except Exception:
+                pass
+    if _dms_hint.search(t):
+        m = DMS_RE.search(t)
+        if m:
+            try:
+                lat = None
+                if m.group('lat_deg') is not None:
+                    lat = _dms_to_dd(m.group('lat_deg'), m.group('lat_min'), m.group('lat_sec'), m.group('lat_hem') or 'N')
+                lng = _dms_to_dd(m.group('lng_deg'), m.group('lng_min'), m.group('lng_sec'), m.group('lng_hem') or 'E')
+                return (lat, lng)
+            except Exception:
+                pass
+    return (None, None)
+
+
+def detect_coords_from_row(row: dict):
+    """Single-row form of detect_coords_frame (explicit columns, then all cells as text)."""
+    col_lat, col_lng, _ = resolve_geo_columns(row.keys())
+    if col_lat is not None and col_lng is not None:
+        try:
+            return (float(str(row[col_lat]).replace(',', '.')), float(str(row[col_lng]).replace(',', '.')))
+        except (TypeError, ValueError):
+            pass
+    joined = " ".join(str(row.get(k) or '') for k in row.keys())
+    return detect_coords_from_text(joined)
+
+
+def _num(s: pd.Series) -> pd.Series:
+    return pd.to_numeric(s.str.replace(",", ".", regex=False), errors="coerce")
+
+
+def _dms_series(m: pd.DataFrame, part:str, default_hem:str) -> pd.Series:
+    dd = _num(m[part + "_deg"]) + _num(m[part + "_min"]).fillna(0) / 60.0 + _num(m[part + "_sec"]).fillna(0) / 3600.0
+    neg = m[part + "_hem"].fillna(default_hem).str.upper().isin(NEGATIVE_HEMISPHERES)
+    return dd.where(~neg, -dd)
+
+
+def _hint_masks(t: pd.Series):
+    """(may hold a decimal pair, may hold DMS) boolean arrays for a string Series."""
+    s = t.astype("string[pyarrow]") if pyarrow is not None else t
+    return (s.str.contains(DD_HINT, regex=True).to_numpy(dtype=bool),
+            s.str.contains(DMS_HINT, regex=True).to_numpy(dtype=bool))
+
+
+def detect_coords_many(texts: pd.Series):
+    """Batch detect_coords_from_text: returns (lat, lng) float Series, NaN where nothing found.
+
+    The prefilters run over the whole column; the extracting regexes only over rows they pass.
+    """
+    t = texts.fillna("").astype(str)
+    lat = pd.Series(float("nan"), index=t.index)
+    lng = pd.Series(float("nan"), index=t.index)
+    dd, dms = _hint_masks(t)
+    if dd.any():
+        m = t[dd].str.extract(COORD_DD_RE)
+        la, ln = _num(m["lat"]), _num(m["lng"])
+        ok = la.between(-90, 90) & ln.between(-180, 180)
+        lat[dd], lng[dd] = la.where(ok), ln.where(ok)
+    if dms.any():
+        dms = dms & lng.isna().to_numpy()
+        if dms.any():
+            m = t[dms].str.extract(DMS_RE)
+            lng[dms] = _dms_series(m, "lng", "E")
+            lat[dms] = _dms_series(m, "lat", "N")  # NaN when only the longitude was written
+    return lat, lng
+
+
+def detect_coords_frame(df: pd.DataFrame, columns:Optional[tuple]=None):
+    """Column-wise detect_coords_from_row over a whole frame.
+
+    `columns` is a resolve_geo_columns() result, when the caller already has one for the sheet.
+    """
+    col_lat, col_lng, _ = columns or resolve_geo_columns(df.columns)
+    lat = pd.Series(float("nan"), index=df.index)
+    lng = pd.Series(float("nan"), index=df.index)
+    if col_lat is not None and col_lng is not None:
+        lat, lng = _num(df[col_lat].astype(str)), _num(df[col_lng].astype(str))
+    explicit = lat.notna() & lng.notna()
+    lat, lng = lat.where(explicit), lng.where(explicit)
+    rest = ~explicit
+    if rest.any():
+        # Fallback: detect inside text/address (all cells joined, as in detect_coords_from_row)
+        sub = df[rest]
+        joined = None
+        for c in sub.columns:
+            v = sub[c].astype(object).where(sub[c].notna(), "").astype(str)
+            joined = v if joined is None else joined + " " + v
+        la, ln = detect_coords_many(joined)
+        lat[rest], lng[rest] = la, ln
+    return lat, lng
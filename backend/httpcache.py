@@ -0,0 +1,88 @@
+"""Conditional and partial HTTP responses.
+
+JSON endpoints get a strong ETag built from the store's data version, so a
+client (or a proxy) revalidating with If-None-Match gets a 304 before anything
+is recomputed. Rendered files are content-addressed and immutable: they get a
+long Cache-Control, an ETag and single-range Range support (resumable
+downloads), which Starlette's FileResponse does not provide.
+"""
+import os, re
+from urllib.parse import quote
+from typing import Callable, Optional
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response, StreamingResponse
+
+JSON_CACHE_CONTROL = "no-cache"                            # always revalidate, 304 is cheap
+FILE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+CHUNK = 64 * 1024
+
+_range_re = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def etag_matches(request:Request, etag:str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # If-None-Match uses weak comparison
+    tags = [t.strip().removeprefix("W/") for t in header.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in tags
+
+
+def cached_json(request:Request, etag:str, build:Callable[[], object]) -> Response:
+    """304 if the client already has `etag`, else build() serialized with the ETag attached."""
+    headers = {"ETag": etag, "Cache-Control": JSON_CACHE_CONTROL}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(build(), headers=headers)
+
+
+def _byte_range(header:Optional[str], size:int):
+    """(start, end) inclusive for a single satisfiable range; None to send the whole file; False if unsatisfiable."""
+    m = _range_re.fullmatch((header or "").strip())
+    if not m or m.groups() == ("", ""):
+        return None  # absent, malformed or multi-range: a full 200 is always allowed
+    first, last = m.groups()
+    if first == "":
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read(path:str, start:int, length:int):
+    with open(path, "rb") as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+
+def _disposition(filename:str) -> str:
+    # as FileResponse does it
+    quoted = quote(filename)
+    return f"attachment; filename*=utf-8''{quoted}" if quoted != filename else f'attachment; filename="{filename}"'
+
+
+def file_response(request:Request, path:str, filename:str, media_type:str) -> Response:
+    """A cached file with ETag, long-lived Cache-Control and Range support."""
+    st = os.stat(path)
+    # size and mtime: a re-rendered file (after eviction) may differ byte-wise
+    etag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+    headers = {"ETag": etag, "Cache-Control": FILE_CACHE_CONTROL, "Accept-Ranges": "bytes"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    if_range = request.headers.get("if-range")
+    rng = _byte_range(request.headers.get("range"), st.st_size) if not if_range or if_range == etag else None
+    if rng is False:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{st.st_size}"})
+    if rng is None:
+        return FileResponse(path, filename=filename, media_type=media_type, headers=headers)
+    start, end = rng
+    return StreamingResponse(_read(path, start, end - start + 1), status_code=206, media_type=media_type, headers={
+        **headers, "Content-Range": f"bytes {start}-{end}/{st.st_size}", "Content-Length": str(end - start + 1),
+        "Content-Disposition": _disposition(filename)})
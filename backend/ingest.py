@@ -0,0 +1,405 @@
+"""Parsing and normalization of uploaded appeal files.
+
+Everything here is free of app state (no FastAPI app, no store), so it can be
+imported by the parse worker processes as well as by app.py.
+"""
+import os, re, logging, warnings, itertools
+from typing import Iterable, List, Optional
+from fastapi import UploadFile
+import pandas as pd
+from matcher import KeywordMatcher
+from topics import top_of
+from metrics import stage
+from appeals import AppealTable
+from geotag import (
+    detect_coords_from_text, detect_coords_many, detect_coords_frame,
+    resolve_geo_columns,
+)
+
+logger = logging.getLogger("uvicorn.error")
+
+# Optional deps
+try:
+    import docx  # python-docx
+except Exception:
+    docx = None
+try:
+    from PyPDF2 import PdfReader
+except Exception:
+    PdfReader = None
+try:
+    import python_calamine  # fast Rust xlsx/xls reader, used by pandas engine="calamine"
+except Exception:
+    python_calamine = None
+
+# pandas Excel engine; default: calamine when installed, else pandas' choice (openpyxl for xlsx)
+EXCEL_ENGINE = os.environ.get("EXCEL_ENGINE") or ("calamine" if python_calamine else None)
+
+KEYWORDS = {
+    "Благоустройство": ["дворы","освещение","урны","лавочки","парк","сквер","уборка","детская площадка","озеленение","благоустройство"],
+    "Окружающая среда": ["экология","свалка","запах","дым","выбросы","река","водоём","шум","окружающая среда","природа"],
+    "Доступность цифровых услуг": ["госуслуги","интернет","цифров","сайт","онлайн","мфц запись","портал"],
+    "Дороги": ["дорога","ямы","ремонт дороги","асфальт","яма","бордюр","разметка","снег","уборка снега","тротуар"],
+    "Образование": ["школа","детсад","садик","учитель","образование","лицей","гимназия"],
+    "Культура": ["культура","дом культуры","библиотека","музей","концерт"],
+    "Здравоохранение": ["поликлиника","больница","врач","медицина","здравоохранение","скорая"],
+    "Транспортное обслуживание": ["автобус","маршрут","транспорт","расписание","остановка","электричка","метро"],
+    "ЖКХ": ["жкх","квартира","подъезд","управляющая компания","счетчик","отопление","вода","горячая вода","холодная вода","электричество","лифт"],
+    "Адаптация участников СВО": ["СВО","ветеран","реабилитация","поддержка","пособие"],
+    "Политическое доверие": ["мэр","глава","администрация","власть","политика","доверие"]
+}
+
+def guess_category(text:str)->str:
+    return MATCHER.category(text)
+
+DATE_RE = re.compile(r"(20\d{2}[-./]\d{1,2}[-./]\d{1,2}|\d{1,2}[-./]\d{1,2}[-./]20\d{2})")
+ADDR_RE = re.compile(r"(ул\.\s*[А-ЯЁа-яёA-Za-z0-9\- ]+|проспект\s+[А-ЯЁа-яёA-Za-z\- ]+|дом\s*\d+[А-Яа-яA-Za-z]?)")
+
+
+DOBRODEL_STATUS_ALLOW = {
+    "в работе исполнителя",
+    "на исполнении",
+    "на уточнении модератора",
+}
+
+def open_workbook(upload: UploadFile):
+    """Open an uploaded workbook once; the same ExcelFile serves sniffing, parsing and the fallback."""
+    for engine in dict.fromkeys([EXCEL_ENGINE, None]):
+        try:
+            upload.file.seek(0)
+            with stage("excel_open"):
+                return pd.ExcelFile(upload.file, engine=engine)
+        except Exception:
+            pass
+    upload.file.seek(0)
+    return None
+
+def parse_dobrodel_excel(xls: pd.ExcelFile):
+    """Return list of normalized rows from a Добродел выгрузка, or None if not applicable.
+    Each row: source,date,address,text,category,lat,lng,municipality_id(None for now)"""
+    try:
+        # choose sheet that has typical columns; nrows=0 reads the header row only
+        target_sheet = None
+        header = None
+        with stage("excel_sniff"):
+            for s in xls.sheet_names:
+                header = xls.parse(s, nrows=0).columns
+                cols = [str(c).strip().lower() for c in header]
+                if ("омсу" in cols) and (("статус" in cols) or any("статус" in c for c in cols)):
+                    target_sheet = s
+                    break
+        if not target_sheet:
+            return None
+        # normalize columns
+        cols_map = {str(c).strip().lower(): c for c in header}
+        def pick(*variants):
+            for v in variants:
+                v_low = v.lower()
+                if v_low in cols_map: return cols_map[v_low]
+                # fuzzy contains match
+                for k in cols_map:
+                    if v_low in k: return cols_map[k]
+            return None
+
+        col_omcu = pick("ОМСУ")
+        col_status = pick("Статус")
+        col_source = pick("Источник")
+        col_date = pick("Дата обращения","Дата (первого взятия в работу)","Дата")
+        col_address = pick("Адрес")
+        col_fact = pick("Факт")
+        col_descr = pick("Описание")
+
+        if not (col_omcu and col_status and (col_fact or col_descr) and col_address):
+            # not a recognizable layout
+            return None
+
+        # read only what the normalization uses (+ coordinate columns)
+        geo = resolve_geo_columns(header)
+        geo_cols = geo[2]
+        usecols = [c for c in (col_omcu, col_status, col_source, col_date, col_address, col_fact, col_descr) if c]
+        usecols += [c for c in geo_cols if c not in usecols]
+        with stage("excel_read"):
+            df = xls.parse(target_sheet, usecols=usecols)
+
+        with stage("filter"):
+            df2 = df.copy()
+            # filter OМСУ содержит Люберцы
+            df2 = df2[df2[col_omcu].astype(str).str.contains("Люберц", case=False, na=False)]
+            # filter statuses
+            df2 = df2[df2[col_status].astype(str).str.strip().str.lower().isin(DOBRODEL_STATUS_ALLOW)]
+        if df2.empty:
+            return []
+
+        return dobrodel_rows(df2, col_source, col_date, col_address, col_fact, col_descr, geo_columns=geo)
+    except Exception as e:
+        # If anything goes wrong, fall back to generic extraction
+        return None
+
+def _parse_dates(raw: pd.Series) -> pd.Series:
+    """One to_datetime over the whole column; mixed layouts get a second, per-element pass."""
+    if pd.api.types.is_datetime64_any_dtype(raw):
+        return raw
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        parsed = pd.to_datetime(raw, errors="coerce")
+        rest = parsed.isna() & raw.notna()
+        if rest.any():
+            parsed[rest] = pd.to_datetime(raw[rest].astype(str), errors="coerce", format="mixed")
+    return parsed
+
+def dobrodel_rows(df2: pd.DataFrame, col_source, col_date, col_address, col_fact, col_descr,
+                  geo_columns:Optional[tuple]=None) -> list:
+    """Column-wise construction of normalized rows from a filtered Добродел frame.
+
+    `geo_columns` is the sheet's resolve_geo_columns() result, if already known.
+    """
+    df2 = df2.reset_index(drop=True)
+    n = len(df2)
+    if col_source:
+        src = df2[col_source]
+        src = src.astype(str).where(src.notna() & (src.astype(str) != ""), "Добродел")
+    else:
+        src = pd.Series(["Добродел"] * n, dtype=object)
+
+    # normalize date to yyyy-mm-dd; unparseable values keep their first 10 chars
+    if col_date:
+        raw = df2[col_date]
+        with stage("dates"):
+            parsed = _parse_dates(raw)
+        dates = parsed.dt.strftime("%Y-%m-%d").where(parsed.notna(), raw.astype(str).str.slice(0, 10))
+        dates = dates.astype(object).where(raw.notna(), None)
+    else:
+        dates = pd.Series([None] * n, dtype=object)
+
+    if col_address:
+        addr = df2[col_address].astype(str).str.strip()
+        address = addr.astype(object).where(df2[col_address].notna() & (addr != ""), None)
+    else:
+        address = pd.Series([None] * n, dtype=object)
+
+    # Факт + Описание joined with a newline, skipping empty cells
+    text = pd.Series([""] * n, dtype=object)
+    started = pd.Series(False, index=text.index)
+    for c in (col_fact, col_descr):
+        if not c: continue
+        v = df2[c]
+        has = v.notna()
+        sep = started.map({True: "\n", False: ""})
+        text = text.where(~has, text + sep + v.astype(str))
+        started |= has
+    text = text.str.strip()
+
+    with stage("categorize"):
+        cats, _ = MATCHER.analyze_many(text)
+    with stage("geotag"):
+        lat, lng = detect_coords_frame(df2, geo_columns)
+    lat = lat.astype(object).where(lat.notna(), None)
+    lng = lng.astype(object).where(lng.notna(), None)
+
+    return [
+        {"source": s, "date": d, "address": a, "text": t, "category": c, "lat": la, "lng": ln, "municipality_id": None}
+        for s, d, a, t, c, la, ln in zip(src, dates, address, text, cats, lat, lng)
+    ]
+
+def extract_text_from_file(up: UploadFile, xls: Optional[pd.ExcelFile] = None) -> str:
+    name = up.filename or "file"
+    if name.lower().endswith((".xlsx",".xls",".csv")):
+        try:
+            if name.lower().endswith(".csv"):
+                df = pd.read_csv(up.file)
+            elif xls is not None:
+                # reuse the workbook already opened for the Добродел check
+                df = xls.parse(xls.sheet_names[0])
+            else:
+                df = pd.read_excel(up.file, engine=EXCEL_ENGINE)
+            cols = [c.lower() for c in df.columns]
+            text_cols = [i for i,c in enumerate(cols) if any(x in c for x in ["текст","сообщ","опис","обращ","post","message"])]
+            if text_cols:
+                return "\n".join(str(x) for x in df.iloc[:, text_cols[0]].astype(str).tolist())
+            else:
+                return df.to_csv(index=False)
+        except Exception as e:
+            return f"Не удалось прочитать таблицу: {e}"
+    if name.lower().endswith((".doc",".docx")) and docx:
+        try:
+            d = docx.Document(up.file)
+            return "\n".join(p.text for p in d.paragraphs)
+        except Exception as e:
+            return f"Не удалось прочитать DOCX: {e}"
+    if name.lower().endswith(".pdf") and PdfReader:
+        try:
+            return "\n".join(pdf_pages_text(up.file, 0, PDF_MAX_PAGES))
+        except Exception as e:
+            return f"Не удалось прочитать PDF: {e}"
+    # fallback
+    b = up.file.read()
+    try:
+        return b.decode("utf-8")
+    except Exception:
+        return b.decode("latin-1","ignore")
+
+def _norm_date(raw:str)->str:
+    raw = raw.replace('/','-').replace('.','-')
+    parts = raw.split('-')
+    if len(parts[0])==4:
+        y,m,d = parts
+    else:  # dd-mm-yyyy
+        d,m,y = parts
+    return f"{y}-{m.zfill(2)}-{d.zfill(2)}"
+
+def extract_fields(text:str, source:str):
+    date_match = DATE_RE.search(text)
+    date = _norm_date(date_match.group(0)) if date_match else None
+    addr_match = ADDR_RE.search(text)
+    address = addr_match.group(0) if addr_match else None
+    category = guess_category(text)
+    lat, lng = detect_coords_from_text((text or "") + " " + (address or ""))
+    return {
+        "source": source,
+        "date": date,
+        "address": address,
+        "text": text.strip()[:5000],
+        "category": category,
+        "lat": lat, "lng": lng,
+    }
+
+def extract_fields_many(texts: pd.Series, source:str) -> list:
+    """Batch extract_fields: one appeal per text, same fields, computed column-wise."""
+    texts = texts.fillna("").astype(str).reset_index(drop=True)
+    with stage("fields"):
+        dates = texts.str.extract(DATE_RE)[0]
+        dates = dates.map(_norm_date, na_action="ignore").astype(object).where(dates.notna(), None)
+        address = texts.str.extract(ADDR_RE)[0]
+        address = address.astype(object).where(address.notna(), None)
+    with stage("categorize"):
+        cats, _ = MATCHER.analyze_many(texts)
+    with stage("geotag"):
+        lat, lng = detect_coords_many(texts + " " + address.fillna(""))
+    lat = lat.astype(object).where(lat.notna(), None)
+    lng = lng.astype(object).where(lng.notna(), None)
+    return [
+        {"source": source, "date": d, "address": a, "text": t.strip()[:5000], "category": c, "lat": la, "lng": ln}
+        for d, a, t, c, la, ln in zip(dates, address, texts, cats, lat, lng)
+    ]
+
+CSV_CHUNK_ROWS = int(os.environ.get("CSV_CHUNK_ROWS", "20000"))
+TEXT_COL_HINTS = ["текст","сообщ","опис","обращ","post","message"]
+
+def iter_csv_appeals(up: UploadFile):
+    """Stream a CSV/TSV upload in chunks of CSV_CHUNK_ROWS, yielding one appeal per row.
+
+    The text column is found with the same name heuristics as extract_text_from_file;
+    without one, the row's non-empty cells are joined into the text.
+    """
+    name = up.filename or "file"
+    sep = "\t" if name.lower().endswith(".tsv") else ","
+    reader = pd.read_csv(up.file, sep=sep, chunksize=CSV_CHUNK_ROWS, dtype=str)
+    text_col = None
+    for i in itertools.count():
+        with stage("csv_read"):
+            chunk = next(reader, None)
+        if chunk is None:
+            break
+        if i == 0:
+            cols = [str(c).lower() for c in chunk.columns]
+            text_cols = [j for j,c in enumerate(cols) if any(x in c for x in TEXT_COL_HINTS)]
+            text_col = chunk.columns[text_cols[0]] if text_cols else None
+        if text_col is not None:
+            texts = chunk[text_col]
+        else:
+            texts = chunk.apply(lambda r: ", ".join(v for v in r if isinstance(v, str) and v), axis=1)
+        yield extract_fields_many(texts, name)
+
+
+RU_STOP = set("и,в,во,не,что,он,на,я,с,со,как,а,то,все,она,так,его,но,да,ты,к,у,же,вы,за,бы,по,ее,мне,есть,тут,они,мы,тебя,ничего,чтобы,когда,где,даже,или,если,без,из,под,при,для,над,про,после,между,это,этот,эта,эти,того,той,тем,теми,тех,та,тут,там,быть,будет,был,были,будут,же,ли,до,от,ну".split(","))
+
+POS_WORDS = set("хорошо,исправили,починили,спасибо,благодарим,улучшили,решено,устранено".split(","))
+NEG_WORDS = set("плохо,ужас,проблема,жалоба,не работает,сломано,грязь,мусор,яма,вонь,шум,некачественно,затопило,отсутствует,протечка,нет,нарушение".split(","))
+
+# Built once: one scan per text yields both category scores and sentiment
+MATCHER = KeywordMatcher(KEYWORDS, POS_WORDS, NEG_WORDS, default_category="ЖКХ")
+
+def sentiment_score(text:str)->float:
+    return MATCHER.sentiment(text)
+
+TOKEN_RE = re.compile(r"[А-ЯЁа-яёA-Za-z0-9\-]{3,}")
+
+def tokenize(text:str)->List[str]:
+    return [w for w in TOKEN_RE.findall((text or "").lower()) if w not in RU_STOP]
+
+def top_tokens(texts:Iterable[str], topn:int=5)->List[str]:
+    """Most frequent tokens, in bounded memory (Space-Saving, see topics.py)."""
+    return [w for w,_ in top_of((tokenize(t) for t in texts), topn)]
+
+# --- PDF: page ranges can be extracted by separate workers, see app._parse_pdf_spooled ---
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", "500"))
+PDF_SPLIT = os.environ.get("PDF_SPLIT", "none")  # none | page | paragraph
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+def pdf_page_count(src) -> int:
+    return len(PdfReader(src).pages)
+
+def pdf_pages_text(src, start:int, stop:int) -> List[str]:
+    """Text of pages [start, stop), extracted one page at a time."""
+    with stage("pdf_text"):
+        r = PdfReader(src)
+        return [r.pages[i].extract_text() or "" for i in range(start, min(stop, len(r.pages)))]
+
+def pdf_rows(pages:List[str], filename:str, split:Optional[str]=None) -> AppealTable:
+    """Appeals from extracted page texts: one per document, per page or per paragraph."""
+    split = split or PDF_SPLIT
+    if split == "page":
+        texts = [p for p in pages if p.strip()]
+    elif split == "paragraph":
+        texts = [para for p in pages for para in PARAGRAPH_RE.split(p) if para.strip()]
+    else:
+        return AppealTable.from_rows([extract_fields("\n".join(pages), filename)])
+    if not texts:
+        return AppealTable.from_rows([extract_fields("", filename)])
+    return AppealTable.from_rows(extract_fields_many(pd.Series(texts, dtype=object), filename))
+
+class ParseError(ValueError):
+    """The file cannot be ingested completely; the upload is rejected (HTTP 400)."""
+
+def parse_upload(f: UploadFile) -> AppealTable:
+    """Normalized rows for one uploaded file (municipality_id is set by the caller)."""
+    parsed = None
+    xls = None
+    name = (f.filename or '').lower()
+    if name.endswith(('.csv','.tsv')):
+        rows = AppealTable()  # compacted chunk by chunk
+        try:
+            for chunk_rows in iter_csv_appeals(f):
+                rows.extend(chunk_rows)
+            return rows
+        except Exception as e:
+            logger.warning(f"CSV stream failed for {f.filename}: {e}")
+            if rows:
+                # a partial file must not be registered as ingested: a retry would hit the upload cache
+                raise ParseError(f"Файл {f.filename} прочитан не полностью (ошибка после {len(rows)} строк): {e}")
+            f.file.seek(0)  # unreadable from the start: old single-blob fallback
+    if name.endswith('.pdf') and PdfReader:
+        try:
+            return pdf_rows(pdf_pages_text(f.file, 0, PDF_MAX_PAGES), f.filename)
+        except Exception as e:
+            return AppealTable.from_rows([extract_fields(f"Не удалось прочитать PDF: {e}", f.filename)])
+    # Try special Добродел parser for Excel
+    if name.endswith(('.xlsx','.xls')):
+        xls = open_workbook(f)
+        if xls is not None:
+            parsed = parse_dobrodel_excel(xls)
+    try:
+        if isinstance(parsed, list):
+            return AppealTable.from_rows(parsed)
+        # Fallback: treat whole file as one text blob
+        with stage("text_extract"):
+            text = extract_text_from_file(f, xls=xls)
+        return AppealTable.from_rows([extract_fields(text, f.filename)])
+    finally:
+        if xls is not None:
+            xls.close()
+
+def parse_path(path:str, filename:str) -> AppealTable:
+    """Process-pool entry point: parse a spooled upload from disk."""
+    with open(path, "rb") as fh:
+        return parse_upload(UploadFile(file=fh, filename=filename))
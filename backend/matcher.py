@@ -0,0 +1,110 @@
+"""Single-pass keyword matcher for categorization and sentiment.
+
+All keywords (KEYWORDS, POS_WORDS, NEG_WORDS) are merged into one trie which
+is compiled into a single regex, so each text is lowercased once and scanned
+once by the C regex engine instead of once per keyword.
+
+The regex is a lookahead tried at every offset; at each offset the trie
+alternation yields the longest keyword starting there. Shorter keywords at
+the same offset are exactly the prefixes of that match, so they are added
+from a precomputed prefix table. That gives the same "which keywords occur
+in the text" set as the `w in t` checks it replaces.
+"""
+import re
+from typing import Dict, Iterable, List, Tuple
+
+
+def _trie_regex(words:Iterable[str]) -> str:
+    trie = {}
+    for w in words:
+        node = trie
+        for ch in w:
+            node = node.setdefault(ch, {})
+        node[""] = True
+
+    def emit(node):
+        alts = [re.escape(ch) + emit(sub) for ch, sub in sorted(node.items()) if ch != ""]
+        if not alts:
+            return ""
+        body = alts[0] if len(alts) == 1 else "(?:" + "|".join(alts) + ")"
+        # children first, so the greedy match is the longest keyword
+        return "(?:" + body + ")?" if "" in node else body
+
+    return emit(trie)
+
+
+class KeywordMatcher:
+    """Compiled once at startup from the category and sentiment word lists.
+
+    Matching is case-insensitive. Keywords written in upper case in the source
+    lists (acronyms such as "СВО") only match as whole words: a plain substring
+    test for "сво" would fire on "своевременно", "свой", etc.
+    """
+
+    def __init__(self, keywords:Dict[str, List[str]], positive:Iterable[str], negative:Iterable[str],
+                 default_category:str="ЖКХ"):
+        self.categories = list(keywords)
+        self.default_category = default_category
+        # pattern -> (category indices, with repeats as in the source lists), sentiment delta
+        self._cats: Dict[str, List[int]] = {}
+        self._sent: Dict[str, int] = {}
+        self._whole_word = set()
+        for ci, cat in enumerate(self.categories):
+            for kw in keywords[cat]:
+                p = kw.lower()
+                self._cats.setdefault(p, []).append(ci)
+                if kw.isupper():
+                    self._whole_word.add(p)
+        for w in positive:
+            self._sent[w.lower()] = self._sent.get(w.lower(), 0) + 1
+        for w in negative:
+            self._sent[w.lower()] = self._sent.get(w.lower(), 0) - 1
+        patterns = set(self._cats) | set(self._sent)
+        self._prefixes = {p: frozenset(q for q in patterns if p.startswith(q)) for p in patterns}
+        self._re = re.compile("(?=(" + _trie_regex(patterns) + "))")
+        self._word_re = {p: re.compile(r"(?<!\w)" + re.escape(p) + r"(?!\w)") for p in self._whole_word}
+
+    def find(self, text:str) -> set:
+        """Set of (lowercased) keywords present in text."""
+        t = (text or "").lower()
+        found = set()
+        for longest in set(self._re.findall(t)):
+            found |= self._prefixes[longest]
+        for p, rx in self._word_re.items():
+            if p in found and not rx.search(t):
+                found.discard(p)
+        return found
+
+    def _category_from(self, found:set) -> str:
+        scores = [0] * len(self.categories)
+        for p in found:
+            for ci in self._cats.get(p, ()):
+                scores[ci] += 1
+        best, score = None, 0
+        for ci, s in enumerate(scores):  # strict '>' keeps the first best category
+            if s > score:
+                score, best = s, self.categories[ci]
+        return best or self.default_category
+
+    def _sentiment_from(self, found:set) -> float:
+        score = sum(self._sent.get(p, 0) for p in found)
+        return 1.0 if score > 0 else (-1.0 if score < 0 else 0.0)
+
+    def category(self, text:str) -> str:
+        return self._category_from(self.find(text))
+
+    def sentiment(self, text:str) -> float:
+        return self._sentiment_from(self.find(text))
+
+    def analyze(self, text:str) -> Tuple[str, float]:
+        """(category, sentiment) from one scan."""
+        found = self.find(text)
+        return self._category_from(found), self._sentiment_from(found)
+
+    def analyze_many(self, texts:Iterable) -> Tuple[List[str], List[float]]:
+        """Batch form over a list or pandas Series; NaN/None count as empty text."""
+        cats, sents = [], []
+        for t in texts:
+            c, s = self.analyze(t if isinstance(t, str) else "")
+            cats.append(c); sents.append(s)
+        return cats, sents
@@ -0,0 +1,238 @@
+"""Prometheus metrics for the API and the ingest pipeline, without a client library.
+
+Counters and histograms live in this process; `render` returns the text
+exposition format served by GET /api/metrics. With several worker processes
+each one writes a snapshot to a shared directory every few seconds and
+`render` adds the other workers' snapshots, so any worker answers for all.
+Stages that run in the parse pool are timed there with `stage` and come back
+with the result (`collect`). MetricsMiddleware is plain ASGI: no per-request
+Request/Response objects, just the status and timing from the send stream.
+"""
+import os, json, glob, time, uuid, bisect, threading
+from contextlib import contextmanager
+from typing import Callable, List, Optional, Tuple
+import anyio, anyio.to_thread
+import profiler
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RATE_BUCKETS = (10, 100, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8)   # rows/s, bytes/s
+
+_metrics = {}
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra="") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(v) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name:str, help:str, labels:Tuple[str, ...]=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics[name] = self
+
+    def values(self) -> dict:
+        with self._lock:
+            return {k: (list(v) if isinstance(v, list) else v) for k, v in self._values.items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount:float=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    @staticmethod
+    def add(into:dict, key, value):
+        into[key] = into.get(key, 0) + value
+
+    def lines(self, values:dict):
+        for k, v in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labels, k)} {_num(v)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name:str, help:str, labels:Tuple[str, ...]=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value:float, *labels):
+        i = bisect.bisect_left(self.buckets, value)  # first bucket with value <= le
+        with self._lock:
+            v = self._values.get(labels)
+            if v is None:
+                v = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]   # counts per bucket, +Inf, sum
+            v[i] += 1
+            v[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, *labels)
+
+    @staticmethod
+    def add(into:dict, key, value):
+        cur = into.get(key)
+        into[key] = list(value) if cur is None or len(cur) != len(value) else [a + b for a, b in zip(cur, value)]
+
+    def lines(self, values:dict):
+        for k, v in sorted(values.items()):
+            total = 0
+            for le, n in zip((*map(_num, self.buckets), "+Inf"), v[:-1]):
+                total += n
+                le_label = f'le="{le}"'
+                yield f"{self.name}_bucket{_labels(self.labels, k, le_label)} {total}"
+            yield f"{self.name}_sum{_labels(self.labels, k)} {_num(v[-1])}"
+            yield f"{self.name}_count{_labels(self.labels, k)} {total}"
+
+
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests", ("method", "route", "status"))
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "HTTP request time, until the body is sent",
+                         ("method", "route"))
+INGEST_STAGE = Histogram("ingest_stage_seconds", "Time per ingest stage and file", ("stage", "file_type"))
+INGEST_FILE_SECONDS = Histogram("ingest_file_seconds", "Time to ingest one file", ("file_type",))
+INGEST_FILES = Counter("ingest_files_total", "Uploaded files; cached = content already ingested",
+                       ("file_type", "result"))
+INGEST_ROWS = Counter("ingest_rows_total", "Appeals stored", ("file_type",))
+INGEST_BYTES = Counter("ingest_bytes_total", "Uploaded bytes", ("file_type",))
+INGEST_ROWS_RATE = Histogram("ingest_rows_per_second", "Per-file ingest throughput, rows/s", ("file_type",),
+                             RATE_BUCKETS)
+INGEST_BYTES_RATE = Histogram("ingest_bytes_per_second", "Per-file ingest throughput, bytes/s", ("file_type",),
+                              RATE_BUCKETS)
+RENDER_SECONDS = Histogram("render_seconds", "Rendering of downloadable files", ("kind", "format"))
+
+
+# --- stages timed inside parse workers ---
+_local = threading.local()
+
+
+@contextmanager
+def stage(name:str):
+    """Time a block when running under `collect`; a no-op otherwise."""
+    timings = getattr(_local, "timings", None)
+    if timings is None:
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append((name, time.perf_counter() - t))
+
+
+def collect(fn:Callable, *args):
+    """(fn(*args), [(stage, seconds)]): the stages fn went through. Picklable for the process pool."""
+    _local.timings = timings = []
+    try:
+        return fn(*args), timings
+    finally:
+        _local.timings = None
+
+
+# --- several worker processes ---
+def _snapshot() -> dict:
+    return {m.name: [[list(k), v] for k, v in m.values().items()] for m in _metrics.values()}
+
+
+def write_snapshot(directory:str):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{os.getpid()}.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(_snapshot(), f)
+    os.replace(path + ".tmp", path)
+
+
+def _other_snapshots(directory:str, max_age:float) -> List[dict]:
+    out = []
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        if os.path.basename(path) == f"{os.getpid()}.json":
+            continue
+        try:
+            if time.time() - os.path.getmtime(path) > max_age:
+                os.unlink(path)  # its process is gone
+                continue
+            with open(path) as f:
+                out.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return out
+
+
+def render(directory:Optional[str]=None, max_age:float=60) -> str:
+    """Text exposition format: this process, plus the snapshots other processes left in `directory`."""
+    others = _other_snapshots(directory, max_age) if directory else []
+    out = []
+    for m in _metrics.values():
+        values = m.values()
+        for snap in others:
+            for k, v in snap.get(m.name, []):
+                m.add(values, tuple(k), v)
+        out += [f"# HELP {m.name} {m.help}", f"# TYPE {m.name} {m.kind}", *m.lines(values)]
+    return "\n".join(out) + "\n"
+
+
+class MetricsMiddleware:
+    """Request count and latency per route template; with the profile token, a sampled profile.
+
+    A request sent with `X-Profile: <token>` is profiled (profiler.Sampler); the
+    folded stacks are saved to `profile_dir` and the response carries X-Profile-Id.
+    """
+
+    def __init__(self, app, profile_token:str="", profile_dir:str=""):
+        self.app = app
+        self.profile_token = profile_token.encode()
+        self.profile_dir = profile_dir
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+        sampler = profile_id = None
+        if self.profile_token and (b"x-profile", self.profile_token) in scope["headers"]:
+            profile_id = uuid.uuid4().hex
+            sampler = profiler.Sampler().start()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if profile_id:
+                    message["headers"] = [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        t = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_SECONDS.observe(time.perf_counter() - t, scope["method"], path)
+            HTTP_REQUESTS.inc(scope["method"], path, str(status))
+            if sampler:
+                # joining the sampler thread and writing the file would block the loop; shielded so a
+                # cancelled request still stops its sampler
+                with anyio.CancelScope(shield=True):
+                    await anyio.to_thread.run_sync(self._save_profile, sampler, profile_id)
+
+    def _save_profile(self, sampler:"profiler.Sampler", profile_id:str):
+        sampler.stop()
+        sampler.save(os.path.join(self.profile_dir, f"{profile_id}.folded"))
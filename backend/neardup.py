@@ -0,0 +1,104 @@
+"""Near-duplicate fingerprints for appeal texts (MinHash + LSH).
+
+The same complaint arrives through several channels with small edits
+(greetings, punctuation, word endings, one more sentence). A text is reduced
+to the set of its stemmed content words; two texts are near-duplicates when
+the Jaccard similarity of those sets is at least THRESHOLD and their addresses
+and dates do not contradict each other.
+
+Candidates are found without a scan: PERMUTATIONS MinHash values are cut into
+BANDS bands, and each band (with the municipality) hashes to one key. Texts
+sharing any key are compared exactly; with 8 bands of 4 rows a pair at
+Jaccard 0.7 shares a key with probability ~0.9, at 0.3 with ~0.06. Only the
+first report of a group is indexed, so later copies are matched against it.
+"""
+import re, datetime as dt
+from collections import namedtuple
+from functools import lru_cache
+from hashlib import blake2b
+from typing import Optional, Tuple
+import numpy as np
+from geocode import parse_address
+
+THRESHOLD = 0.7
+PERMUTATIONS = 32
+BANDS = 8            # PERMUTATIONS / BANDS rows per band
+MIN_WORDS = 3        # shorter texts ("яма у дома") are too generic to fingerprint
+STEM = 5             # words are cut to this many letters so case endings still match
+DATE_WINDOW = 7      # days between two reports of one complaint
+
+WORD_RE = re.compile(r"[a-zа-я0-9]+")
+# politeness and filler words that channels add or drop
+STOP_WORDS = {
+    "и", "в", "во", "на", "с", "со", "к", "ко", "у", "о", "об", "от", "до", "по", "за", "из", "для", "что", "это",
+    "а", "но", "же", "ли", "бы", "уже", "еще", "очень", "так", "как", "все", "мы", "я", "вы", "нас", "нам",
+    "добрый", "доброе", "день", "утро", "вечер", "здравствуйте", "уважаемые", "пожалуйста", "спасибо",
+    "просим", "прошу", "помогите", "заранее",
+}
+
+_rng = np.random.default_rng(20240501)
+_A = _rng.integers(1, 2**63, PERMUTATIONS, dtype=np.uint64) | np.uint64(1)
+_B = _rng.integers(0, 2**63, PERMUTATIONS, dtype=np.uint64)
+
+Signature = namedtuple("Signature", "words keys address day")
+
+
+@lru_cache(maxsize=200000)
+def _word_hash(w:str) -> int:
+    return int.from_bytes(blake2b(w.encode(), digest_size=8).digest(), "little")
+
+
+def words_of(text:str) -> Tuple[str, ...]:
+    """Sorted distinct stemmed content words."""
+    t = str(text or "").lower().replace("ё", "е")
+    return tuple(sorted({w[:STEM] for w in WORD_RE.findall(t) if len(w) > 1 and w not in STOP_WORDS}))
+
+
+def minhash(words:Tuple[str, ...]) -> np.ndarray:
+    h = np.fromiter((_word_hash(w) for w in words), dtype=np.uint64, count=len(words))
+    # multiply-shift hashing; uint64 products wrap around
+    return ((_A[:, None] * h[None, :] + _B[:, None]) >> np.uint64(32)).min(axis=1)
+
+
+def _band_keys(mh:np.ndarray, municipality_id:int) -> Tuple[int, ...]:
+    rows = PERMUTATIONS // BANDS
+    prefix = municipality_id.to_bytes(8, "little", signed=True)
+    return tuple(int.from_bytes(blake2b(prefix + bytes([i]) + mh[i*rows:(i+1)*rows].tobytes(),
+                                        digest_size=8).digest(), "little", signed=True)
+                 for i in range(BANDS))
+
+
+def address_key(address:Optional[str]) -> Optional[str]:
+    parsed = parse_address(address) if address else None
+    if not parsed:
+        return None
+    _, words, house = parsed
+    return " ".join(words) + "|" + (house or "")
+
+
+def _day(date:Optional[str]) -> Optional[int]:
+    try:
+        return dt.date.fromisoformat(str(date)[:10]).toordinal()
+    except (TypeError, ValueError):
+        return None
+
+
+def signature(text:str, address:Optional[str]=None, date:Optional[str]=None,
+              municipality_id:Optional[int]=None) -> Optional[Signature]:
+    """Fingerprint of one appeal, or None when the text is too short to compare."""
+    words = words_of(text)
+    if len(words) < MIN_WORDS:
+        return None
+    return Signature(frozenset(words), _band_keys(minhash(words), municipality_id or 0),
+                     address_key(address), _day(date))
+
+
+def is_near(sig:Signature, words:str, address:Optional[str], day:Optional[int]) -> bool:
+    """sig vs a stored (words, address key, day); a missing address or date does not contradict."""
+    if sig.address and address and sig.address != address:
+        return False
+    if sig.day is not None and day is not None and abs(sig.day - day) > DATE_WINDOW:
+        return False
+    b = words.split()
+    common = len(sig.words.intersection(b))
+    return common >= THRESHOLD * (len(sig.words) + len(b) - common)
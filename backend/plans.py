@@ -0,0 +1,145 @@
+"""Action plan text and its DOCX/PDF renderings.
+
+Free of app state, so renders can run in the parse worker processes. The PDF
+font is looked up and registered once, at import.
+"""
+import io, os, bisect, logging, datetime as dt
+from itertools import accumulate
+from typing import List, Optional
+
+logger = logging.getLogger("uvicorn.error")
+
+# Optional deps
+try:
+    import docx  # python-docx
+except Exception:
+    docx = None
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+except Exception:
+    canvas = None
+
+# Unicode fonts with Cyrillic (DejaVu Sans on most Linux images)
+FONT_CANDIDATES = [
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf',
+]
+FONT_SIZE = 11
+LINE_HEIGHT = 14
+
+
+def _register_font() -> str:
+    if canvas is None:
+        return 'Helvetica'
+    font_path = next((p for p in FONT_CANDIDATES if os.path.exists(p)), None)
+    if font_path:
+        try:
+            pdfmetrics.registerFont(TTFont('DejaVuSans', font_path))
+            return 'DejaVuSans'
+        except Exception as e:
+            logger.warning(f"PDF font {font_path} not registered: {e}")
+    # Helvetica has no Cyrillic glyphs: Russian text renders as boxes
+    logger.warning("No Cyrillic TTF font found, plan PDFs fall back to Helvetica")
+    return 'Helvetica'
+
+PDF_FONT = _register_font()
+_char_widths = {}
+
+
+def make_plan_text(category:str, municipality_name:str, today:Optional[dt.date]=None)->str:
+    today = today or dt.date.today()
+    deadline = today + dt.timedelta(days=30)
+    steps = [
+      ("Диагностика проблематики","Собрать первичные данные, верифицировать адресные точки, составить карту очагов."),
+      ("Быстрые победы (до 2 недель)","Отработать 2–3 адреса с высокой видимостью; подготовить фото «до/после»."),
+      ("Системные меры","Запланировать закупки/МКУ/подрядчики, согласовать сметы и графики."),
+      ("Коммуникации","План публикаций в соцсетях, встречи с жителями, ответы в комментариях."),
+      ("Контроль и KPI","Еженедельный отчёт, дашборд метрик, опрос удовлетворённости.")
+    ]
+    lines = [f"План действий на месяц — {category} — {municipality_name}",
+             f"Период: {today.strftime('%d.%m.%Y')} — {deadline.strftime('%d.%m.%Y')}",
+             "", "Цели:", "- Повышение доверия жителей", "- Снижение количества проблемных обращений", "", "Шаги:"]
+    for i,(t,d) in enumerate(steps, start=1):
+        lines.append(f"{i}. {t}: {d}")
+    lines.append("Ключевые KPI: закрытие 80% обращений в срок; рост позитивных упоминаний на 20%; ≥3 встречи с жителями.")
+    return "\n".join(lines)
+
+
+def _char_width(ch:str) -> float:
+    w = _char_widths.get(ch)
+    if w is None:
+        w = _char_widths[ch] = pdfmetrics.stringWidth(ch, PDF_FONT, FONT_SIZE)
+    return w
+
+
+def wrap_line(line:str, max_width:float) -> List[str]:
+    """Split one line into pieces no wider than max_width.
+
+    Widths come from a per-character table and a running sum, so each cut is a
+    bisect instead of re-measuring shrinking prefixes. Cuts at the last space
+    that fits; a word wider than the line is cut mid-word.
+    """
+    if not line:
+        return [""]
+    cum = list(accumulate(_char_width(ch) for ch in line))
+    out, start, n = [], 0, len(line)
+    while start < n:
+        base = cum[start - 1] if start else 0.0
+        end = bisect.bisect_right(cum, base + max_width, lo=start)
+        if end >= n:
+            out.append(line[start:])
+            break
+        end = max(end, start + 1)
+        sp = line.rfind(" ", start, end + 1)
+        if sp > start:
+            end = sp
+        out.append(line[start:end].rstrip())
+        start = end
+        while start < n and line[start] == " ":
+            start += 1
+    return out
+
+
+def docx_bytes(text:str) -> bytes:
+    d = docx.Document()
+    for para in text.split("\n"):
+        d.add_paragraph(para)
+    buf = io.BytesIO()
+    d.save(buf)
+    return buf.getvalue()
+
+
+def pdf_bytes(text:str) -> bytes:
+    buf = io.BytesIO()
+    c = canvas.Canvas(buf, pagesize=A4)
+    width, height = A4
+    left, top, bottom = 2*cm, height-2*cm, 2*cm
+    c.setFont(PDF_FONT, FONT_SIZE)
+    y = top
+    for raw_line in (text or "").split("\n"):
+        for line in wrap_line(raw_line.replace("\t", "    "), width - 2*left):
+            c.drawString(left, y, line)
+            y -= LINE_HEIGHT
+            if y < bottom:
+                c.showPage()
+                c.setFont(PDF_FONT, FONT_SIZE)
+                y = top
+    c.save()
+    return buf.getvalue()
+
+
+def render_plan(category:str, municipality_name:str, date:str, fmt:str) -> bytes:
+    """Plan document bytes; fmt is 'docx' or 'pdf', date is ISO yyyy-mm-dd."""
+    text = make_plan_text(category, municipality_name, dt.date.fromisoformat(date))
+    if fmt == "docx":
+        if docx is None:
+            raise RuntimeError("python-docx не установлен")
+        return docx_bytes(text)
+    if canvas is None:
+        raise RuntimeError("reportlab не установлен")
+    return pdf_bytes(text)
@@ -0,0 +1,73 @@
+"""Sampling profiler for single requests (opt-in, see metrics.MetricsMiddleware).
+
+A thread takes the Python stacks of all other threads every `interval`
+seconds, so the event loop and the threadpool doing the request's blocking
+work are both covered; threads idling in a wait are skipped. Work in the parse
+processes is not sampled (its stages are in ingest_stage_seconds). The
+result is in "folded" form, one `frame;frame;frame count` line per stack,
+which flamegraph.pl and speedscope read directly. Other requests running at
+the same time show up in the samples too.
+"""
+import os, sys, glob, time, threading
+from collections import Counter
+
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", "0.005"))   # seconds between samples
+
+# leaf frames of threads that are waiting, not working
+IDLE_FILES = {"threading.py", "selectors.py", "queue.py", "connection.py"}
+
+
+def _frame_name(f) -> str:
+    return f"{os.path.basename(f.f_code.co_filename)}:{f.f_code.co_name}"
+
+
+def _idle(f) -> bool:
+    name = os.path.basename(f.f_code.co_filename)
+    return name in IDLE_FILES or (f.f_code.co_name == "_worker" and "futures" in f.f_code.co_filename)
+
+
+class Sampler:
+    def __init__(self, interval:float=PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def start(self) -> "Sampler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for tid, frame in sys._current_frames().items():
+                if tid == me or _idle(frame):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def save(self, path:str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+
+def prune(directory:str, max_age:float) -> int:
+    """Delete saved profiles older than max_age seconds; returns how many were removed."""
+    removed = 0
+    for path in glob.glob(os.path.join(directory, "*.folded")):
+        try:
+            if time.time() - os.path.getmtime(path) > max_age:
+                os.unlink(path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
@@ -0,0 +1,73 @@
+"""Full-text search terms for appeals (SQLite FTS5, see store.py).
+
+Texts go through the analytics tokenizer (ingest.tokenize), then a light
+Russian stemmer strips one inflectional ending, so "яма", "ямы" and "ямой",
+or "Смирновская" and "Смирновской", index to the same term. The stemmed text
+is what FTS5 indexes. Municipality and category are indexed as facet tokens
+in a second column ("m_4", "c_жкх" and the pair "m_4_c_жкх"), so a filter is
+one more doclist intersection, and filtering on both costs a single one.
+"""
+import re
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+MIN_STEM = 2
+REFLEXIVE = ("ся", "сь")
+# noun, adjective and verb endings, longest first
+ENDINGS = sorted({
+    "иями", "ями", "ами", "ией", "иям", "ием", "иях", "ях", "ах", "ев", "ов", "ей", "ой", "ий", "ям", "ем",
+    "ам", "ом", "ие", "ье", "ия", "ья", "ию", "ью", "еи", "ии", "а", "е", "и", "й", "о", "у", "ы", "ь", "ю", "я",
+    "ими", "ыми", "его", "ого", "ему", "ому", "ее", "ые", "ое", "ый", "им", "ым", "их", "ых", "ую", "юю", "ая",
+    "яя", "ою", "ею",
+    "ете", "йте", "ешь", "нно", "ить", "ыть", "ишь", "ует", "уют", "ила", "ыла", "ена", "или", "ыли", "ило",
+    "ыло", "ено", "ены", "ла", "на", "ли", "ло", "но", "ет", "ют", "ят", "ит", "ыт", "ны", "ть", "ил", "ыл", "ен",
+}, key=len, reverse=True)
+
+_facet_re = re.compile(r"\W+")
+
+
+@lru_cache(maxsize=100000)
+def stem(word:str) -> str:
+    w = word.lower().replace("ё", "е")
+    if not re.search("[а-я]", w):
+        return w
+    for suffix in REFLEXIVE:
+        if w.endswith(suffix) and len(w) - len(suffix) >= MIN_STEM + 1:
+            w = w[:-len(suffix)]
+            break
+    for e in ENDINGS:
+        if w.endswith(e) and len(w) - len(e) >= MIN_STEM:
+            return w[:-len(e)]
+    return w
+
+
+def terms(text:str, tokenize:Callable[[str], List[str]]) -> List[str]:
+    # hyphenated tokens ("северо-восток") become separate terms: FTS5 splits them anyway,
+    # and query terms are matched one by one, not as phrases
+    return [stem(p) for t in tokenize(text or "") for p in t.split("-") if p]
+
+
+def _facet(kind:str, value) -> str:
+    v = _facet_re.sub("_", str(value).lower()).strip("_") if value not in (None, "", "—", 0) else "none"
+    return f"{kind}_{v}"
+
+
+def facets(municipality_id, category) -> str:
+    """Facet column value of one appeal."""
+    m, c = _facet("m", municipality_id), _facet("c", category)
+    return f"{m} {c} {m}_{c}"
+
+
+def match_query(q:str, tokenize:Callable[[str], List[str]], municipality_id:Optional[int]=None,
+                category:Optional[str]=None) -> Optional[str]:
+    """FTS5 MATCH expression: all query terms (the last one as a prefix, for typing), plus facets."""
+    ts = list(dict.fromkeys(terms(q, tokenize)))
+    if not ts:
+        return None
+    phrases = [f'"{t}"' for t in ts]
+    phrases[-1] += "*"
+    expr = f"body : ({' '.join(phrases)})"
+    fs = [_facet("m", municipality_id) if municipality_id else None, _facet("c", category) if category else None]
+    if any(fs):
+        expr += f' AND facets : "{"_".join(f for f in fs if f)}"'
+    return expr
@@ -0,0 +1,745 @@
+"""Persistent appeal store (SQLite).
+
+Rows are appended in batches from upload_appeals and read back column-wise
+for analytics, so the API process never keeps the full history in memory.
+Running aggregates for the dashboard are maintained on insert, so analytics
+never has to rescan appeal texts. Each appeal is also checked against a
+MinHash/LSH signature index (neardup.py); near-duplicates are kept but linked
+to the first report via dup_of. Texts and addresses are indexed for full-text
+search (FTS5, terms from search.py). A file is written in chunks of
+APPEND_CHUNK rows, each its own short transaction, so other workers' writes
+are not held up for the length of a large upload; its aggregates and its
+uploads entry are committed together at the end.
+
+The database is shared by all worker processes (uvicorn --workers): it runs in
+WAL mode, so readers never wait for an ingest, and plans and upload job
+states live here too. Schema setup and backfills run under a file lock, once.
+"""
+import os, re, json, sqlite3, threading, datetime as dt
+from collections import Counter
+from contextlib import contextmanager
+from typing import Callable, Iterable, List, Optional, Tuple
+import neardup, search
+from topics import TopicSketch
+
+try:
+    import fcntl  # POSIX: serializes schema setup between worker processes
+except ImportError:
+    fcntl = None
+
+COLUMNS = ["source","date","address","text","category","lat","lng","municipality_id"]
+# what GET /api/appeals may project
+LIST_FIELDS = ["id", "batch_id", *COLUMNS, "dup_of"]
+
+# detail=full: on a contentless table, detail=column leaves bm25() at 0 for every row
+FTS_SCHEMA = """CREATE VIRTUAL TABLE IF NOT EXISTS appeal_fts USING fts5(
+    body, facets, content='', detail=full, prefix='2 3',
+    tokenize="unicode61 remove_diacritics 0 tokenchars '_'"
+);"""
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS appeals (
+    id              INTEGER PRIMARY KEY,
+    batch_id        TEXT,
+    file_hash       TEXT,      -- sha256 of the uploaded file the row came from
+    source          TEXT,
+    date            TEXT,      -- ISO yyyy-mm-dd when known
+    address         TEXT,
+    text            TEXT,
+    category        TEXT,
+    lat             REAL,
+    lng             REAL,
+    municipality_id INTEGER,
+    dup_of          INTEGER    -- id of the first report when this is a near-duplicate
+);
+CREATE INDEX IF NOT EXISTS ix_appeals_municipality ON appeals(municipality_id);
+CREATE INDEX IF NOT EXISTS ix_appeals_category ON appeals(category);
+CREATE INDEX IF NOT EXISTS ix_appeals_date ON appeals(date);
+CREATE INDEX IF NOT EXISTS ix_appeals_category_date ON appeals(category, date);
+-- keyset listing: equality filters, then id order (rowid is the implicit last column)
+CREATE INDEX IF NOT EXISTS ix_appeals_muni_category ON appeals(municipality_id, category);
+CREATE INDEX IF NOT EXISTS ix_appeals_batch ON appeals(batch_id);
+
+-- One row per ingested file content (sha256) per municipality; repeats are not parsed again
+CREATE TABLE IF NOT EXISTS uploads (
+    sha256          TEXT NOT NULL,
+    municipality_id INTEGER NOT NULL,   -- 0 = not specified
+    filename        TEXT,
+    batch_id        TEXT,
+    rows            INTEGER NOT NULL,
+    created_at      TEXT NOT NULL DEFAULT (datetime('now')),
+    PRIMARY KEY (sha256, municipality_id)
+) WITHOUT ROWID;
+
+-- Running aggregates. municipality_id 0 = not specified, date '' = unknown.
+CREATE TABLE IF NOT EXISTS agg_daily (
+    municipality_id INTEGER NOT NULL,
+    category        TEXT NOT NULL,
+    date            TEXT NOT NULL,
+    n               INTEGER NOT NULL,
+    sentiment_sum   REAL NOT NULL,
+    uniq            INTEGER NOT NULL DEFAULT 0,   -- appeals that are not near-duplicates
+    PRIMARY KEY (municipality_id, category, date)
+) WITHOUT ROWID;
+-- date windows without a category filter
+CREATE INDEX IF NOT EXISTS ix_agg_daily_muni_date ON agg_daily(municipality_id, date);
+CREATE INDEX IF NOT EXISTS ix_agg_daily_date ON agg_daily(date);
+CREATE TABLE IF NOT EXISTS agg_address (
+    municipality_id INTEGER NOT NULL,
+    category        TEXT NOT NULL,
+    address         TEXT NOT NULL,
+    n               INTEGER NOT NULL,
+    PRIMARY KEY (municipality_id, category, address)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_agg_address_rank ON agg_address(municipality_id, category, n DESC);
+-- Topic heavy hitters, one topics.TopicSketch (at most TOPIC_SKETCH_SIZE counters) per row;
+-- period is yyyy-mm-dd, yyyy-mm or '' for all time (undated appeals are only in the latter)
+CREATE TABLE IF NOT EXISTS topic_sketch (
+    category        TEXT NOT NULL,
+    period          TEXT NOT NULL,
+    municipality_id INTEGER NOT NULL,
+    counters        TEXT NOT NULL,      -- JSON [[token, n, err], ...]
+    PRIMARY KEY (category, period, municipality_id)
+) WITHOUT ROWID;
+
+-- Near-duplicate signatures of appeal texts (see neardup.py)
+CREATE TABLE IF NOT EXISTS appeal_sig (
+    id              INTEGER PRIMARY KEY,   -- appeals.id
+    root            INTEGER NOT NULL,      -- first appeal of the duplicate group
+    words           TEXT NOT NULL,         -- stemmed content words
+    address_key     TEXT,
+    day             INTEGER                -- date as a day ordinal
+);
+-- LSH band keys (municipality included) -> appeal_sig.id of first reports
+CREATE TABLE IF NOT EXISTS sig_band (
+    key             INTEGER NOT NULL,
+    id              INTEGER NOT NULL,
+    PRIMARY KEY (key, id)
+) WITHOUT ROWID;
+
+-- Full-text index: stemmed text + address (search.terms) and filter tokens (search.facets);
+-- rowid = appeals.id. Contentless: the texts themselves stay in appeals.
+{FTS_SCHEMA}
+
+-- Action plans; documents are rendered from the `documents` row doc_key
+CREATE TABLE IF NOT EXISTS plans (
+    id              TEXT NOT NULL UNIQUE,
+    category        TEXT NOT NULL,
+    municipality_id INTEGER,
+    summary         TEXT,
+    doc_key         TEXT NOT NULL,
+    created_at      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_plans_municipality ON plans(municipality_id);
+
+-- Background upload jobs (JSON state), so any worker can answer a status poll
+CREATE TABLE IF NOT EXISTS jobs (
+    id              TEXT PRIMARY KEY,
+    state           TEXT NOT NULL,
+    updated_at      TEXT NOT NULL DEFAULT (datetime('now'))
+);
+
+-- Counters; data_version changes whenever anything a client may have cached changes
+CREATE TABLE IF NOT EXISTS meta (
+    key             TEXT PRIMARY KEY,
+    value           INTEGER NOT NULL
+) WITHOUT ROWID;
+
+-- Inputs of files rendered on demand (exports, plan documents), keyed by a content hash
+CREATE TABLE IF NOT EXISTS documents (
+    key             TEXT PRIMARY KEY,
+    kind            TEXT NOT NULL,      -- 'export' | 'plan'
+    params          TEXT NOT NULL,      -- JSON
+    created_at      TEXT NOT NULL DEFAULT (datetime('now'))
+) WITHOUT ROWID;
+"""
+
+# bump when search.terms or FTS_SCHEMA changes: the index is rebuilt on startup
+SEARCH_INDEX_VERSION = 2
+SEARCH_RANK_WINDOW = 5000   # newest matches ranked by BM25 per query
+BUSY_TIMEOUT = 60           # seconds a write waits for another process's transaction
+APPEND_CHUNK = 2000         # appeals per write transaction of an upload
+# uploads.rows while the file is still being written; a claim older than STALE_UPLOAD
+# seconds was left by a worker that died mid-file, and the next upload of it takes over
+PENDING_ROWS = -1
+STALE_UPLOAD = 3600
+BUMP_VERSION = ("INSERT INTO meta VALUES ('data_version', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+UPSERT_DAILY = ("INSERT INTO agg_daily(municipality_id,category,date,n,sentiment_sum,uniq) VALUES (?,?,?,?,?,?) "
+                "ON CONFLICT(municipality_id,category,date) DO UPDATE SET n=n+excluded.n, "
+                "sentiment_sum=sentiment_sum+excluded.sentiment_sum, uniq=uniq+excluded.uniq")
+# candidates sharing at least one band key and not contradicting on address/date
+# (neardup.is_near); each key contributes only its newest entries, so templated
+# texts that crowd one bucket cost a bounded number of lookups
+SIG_CANDIDATES = (
+    "SELECT s.root, s.words, s.address_key, s.day FROM appeal_sig s WHERE s.id IN ("
+    + " UNION ALL ".join(f"SELECT * FROM (SELECT id FROM sig_band WHERE key = :k{i} ORDER BY id DESC LIMIT 25)"
+                         for i in range(neardup.BANDS))
+    + ") AND (:addr IS NULL OR s.address_key IS NULL OR s.address_key = :addr) "
+    "AND (:day IS NULL OR s.day IS NULL OR s.day BETWEEN :day - :window AND :day + :window) "
+    "ORDER BY s.id")
+# agg_daily.date is yyyy-mm-dd (or "" when unknown); buckets are NULL for unparsable dates
+DATE_BUCKETS = {
+    "day": "date(date)",
+    "week": "date(date, 'weekday 0', '-6 days')",   # Monday of the week
+    "month": "strftime('%Y-%m', date)",
+}
+UPSERT_ADDRESS = ("INSERT INTO agg_address VALUES (?,?,?,?) ON CONFLICT(municipality_id,category,address) "
+                  "DO UPDATE SET n=n+excluded.n")
+DAY_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+# the same in SQL: agg_daily may hold other date strings from older uploads
+ISO_DAY = "date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+
+
+def _opt_str(v):
+    if v is None: return None
+    s = str(v)
+    return s if s else None
+
+def _opt_float(v):
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return None if f != f else f  # NaN -> NULL
+
+def _opt_int(v):
+    try:
+        return int(v) if v is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+class AppealStore:
+    """Small repository API over the appeals table.
+
+    One connection per thread: FastAPI runs sync endpoints in a threadpool.
+    `tokenize` and `sentiment` are the text features folded into the running
+    aggregates; they are supplied by the app so the rules live in one place.
+    """
+
+    def __init__(self, path:str, tokenize:Optional[Callable[[str], List[str]]]=None,
+                 sentiment:Optional[Callable[[str], float]]=None):
+        self.path = path
+        self.tokenize = tokenize or (lambda t: [])
+        self.sentiment = sentiment or (lambda t: 0.0)
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._local = threading.local()
+        with self._setup_lock():
+            conn = self._conn()
+            if path != ":memory:":
+                conn.execute("PRAGMA journal_mode=WAL")  # persistent: set once per database file
+            conn.executescript(SCHEMA)
+            if self._migrate(conn):
+                self.rebuild_signatures()
+            # Databases created before the aggregate tables (or the topic sketches) existed: backfill once
+            elif conn.execute("SELECT 1 FROM appeals LIMIT 1").fetchone() is not None \
+                    and (conn.execute("SELECT 1 FROM agg_daily LIMIT 1").fetchone() is None
+                         or conn.execute("SELECT 1 FROM topic_sketch LIMIT 1").fetchone() is None):
+                self.rebuild_aggregates()
+            if self._meta("search_index") != SEARCH_INDEX_VERSION:
+                self.rebuild_search_index()
+
+    @contextmanager
+    def _setup_lock(self):
+        """Workers starting together: the first one migrates, the others then find nothing to do."""
+        if self.path == ":memory:" or fcntl is None:
+            yield
+            return
+        with open(self.path + ".lock", "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            conn.execute("PRAGMA synchronous=NORMAL")  # durable across app crashes in WAL mode
+            self._local.conn = conn
+        return conn
+
+    def _migrate(self, conn) -> bool:
+        """Bring older databases up to SCHEMA; True if near-duplicate links must be backfilled."""
+        # databases created before uploads were hashed
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(appeals)")}
+        if "file_hash" not in cols:
+            with conn:
+                conn.execute("ALTER TABLE appeals ADD COLUMN file_hash TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_appeals_file_hash ON appeals(file_hash)")
+        # exact per-token counts, replaced by topic_sketch
+        conn.execute("DROP TABLE IF EXISTS agg_token")
+        # ... and before near-duplicate detection
+        if "dup_of" not in cols:
+            with conn:
+                conn.execute("ALTER TABLE appeals ADD COLUMN dup_of INTEGER")
+                if "uniq" not in {r[1] for r in conn.execute("PRAGMA table_info(agg_daily)")}:
+                    conn.execute("ALTER TABLE agg_daily ADD COLUMN uniq INTEGER NOT NULL DEFAULT 0")
+            return True
+        return False
+
+    def append(self, rows:Iterable[dict], batch_id:Optional[str]=None,
+               file_hash:Optional[str]=None, filename:Optional[str]=None, municipality_id:Optional[int]=None) -> int:
+        """Append-only batch insert, committed every APPEND_CHUNK rows; aggregates last.
+
+        With file_hash the rows are registered as the content of one uploaded file;
+        if that content was already ingested (or is being ingested) for the municipality
+        nothing is inserted and 0 is returned (safe against two concurrent uploads of the
+        same file). If any step fails, the rows already committed are deleted again.
+        """
+        params = [(
+            batch_id,
+            file_hash,
+            _opt_str(r.get("source")),
+            _opt_str(r.get("date")),
+            _opt_str(r.get("address")),
+            r.get("text") or "",
+            _opt_str(r.get("category")),
+            _opt_float(r.get("lat")),
+            _opt_float(r.get("lng")),
+            _opt_int(r.get("municipality_id")),
+        ) for r in rows]
+        if not params and not file_hash:
+            return 0
+        conn = self._conn()
+        if file_hash and not self._claim_upload(conn, file_hash, municipality_id, filename, batch_id):
+            return 0
+        ids, unique = [], []
+        try:
+            for i in range(0, len(params), APPEND_CHUNK):
+                chunk = params[i:i + APPEND_CHUNK]
+                # MinHash and stemming between transactions: the gaps let other processes' writes in
+                sigs = [neardup.signature(p[5], p[4], p[3], p[9]) for p in chunk]
+                fts = [self._fts_values(p[5], p[4], p[9], p[6]) for p in chunk]
+                with conn:
+                    for p, sig, (body, facets) in zip(chunk, sigs, fts):
+                        root = self._find_root(conn, sig) if sig else None
+                        cur = conn.execute(
+                            "INSERT INTO appeals(batch_id,file_hash,source,date,address,text,category,lat,lng,municipality_id,dup_of) "
+                            "VALUES (?,?,?,?,?,?,?,?,?,?,?)", (*p, root))
+                        if sig:
+                            self._add_signature(conn, cur.lastrowid, root, sig)
+                        ids.append(cur.lastrowid)
+                        unique.append(root is None)
+                        self._index_text(conn, cur.lastrowid, body, facets)
+                    conn.execute(BUMP_VERSION)
+            # tokens and sentiment are computed before the last transaction opens
+            deltas = self._aggregate_deltas((p[3], p[4], p[5], p[6], p[9], u) for p, u in zip(params, unique))
+            with conn:
+                self._write_aggregates(conn, *deltas)
+                if file_hash:
+                    conn.execute("UPDATE uploads SET rows = ? WHERE sha256 = ? AND municipality_id = ?",
+                                 (len(params), file_hash, municipality_id or 0))
+                conn.execute(BUMP_VERSION)
+        except BaseException:
+            with conn:
+                self._discard(conn, ids)
+                if file_hash:
+                    conn.execute("DELETE FROM uploads WHERE sha256 = ? AND municipality_id = ?",
+                                 (file_hash, municipality_id or 0))
+                conn.execute(BUMP_VERSION)
+            raise
+        return len(params)
+
+    def _claim_upload(self, conn, file_hash:str, municipality_id, filename, batch_id) -> bool:
+        """Register a file as being ingested; False if it already is (or was)."""
+        key = (file_hash, municipality_id or 0)
+        with conn:
+            stale = conn.execute(
+                "SELECT batch_id FROM uploads WHERE sha256 = ? AND municipality_id = ? AND rows = ? "
+                "AND created_at < datetime('now', ?)", (*key, PENDING_ROWS, f"-{STALE_UPLOAD} seconds")).fetchone()
+            if stale:
+                self._discard(conn, [i for (i,) in conn.execute(
+                    "SELECT id FROM appeals WHERE file_hash = ? AND batch_id IS ?", (file_hash, stale[0]))])
+                conn.execute("DELETE FROM uploads WHERE sha256 = ? AND municipality_id = ?", key)
+            cur = conn.execute(
+                "INSERT OR IGNORE INTO uploads(sha256,municipality_id,filename,batch_id,rows) VALUES (?,?,?,?,?)",
+                (*key, filename, batch_id, PENDING_ROWS))
+            return cur.rowcount > 0
+
+    def _discard(self, conn, ids:List[int]):
+        """Delete appeals of an upload that did not complete, with their signatures and index entries.
+
+        Their aggregates were never written: those are committed with the last chunk.
+        """
+        for i in range(0, len(ids), APPEND_CHUNK):
+            chunk = json.dumps(ids[i:i + APPEND_CHUNK])
+            rows = conn.execute("SELECT id, text, address, date, municipality_id, category FROM appeals "
+                                "WHERE id IN (SELECT value FROM json_each(?))", (chunk,)).fetchall()
+            for appeal_id, text, address, date, m, c in rows:
+                # contentless FTS5: a delete names the indexed values again
+                conn.execute("INSERT INTO appeal_fts(appeal_fts, rowid, body, facets) VALUES ('delete',?,?,?)",
+                             (appeal_id, *self._fts_values(text, address, m, c)))
+                sig = neardup.signature(text, address, date, m)
+                if sig:
+                    conn.executemany("DELETE FROM sig_band WHERE key = ? AND id = ?", [(k, appeal_id) for k in sig.keys])
+            for table in ("appeal_sig", "appeals"):
+                conn.execute(f"DELETE FROM {table} WHERE id IN (SELECT value FROM json_each(?))", (chunk,))
+
+    # --- near-duplicates ---
+    def _find_root(self, conn, sig) -> Optional[int]:
+        """First appeal of the duplicate group sig belongs to, or None if it is new."""
+        args = {**{f"k{i}": k for i, k in enumerate(sig.keys)},
+                "addr": sig.address, "day": sig.day, "window": neardup.DATE_WINDOW}
+        for root, words, address, day in conn.execute(SIG_CANDIDATES, args):
+            if neardup.is_near(sig, words, address, day):
+                return root
+        return None
+
+    def _add_signature(self, conn, appeal_id:int, root:Optional[int], sig):
+        conn.execute("INSERT INTO appeal_sig VALUES (?,?,?,?,?)",
+                     (appeal_id, root or appeal_id, " ".join(sorted(sig.words)), sig.address, sig.day))
+        if root is None:
+            # only first reports are candidates, so buckets grow with distinct complaints, not rows
+            conn.executemany("INSERT OR IGNORE INTO sig_band VALUES (?,?)", [(k, appeal_id) for k in sig.keys])
+
+    def rebuild_signatures(self):
+        """Recompute signatures and dup_of links for all appeals in insertion order, then the aggregates."""
+        conn = self._conn()
+        with conn:
+            conn.execute("DELETE FROM appeal_sig")
+            conn.execute("DELETE FROM sig_band")
+            last = 0
+            while True:
+                chunk = conn.execute("SELECT id, date, address, text, municipality_id FROM appeals "
+                                     "WHERE id > ? ORDER BY id LIMIT 5000", (last,)).fetchall()
+                if not chunk: break
+                for appeal_id, date, address, text, muni in chunk:
+                    sig = neardup.signature(text, address, date, muni)
+                    root = self._find_root(conn, sig) if sig else None
+                    conn.execute("UPDATE appeals SET dup_of = ? WHERE id = ?", (root, appeal_id))
+                    if sig:
+                        self._add_signature(conn, appeal_id, root, sig)
+                last = chunk[-1][0]
+        self.rebuild_aggregates()
+
+    def find_upload(self, file_hash:str, municipality_id:Optional[int]=None) -> Optional[dict]:
+        r = self._conn().execute(
+            "SELECT filename,batch_id,rows,created_at FROM uploads WHERE sha256 = ? AND municipality_id = ? AND rows >= 0",
+            (file_hash, municipality_id or 0)).fetchone()
+        return dict(zip(("filename", "batch_id", "rows", "created_at"), r)) if r else None
+
+    def iter_upload_rows(self, file_hash:str, municipality_id:Optional[int]=None, chunk:int=5000):
+        """Rows stored for an already ingested file, in their original order, in lists of up to `chunk` rows."""
+        sql = f"SELECT {','.join(COLUMNS)} FROM appeals WHERE file_hash = ?"
+        params = [file_hash]
+        if municipality_id:
+            sql += " AND municipality_id = ?"
+            params.append(municipality_id)
+        else:
+            sql += " AND municipality_id IS NULL"
+        cur = self._conn().execute(sql + " ORDER BY id", params)
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows: break
+            yield [dict(zip(COLUMNS, r)) for r in rows]
+
+    def upload_category_counts(self, file_hash:str, municipality_id:Optional[int]=None) -> Counter:
+        """Appeals per category ("—" for none) stored for an already ingested file."""
+        sql = "SELECT COALESCE(category, '—'), COUNT(*) FROM appeals WHERE file_hash = ?"
+        params = [file_hash]
+        if municipality_id:
+            sql += " AND municipality_id = ?"
+            params.append(municipality_id)
+        else:
+            sql += " AND municipality_id IS NULL"
+        return Counter(dict(self._conn().execute(sql + " GROUP BY 1", params).fetchall()))
+
+    def list_appeals(self, fields:List[str], limit:int, before_id:Optional[int]=None,
+                     municipality_id:Optional[int]=None, category:Optional[str]=None, source:Optional[str]=None,
+                     date_from:Optional[str]=None, date_to:Optional[str]=None,
+                     batch_id:Optional[str]=None) -> List[dict]:
+        """Newest first, keyset-paginated: pass the last id of a page as before_id for the next one.
+
+        Dates are inclusive ISO days; category "—" selects appeals without a category.
+        """
+        cond, params = [], []
+        for sql, v in (("id < ?", before_id), ("municipality_id = ?", municipality_id),
+                       ("source = ?", source), ("date >= ?", date_from), ("batch_id = ?", batch_id)):
+            if v:
+                cond.append(sql)
+                params.append(v)
+        if category:
+            cond.append("category IS NULL" if category == "—" else "category = ?")
+            if category != "—":
+                params.append(category)
+        if date_to:
+            cond.append("date < ?")  # dates may carry a time part
+            params.append((dt.date.fromisoformat(date_to) + dt.timedelta(days=1)).isoformat())
+        cols = ["id"] + [f for f in fields if f in LIST_FIELDS and f != "id"]
+        sql = (f"SELECT {','.join(cols)} FROM appeals" + (" WHERE " + " AND ".join(cond) if cond else "")
+               + " ORDER BY id DESC LIMIT ?")
+        return [dict(zip(cols, r)) for r in self._conn().execute(sql, params + [limit])]
+
+    def save_document(self, key:str, kind:str, params:dict):
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO documents(key,kind,params) VALUES (?,?,?)",
+                         (key, kind, json.dumps(params, ensure_ascii=False)))
+
+    def get_document(self, key:str) -> Optional[Tuple[str, dict]]:
+        """(kind, params) of a renderable file, or None."""
+        r = self._conn().execute("SELECT kind, params FROM documents WHERE key = ?", (key,)).fetchone()
+        return (r[0], json.loads(r[1])) if r else None
+
+    def _update_aggregates(self, conn, items:Iterable[Tuple]):
+        """Fold (date, address, text, category, municipality_id, is_unique) tuples into agg_* tables."""
+        self._write_aggregates(conn, *self._aggregate_deltas(items))
+
+    def _aggregate_deltas(self, items:Iterable[Tuple]) -> Tuple[dict, Counter, dict]:
+        """Per-key sums of a batch, so each key costs one upsert: (daily, addresses, tokens)."""
+        daily, tokens = {}, {}
+        addresses = Counter()
+        for date, address, text, category, muni, unique in items:
+            m, c = muni or 0, category or "—"
+            d = daily.setdefault((m, c, (date or "")[:10]), [0, 0.0, 0])
+            d[0] += 1
+            d[1] += self.sentiment(text or "")
+            d[2] += bool(unique)
+            if address is not None:
+                addresses[(m, c, address)] += 1
+            words = self.tokenize(text or "")
+            day = (date or "")[:10]
+            for period in ("", day[:7], day) if DAY_RE.fullmatch(day) else ("",):
+                tokens.setdefault((m, c, period), Counter()).update(words)
+        return daily, addresses, tokens
+
+    def _write_aggregates(self, conn, daily:dict, addresses:Counter, tokens:dict):
+        conn.executemany(UPSERT_DAILY, [(*k, *v) for k, v in daily.items()])
+        conn.executemany(UPSERT_ADDRESS, [(*k, n) for k, n in addresses.items()])
+        self._fold_topics(conn, tokens)
+
+    def _fold_topics(self, conn, tokens:dict):
+        """Merge a batch's token counts into the (municipality_id, category, period) sketches they touch."""
+        keys = [(c, period, m) for m, c, period in tokens]
+        sketches = {k: TopicSketch() for k in keys}
+        for c, period, m, counters in conn.execute(
+                "SELECT category, period, municipality_id, counters FROM topic_sketch "
+                "WHERE (category, period, municipality_id) IN "
+                "(SELECT value ->> 0, value ->> 1, value ->> 2 FROM json_each(?))", (json.dumps(keys),)):
+            sketches[(c, period, m)] = TopicSketch(rows=json.loads(counters))
+        for (m, c, period), counts in tokens.items():
+            sketches[(c, period, m)].update(counts)
+        conn.executemany("INSERT OR REPLACE INTO topic_sketch VALUES (?,?,?,?)",
+                         [(*k, json.dumps(sk.rows(), ensure_ascii=False)) for k, sk in sketches.items()])
+
+    def rebuild_aggregates(self):
+        conn = self._conn()
+        with conn:
+            for t in ("agg_daily", "agg_address", "topic_sketch"):
+                conn.execute(f"DELETE FROM {t}")
+            cur = conn.execute("SELECT date,address,text,category,municipality_id,dup_of IS NULL FROM appeals")
+            while True:
+                chunk = cur.fetchmany(10000)
+                if not chunk: break
+                self._update_aggregates(conn, chunk)
+            conn.execute(BUMP_VERSION)
+
+    # --- full-text search ---
+    def _fts_values(self, text, address, municipality_id, category) -> Tuple[str, str]:
+        return (" ".join(search.terms(f"{text or ''} {address or ''}", self.tokenize)),
+                search.facets(municipality_id, category))
+
+    def _index_text(self, conn, appeal_id:int, body:str, facets:str):
+        conn.execute("INSERT INTO appeal_fts(rowid, body, facets) VALUES (?,?,?)", (appeal_id, body, facets))
+
+    def rebuild_search_index(self):
+        conn = self._conn()
+        with conn:
+            conn.execute("DROP TABLE IF EXISTS appeal_fts")  # the options may have changed too
+            conn.execute(FTS_SCHEMA)
+            cur = conn.execute("SELECT id, text, address, municipality_id, category FROM appeals")
+            while True:
+                chunk = cur.fetchmany(10000)
+                if not chunk: break
+                for appeal_id, *row in chunk:
+                    self._index_text(conn, appeal_id, *self._fts_values(*row))
+            conn.execute("INSERT INTO meta VALUES ('search_index', ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                         (SEARCH_INDEX_VERSION,))
+
+    def search(self, q:str, fields:List[str], limit:int, offset:int=0, municipality_id:Optional[int]=None,
+               category:Optional[str]=None) -> List[dict]:
+        """Appeals matching all terms of q (the last one as a prefix), best BM25 score first.
+
+        Only the newest SEARCH_RANK_WINDOW matches are ranked.
+        """
+        match = search.match_query(q, self.tokenize, municipality_id, category)
+        if not match:
+            return []
+        cols = ["id"] + [f for f in fields if f in LIST_FIELDS and f != "id"]
+        # BM25 is computed for the newest SEARCH_RANK_WINDOW matches only (the doclist is
+        # walked in rowid order and stops there), so a term in every tenth appeal stays cheap
+        sql = (f"SELECT {','.join('a.' + c for c in cols)}, f.score FROM "
+               "(SELECT rowid, bm25(appeal_fts, 1.0, 0.0) AS score FROM appeal_fts "
+               " WHERE appeal_fts MATCH ? ORDER BY rowid DESC LIMIT ?) f "
+               "JOIN appeals a ON a.id = f.rowid ORDER BY f.score, f.rowid DESC LIMIT ? OFFSET ?")
+        return [{**dict(zip(cols, r[:-1])), "score": round(-r[-1], 3)}
+                for r in self._conn().execute(sql, (match, SEARCH_RANK_WINDOW, limit, offset))]
+
+    # --- data version (ETags) ---
+    def _meta(self, key:str) -> int:
+        r = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return r[0] if r else 0
+
+    def data_version(self) -> int:
+        return self._meta("data_version")
+
+    # --- plans and upload jobs (shared by all workers) ---
+    def add_plan(self, plan:dict):
+        """plan: id, category, municipality_id, summary, doc_key, created_at."""
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT INTO plans(id,category,municipality_id,summary,doc_key,created_at) "
+                         "VALUES (:id,:category,:municipality_id,:summary,:doc_key,:created_at)", plan)
+            conn.execute(BUMP_VERSION)
+
+    def plans(self, municipality_id:Optional[int]=None, limit:int=50) -> List[dict]:
+        """The newest `limit` plans, oldest first."""
+        cols = ["id", "category", "municipality_id", "summary", "doc_key", "created_at"]
+        sql, params = f"SELECT {','.join(cols)} FROM plans", []
+        if municipality_id:
+            sql += " WHERE municipality_id = ?"
+            params.append(municipality_id)
+        rows = self._conn().execute(sql + " ORDER BY rowid DESC LIMIT ?", params + [limit]).fetchall()
+        return [dict(zip(cols, r)) for r in reversed(rows)]
+
+    def save_job(self, job:dict, keep:Optional[int]=None):
+        """Store a job's current state; with `keep` only that many most recent jobs are kept."""
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT INTO jobs(id, state) VALUES (?,?) ON CONFLICT(id) DO UPDATE SET "
+                         "state = excluded.state, updated_at = excluded.updated_at",
+                         (job["id"], json.dumps(job, ensure_ascii=False)))
+            if keep:
+                conn.execute("DELETE FROM jobs WHERE id NOT IN "
+                             "(SELECT id FROM jobs ORDER BY updated_at DESC LIMIT ?)", (keep,))
+
+    def get_job(self, job_id:str) -> Optional[dict]:
+        r = self._conn().execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(r[0]) if r else None
+
+    # --- aggregate reads (cost depends on categories/dates in the window, not on rows) ---
+    def _agg_where(self, municipality_id, params, category=None, date_from=None, date_to=None):
+        """WHERE for agg_daily; date_from/date_to are inclusive ISO dates (undated rows fall outside)."""
+        cond = []
+        for sql, v in (("municipality_id = ?", municipality_id), ("category = ?", category),
+                       ("date >= ?", date_from), ("date <= ?", date_to)):
+            if v:
+                cond.append(sql)
+                params.append(v)
+        return " WHERE " + " AND ".join(cond) if cond else ""
+
+    def category_totals(self, municipality_id:Optional[int]=None, category:Optional[str]=None,
+                        date_from:Optional[str]=None, date_to:Optional[str]=None) -> List[Tuple[str, int, float, int]]:
+        """[(category, count, sentiment_sum, unique count)] ordered by category."""
+        params = []
+        sql = ("SELECT category, SUM(n), SUM(sentiment_sum), SUM(uniq) FROM agg_daily"
+               + self._agg_where(municipality_id, params, category, date_from, date_to)
+               + " GROUP BY category ORDER BY category")
+        return [(c, int(n), float(s), int(u)) for c, n, s, u in self._conn().execute(sql, params)]
+
+    def date_span(self, municipality_id:Optional[int]=None, category:Optional[str]=None) -> Tuple[Optional[str], Optional[str]]:
+        """(first, last) ISO date; each end is the first yyyy-mm-dd met walking a date index."""
+        params = []
+        where = self._agg_where(municipality_id, params, category, date_from="0")  # "" sorts before digits
+        conn = self._conn()
+        first, last = (conn.execute(f"SELECT date FROM agg_daily{where} AND {ISO_DAY} ORDER BY date {order} LIMIT 1",
+                                    params).fetchone() for order in ("ASC", "DESC"))
+        return first and first[0], last and last[0]
+
+    def date_totals(self, municipality_id:Optional[int]=None, category:Optional[str]=None,
+                    date_from:Optional[str]=None, date_to:Optional[str]=None, granularity:str="day",
+                    limit:Optional[int]=None) -> List[Tuple[Optional[str], int]]:
+        """[(bucket, count)] in date order, then (None, count) for rows without a usable date.
+
+        With limit only the newest buckets are returned; the undated one is always kept.
+        """
+        params = []
+        bucket = DATE_BUCKETS[granularity]
+        sql = (f"SELECT {bucket} AS b, SUM(n) FROM agg_daily"
+               + self._agg_where(municipality_id, params, category, date_from, date_to)
+               + " GROUP BY b ORDER BY b IS NOT NULL, b DESC")
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit + 1)  # + the undated bucket, which sorts first
+        rows = [(b, int(n)) for b, n in self._conn().execute(sql, params)]
+        dated = [r for r in rows if r[0] is not None][:limit]
+        return dated[::-1] + [r for r in rows if r[0] is None]
+
+    def _window_where(self, municipality_id, category, date_from, date_to, params):
+        """WHERE over appeals for one category and an inclusive date window (ix_appeals_category_date)."""
+        cond = ["category IS NULL" if category == "—" else "category = ?"]
+        if category != "—":
+            params.append(category)
+        if date_from:
+            cond.append("date >= ?")
+            params.append(date_from)
+        if date_to:
+            # appeal dates may carry a time part: compare against the next day
+            cond.append("date < ?")
+            params.append((dt.date.fromisoformat(date_to) + dt.timedelta(days=1)).isoformat())
+        if municipality_id:
+            cond.append("municipality_id = ?")
+            params.append(municipality_id)
+        return " WHERE " + " AND ".join(cond)
+
+    def _top(self, table, key, municipality_id, category, k):
+        if municipality_id:
+            # served straight from the (municipality_id, category, n DESC) index
+            sql = (f"SELECT {key}, n FROM {table} WHERE municipality_id = ? AND category = ? "
+                   f"ORDER BY n DESC, {key} LIMIT ?")
+            params = (municipality_id, category, k)
+        else:
+            sql = (f"SELECT {key}, SUM(n) AS total FROM {table} WHERE category = ? "
+                   f"GROUP BY {key} ORDER BY total DESC, {key} LIMIT ?")
+            params = (category, k)
+        return [(v, int(n)) for v, n in self._conn().execute(sql, params)]
+
+    def hotspots(self, category:str, municipality_id:Optional[int]=None, k:int=5,
+                 date_from:Optional[str]=None, date_to:Optional[str]=None) -> List[Tuple[str, int]]:
+        if not (date_from or date_to):
+            return self._top("agg_address", "address", municipality_id, category, k)
+        # address aggregates are not dated: count the window's rows instead
+        params = []
+        sql = ("SELECT address, COUNT(*) AS n FROM appeals"
+               + self._window_where(municipality_id, category, date_from, date_to, params)
+               + " AND address IS NOT NULL GROUP BY address ORDER BY n DESC, address LIMIT ?")
+        return [(a, int(n)) for a, n in self._conn().execute(sql, params + [k])]
+
+    def _periods(self, municipality_id, category, date_from, date_to) -> List[str]:
+        """Sketch periods covering an inclusive window: whole months, plus days at the edges."""
+        first, last = self.date_span(municipality_id, category)
+        if not first:
+            return []
+        try:
+            d = max(dt.date.fromisoformat(date_from), dt.date.fromisoformat(first[:10])) if date_from \
+                else dt.date.fromisoformat(first[:10])
+            end = min(dt.date.fromisoformat(date_to), dt.date.fromisoformat(last[:10])) if date_to \
+                else dt.date.fromisoformat(last[:10])
+        except ValueError:
+            return []
+        periods = []
+        while d <= end:
+            next_month = (d.replace(day=28) + dt.timedelta(days=4)).replace(day=1)
+            if d.day == 1 and next_month - dt.timedelta(days=1) <= end:
+                periods.append(d.isoformat()[:7])
+                d = next_month
+            else:
+                periods.append(d.isoformat())
+                d += dt.timedelta(days=1)
+        return periods
+
+    def topics(self, category:str, municipality_id:Optional[int]=None, k:int=7,
+               date_from:Optional[str]=None, date_to:Optional[str]=None) -> List[str]:
+        """Top k tokens of the merged sketches: all time, or the day and month sketches covering a window."""
+        periods = self._periods(municipality_id, category, date_from, date_to) if date_from or date_to else [""]
+        sql = "SELECT counters FROM topic_sketch WHERE category = ? AND period IN (SELECT value FROM json_each(?))"
+        params = [category, json.dumps(periods)]
+        if municipality_id:
+            sql += " AND municipality_id = ?"
+            params.append(municipality_id)
+        merged = TopicSketch.merged(TopicSketch(rows=json.loads(c)) for (c,) in self._conn().execute(sql, params))
+        return [t for t, _ in merged.top(k)]
@@ -0,0 +1,40 @@
+import ingest
+from store import AppealStore
+
+MARCH = ("2024-03-01", "2024-03-31")
+
+
+def test_norm_date_pads_month_and_day():
+    assert ingest._norm_date("2024.9.1") == "2024-09-01"
+    assert ingest._norm_date("5/3/2024") == "2024-03-05"
+    assert ingest._norm_date("2024-03-15") == "2024-03-15"
+
+
+def test_window_topics_with_mixed_date_formats(tmp_path):
+    path = tmp_path / "appeals.csv"
+    lines = ["id,Текст обращения"]
+    lines += [f"{i},Яма на дороге у дома {i} от {i % 28 + 1}.03.2024" for i in range(10)]
+    lines += [f"{i},Яма на дороге у дома {i} от 2024.3.{i % 28 + 1}" for i in range(10, 20)]
+    lines += ["20,Яма на дороге у школы 2024.9.1", "21,Яма на дороге без даты"]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    table = ingest.parse_path(str(path), "appeals.csv")
+    table.set_municipality(4)
+    store = AppealStore(str(tmp_path / "appeals.sqlite3"), tokenize=ingest.tokenize)
+    store.append(table)
+    # stored before dates were zero-padded, and a Добродел cell that is not a date at all
+    store.append([{"text": "Яма на дороге у подъезда", "date": d, "municipality_id": 4, "category": c}
+                  for c in table.counts("category") for d in ("2024-9-1", "вчера днём")])
+
+    (category, n), = table.counts("category").items()
+    assert n == 22
+    assert store.date_span(4, category) == ("2024-03-01", "2024-09-01")
+    assert "яма" in store.topics(category, 4, 7, *MARCH)
+    assert "яма" in store.topics(category, 4, 7, date_from=MARCH[0])
+
+
+def test_date_span_of_multi_year_data_skips_other_strings(tmp_path):
+    store = AppealStore(str(tmp_path / "appeals.sqlite3"), tokenize=ingest.tokenize)
+    dates = ["2022-01-10", "2023-06-01", "2024-11-30", "2024-9-1", "31.12.2024 г.", "", None]
+    store.append([{"text": f"Не горит свет у дома {i}", "date": d, "municipality_id": 4} for i, d in enumerate(dates)])
+    assert store.date_span() == store.date_span(4) == ("2022-01-10", "2024-11-30")
+    assert AppealStore(str(tmp_path / "empty.sqlite3")).date_span() == (None, None)
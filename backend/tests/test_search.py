@@ -0,0 +1,29 @@
+from ingest import tokenize
+from store import AppealStore
+
+# the searched term has to be rare for BM25 to weigh it, as in a real store
+FILLER = [f"Не вывозят мусор с площадки у дома {i}" for i in range(10)]
+
+
+def _store(tmp_path, texts):
+    store = AppealStore(str(tmp_path / "appeals.sqlite3"), tokenize=tokenize)
+    store.append([{"text": t, "municipality_id": 4, "category": "Дороги"} for t in texts + FILLER])
+    return store
+
+
+def test_more_term_hits_rank_higher(tmp_path):
+    store = _store(tmp_path, [
+        "Одна яма во дворе дома номер пять, просим засыпать",
+        "Яма на дороге у школы, ямы по всей улице, в яму провалилось колесо",
+    ])
+    hits = store.search("яма", ["id", "text"], 10)
+    assert [h["id"] for h in hits] == [2, 1]
+    assert hits[0]["score"] > hits[1]["score"] > 0
+
+
+def test_rebuilt_index_keeps_ranking(tmp_path):
+    store = _store(tmp_path, ["Свет в подъезде не горит, свет на улице тоже, свет нужен", "Свет не горит"])
+    store.rebuild_search_index()
+    hits = store.search("свет", ["id"], 10)
+    assert [h["id"] for h in hits] == [1, 2]
+    assert hits[0]["score"] > hits[1]["score"] > 0
@@ -0,0 +1,74 @@
+import pytest
+
+import store as store_module
+from ingest import tokenize
+from store import AppealStore
+
+
+def _rows(n, word="яма"):
+    return [{"text": f"{word} на дороге у дома {i}, просим отремонтировать участок {i * 7}",
+             "date": "2024-03-05", "municipality_id": 4, "category": "Дороги"} for i in range(n)]
+
+
+def _count(store, sql):
+    return store._conn().execute(sql).fetchone()[0]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(store_module, "APPEND_CHUNK", 3)
+    return AppealStore(str(tmp_path / "appeals.sqlite3"), tokenize=tokenize)
+
+
+def test_chunked_append_registers_the_file_once(store):
+    assert store.append(_rows(10), batch_id="b1", file_hash="h", municipality_id=4) == 10
+    assert store.append(_rows(10), batch_id="b2", file_hash="h", municipality_id=4) == 0
+    assert store.find_upload("h", 4)["rows"] == 10
+    assert _count(store, "SELECT COUNT(*) FROM appeals") == 10
+    assert _count(store, "SELECT SUM(n) FROM agg_daily") == 10
+    assert len(store.search("яма", ["id"], 20)) == 10
+
+
+def test_failed_append_leaves_nothing_behind(store, monkeypatch):
+    store.append(_rows(2, "свет"), batch_id="b0")
+    calls = []
+
+    def fail_late(conn, appeal_id, *args):
+        calls.append(appeal_id)
+        if len(calls) == 8:
+            raise RuntimeError("disk full")
+        AppealStore._index_text(store, conn, appeal_id, *args)
+    monkeypatch.setattr(store, "_index_text", fail_late)
+    with pytest.raises(RuntimeError):
+        store.append(_rows(10), batch_id="b1", file_hash="h", municipality_id=4)
+    monkeypatch.undo()
+
+    assert store.find_upload("h", 4) is None
+    store._conn().execute("INSERT INTO appeal_fts(appeal_fts, rank) VALUES ('integrity-check', 1)")
+    assert _count(store, "SELECT COUNT(*) FROM appeals") == 2
+    assert _count(store, "SELECT COUNT(*) FROM appeal_sig") == 2
+    assert store.search("яма", ["id"], 20) == []
+    assert _count(store, "SELECT SUM(n) FROM agg_daily") == 2
+    # a retry is a fresh ingest, not a cache hit
+    assert store.append(_rows(10), batch_id="b2", file_hash="h", municipality_id=4) == 10
+    assert len(store.search("яма", ["id"], 20)) == 10
+
+
+def test_stale_claim_is_taken_over(store):
+    conn = store._conn()
+    with conn:
+        conn.execute("INSERT INTO uploads(sha256,municipality_id,filename,batch_id,rows) VALUES ('h',4,'f.csv','dead',?)",
+                     (store_module.PENDING_ROWS,))
+        # a chunk the dead worker committed: row and index entry together
+        cur = conn.execute("INSERT INTO appeals(batch_id,file_hash,text,municipality_id) VALUES ('dead','h','яма обрывок',4)")
+        store._index_text(conn, cur.lastrowid, *store._fts_values("яма обрывок", None, 4, None))
+    # being written by another worker: not served from the cache, not written twice
+    assert store.find_upload("h", 4) is None
+    assert store.append(_rows(3), batch_id="b1", file_hash="h", municipality_id=4) == 0
+    # ... until that worker is taken for dead
+    with conn:
+        conn.execute("UPDATE uploads SET created_at = datetime('now', '-2 hours')")
+    assert store.append(_rows(5), batch_id="b2", file_hash="h", municipality_id=4) == 5
+    assert _count(store, "SELECT COUNT(*) FROM appeals") == 5
+    assert store.find_upload("h", 4)["batch_id"] == "b2"
+    assert len(store.search("яма", ["id"], 20)) == 5
@@ -0,0 +1,82 @@
+"""Bounded-memory topic counts (Space-Saving heavy hitters).
+
+A sketch keeps at most `capacity` (token, n, err) counters. n overestimates
+the true count by at most err, and any token occurring in more than
+1/capacity of the tokens is guaranteed to be kept, so the top of the sketch
+is the top of the stream. Sketches merge (Agarwal et al., "Mergeable
+summaries"): a token missing from a full sketch is credited with that sketch's
+smallest counter, then the largest `capacity` counters are kept. store.py
+keeps one sketch per municipality, category and period (day, month, all time);
+a date window is answered by merging the sketches that cover it.
+"""
+import os, heapq
+from collections import Counter
+from typing import Iterable, List, Mapping, Optional, Tuple
+
+TOPIC_SKETCH_SIZE = int(os.environ.get("TOPIC_SKETCH_SIZE", "256"))
+
+
+class TopicSketch:
+    __slots__ = ("capacity", "counts", "errors")
+
+    def __init__(self, capacity:Optional[int]=None, rows:Iterable[Tuple[str, int, int]]=()):
+        self.capacity = capacity or TOPIC_SKETCH_SIZE
+        self.counts, self.errors = {}, {}
+        for token, n, err in rows:
+            self.counts[token], self.errors[token] = n, err
+
+    def floor(self) -> int:
+        """Upper bound of the count of any token not in the sketch."""
+        return min(self.counts.values()) if len(self.counts) >= self.capacity else 0
+
+    def update(self, counts:Mapping[str, int]):
+        """Add exact counts (e.g. the tokens of one batch); a new token starts from the floor."""
+        floor = self.floor()
+        for t, n in counts.items():
+            if t in self.counts:
+                self.counts[t] += n
+            else:
+                self.counts[t], self.errors[t] = floor + n, floor
+        self._trim()
+
+    def _trim(self):
+        if len(self.counts) > self.capacity:
+            keep = heapq.nsmallest(self.capacity, self.counts, key=lambda t: (-self.counts[t], self.errors[t], t))
+            self.counts = {t: self.counts[t] for t in keep}
+            self.errors = {t: self.errors[t] for t in keep}
+
+    @classmethod
+    def merged(cls, sketches:Iterable["TopicSketch"], capacity:Optional[int]=None) -> "TopicSketch":
+        """Merge of all sketches, trimmed to capacity once at the end."""
+        out, floors, credited = cls(capacity), 0, {}
+        for sk in sketches:
+            f = sk.floor()
+            floors += f
+            for t, n in sk.counts.items():
+                out.counts[t] = out.counts.get(t, 0) + n
+                out.errors[t] = out.errors.get(t, 0) + sk.errors[t]
+                credited[t] = credited.get(t, 0) + f
+        for t in out.counts:
+            # each sketch a token is missing from credits it with that sketch's floor
+            out.counts[t] += floors - credited[t]
+            out.errors[t] += floors - credited[t]
+        out._trim()
+        return out
+
+    def top(self, k:int) -> List[Tuple[str, int]]:
+        return heapq.nsmallest(k, self.counts.items(), key=lambda x: (-x[1], x[0]))
+
+    def rows(self) -> List[Tuple[str, int, int]]:
+        return [(t, n, self.errors[t]) for t, n in self.counts.items()]
+
+
+def top_of(token_lists:Iterable[List[str]], k:int, capacity:Optional[int]=None, chunk:int=1000) -> List[Tuple[str, int]]:
+    """Top k tokens of a stream of token lists, holding at most `chunk` lists' tokens plus the sketch."""
+    sketch, batch = TopicSketch(capacity), Counter()
+    for i, tokens in enumerate(token_lists, 1):
+        batch.update(tokens)
+        if i % chunk == 0:
+            sketch.update(batch)
+            batch = Counter()
+    sketch.update(batch)
+    return sketch.top(k)
@@ -20,6 +20,21 @@ const apiGet  = (p)=>fetchJSON(API_BASE+p,{headers:{}})
 const apiPostJSON=(p,body)=>fetchJSON(API_BASE+p,{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify(body)})
 const apiUpload=(p,form)=>fetchJSON(API_BASE+p,{method:'POST',body:form})
 
+const sleep = (ms)=>new Promise(r=>setTimeout(r, ms))
+const JOB_STAGES = { queued:'в очереди', parsing:'разбор файлов', done:'готово', error:'ошибка' }
+
+// Upload runs as a background job on the backend; poll until it finishes
+async function uploadAndWait(form, onProgress){
+  const { job_id } = await apiUpload('/appeals/upload?job=1', form)
+  for(;;){
+    const job = await apiGet('/appeals/jobs/'+job_id)
+    onProgress(job)
+    if (job.status==='done') return job
+    if (job.status==='error') throw new Error(job.error || 'Ошибка обработки')
+    await sleep(1000)
+  }
+}
+
 function ErrorNote({error}){ if(!error) return null; return <div className="badge err" style={{display:'block'}}>{String(error.message||error)}</div> }
 
 const MUNICIPALITIES_FALLBACK = [
@@ -46,27 +61,51 @@ export default function App(){
   const [mId, setMId] = useState(1)
   const [files, setFiles] = useState([])
   const [uploadRes, setUploadRes] = useState(null)
+  const [appeals, setAppeals] = useState({items:[], next_cursor:null})
   const [analytics, setAnalytics] = useState(null)
+  const [period, setPeriod] = useState({date_from:'', date_to:'', granularity:'auto'})
   const [plans, setPlans] = useState([])
   const [loading, setLoading] = useState(false)
+  const [job, setJob] = useState(null)
   const [error, setError] = useState(null)
 
+  const analyticsUrl = ()=>{
+    const q = new URLSearchParams({municipality_id: String(mId), granularity: period.granularity})
+    if(period.date_from) q.set('date_from', period.date_from)
+    if(period.date_to) q.set('date_to', period.date_to)
+    return '/appeals/analytics?'+q.toString()
+  }
+
   useEffect(()=>{ (async()=>{
     try{ const data = await apiGet('/appeals/municipalities'); setMunicipalities(data.items||MUNICIPALITIES_FALLBACK) }catch(e){ /* fallback */ }
-    try{ const a = await apiGet('/appeals/analytics?municipality_id='+mId); setAnalytics(a) }catch(e){}
     try{ const p = await apiGet('/appeals/plans?municipality_id='+mId); setPlans(p.items||[]) }catch(e){}
   })() }, [mId])
 
+  useEffect(()=>{ (async()=>{
+    try{ const a = await apiGet(analyticsUrl()); setAnalytics(a) }catch(e){}
+  })() }, [mId, period])
+
+  // stored appeals, newest first; the next page continues from next_cursor
+  const APPEAL_FIELDS = 'source,date,address,text,category,lat,lng'
+  const loadAppeals = async (cursor)=>{
+    const q = new URLSearchParams({municipality_id: String(mId), fields: APPEAL_FIELDS, limit: '50'})
+    if(cursor) q.set('cursor', cursor)
+    const page = await apiGet('/appeals?'+q.toString())
+    setAppeals(prev=>({items: cursor? [...prev.items, ...page.items] : page.items, next_cursor: page.next_cursor}))
+  }
+  useEffect(()=>{ loadAppeals().catch(()=>{}) }, [mId])
+
   const handleUpload = async ()=>{
     setLoading(true); setError(null)
     const form = new FormData()
     files.forEach(f=>form.append('files', f))
     form.append('municipality_id', String(mId))
     try{
-      const res = await apiUpload('/appeals/upload', form)
+      const res = await uploadAndWait(form, setJob)
       setUploadRes(res)
-      const a = await apiGet('/appeals/analytics?municipality_id='+mId); setAnalytics(a)
-    }catch(e){ setError(e) }finally{ setLoading(false) }
+      const a = await apiGet(analyticsUrl()); setAnalytics(a)
+      await loadAppeals()
+    }catch(e){ setError(e) }finally{ setLoading(false); setJob(null) }
   }
 
   const handleGeneratePlan = async (category)=>{
@@ -78,6 +117,15 @@ export default function App(){
     }catch(e){ setError(e) }finally{ setLoading(false) }
   }
 
+  const handleGenerateAllPlans = async ()=>{
+    setLoading(true); setError(null)
+    try{
+      await apiPostJSON('/appeals/generate-plans', { municipality_id: mId })
+      const refreshed = await apiGet('/appeals/plans?municipality_id='+mId)
+      setPlans(refreshed.items||[])
+    }catch(e){ setError(e) }finally{ setLoading(false) }
+  }
+
   return <div className="container">
     <header className="row" style={{justifyContent:'space-between', marginBottom:16}}>
       <div className="row" style={{gap:10}}>
@@ -104,15 +152,19 @@ export default function App(){
         <button onClick={handleUpload} disabled={loading || files.length===0}>
           {loading? <><Loader2 size={16} className="spin"/> Обработка…</> : <>Обработать</>}
         </button>
+        {job && <span className="muted">{JOB_STAGES[job.stage]||job.stage} • файлы {job.files_done}/{job.files_total} • строк {job.rows}</span>}
         {uploadRes?.export_url && <a className="badge" href={absApiUrlMaybe(uploadRes.export_url)} target="_blank"><FileSpreadsheet size={14}/> Скачать объединённый Excel</a>}
       </div>
-      {uploadRes?.items?.length>0 && <div style={{marginTop:12, maxHeight:280, overflow:'auto'}}>
+      {uploadRes && <div className="muted" style={{marginTop:8}}>
+        Обработано обращений: {uploadRes.rows}{uploadRes.by_category && ' — '+Object.entries(uploadRes.by_category).map(([c,n])=>c+': '+n).join(', ')}
+      </div>}
+      {appeals.items.length>0 && <div style={{marginTop:12, maxHeight:280, overflow:'auto'}}>
         <table>
           <thead><tr>
             <th>Источник</th><th>Дата</th><th>Адрес</th><th>Текст</th><th>Категория</th><th>Геометка</th>
           </tr></thead>
           <tbody>
-            {uploadRes.items.map((r,i)=>(<tr key={i}>
+            {appeals.items.map(r=>(<tr key={r.id}>
               <td className="mono">{r.source}</td>
               <td>{r.date||''}</td>
               <td>{r.address||''}</td>
@@ -122,11 +174,19 @@ export default function App(){
             </tr>))}
           </tbody>
         </table>
+        {appeals.next_cursor && <button style={{marginTop:8}} onClick={()=>loadAppeals(appeals.next_cursor).catch(setError)}>Показать ещё</button>}
       </div>}
     </section>
 
     <section className="panel" style={{marginBottom:16}}>
-      <div className="row" style={{gap:8}}><BarChart3 size={18}/> <b>Аналитика обращений</b></div>
+      <div className="row" style={{gap:8, flexWrap:'wrap'}}><BarChart3 size={18}/> <b>Аналитика обращений</b>
+        <span className="muted">с</span><input type="date" value={period.date_from} onChange={e=>setPeriod({...period, date_from:e.target.value})}/>
+        <span className="muted">по</span><input type="date" value={period.date_to} onChange={e=>setPeriod({...period, date_to:e.target.value})}/>
+        <select value={period.granularity} onChange={e=>setPeriod({...period, granularity:e.target.value})}>
+          <option value="auto">авто</option><option value="day">по дням</option><option value="week">по неделям</option><option value="month">по месяцам</option>
+        </select>
+        {analytics?.truncated && <span className="muted">показаны последние {analytics.by_date.length} точек</span>}
+      </div>
       {analytics? <div className="row" style={{gap:24, marginTop:12, flexWrap:'wrap'}}>
         <div style={{width:360, height:260}}>
           <ResponsiveContainer width="100%" height="100%">
@@ -148,6 +208,7 @@ export default function App(){
       <div className="row" style={{gap:6, flexWrap:'wrap', marginTop:8}}>
         {['Благоустройство','Окружающая среда','Доступность цифровых услуг','Дороги','Образование','Культура','Здравоохранение','Транспортное обслуживание','ЖКХ','Адаптация участников СВО','Политическое доверие']
           .map(cat=>(<button key={cat} onClick={()=>handleGeneratePlan(cat)} disabled={loading}>{cat}</button>))}
+        <button onClick={handleGenerateAllPlans} disabled={loading}><b>Все категории</b></button>
       </div>
       <div style={{marginTop:10}}>
         {plans?.map((p,i)=>(<div key={i} className="row" style={{justifyContent:'space-between', borderBottom:'1px solid var(--border)', padding:'8px 0'}}>